@@ -1,18 +1,22 @@
+import itertools
+import math
 import os
-from typing import Dict, Any, List
-from llama_index.core import StorageContext, load_index_from_storage
+from sqlite3 import Connection
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 from llama_index.core.indices import VectorStoreIndex
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core.indices import VectorStoreIndex
-from llama_index.core.node_parser import SimpleNodeParser
-from llama_index.core.schema import TextNode
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
 #from llama_index.llms import OpenAI
 from datasets.arrow_dataset import Dataset
 import chromadb
 
-from eval_scripts.utils import chunk_documents
-from packages.scripts.src.eval_scripts.generator import AbstractGenerator
+from eval_scripts.utils import iter_chunked_documents
+from eval_scripts.database import embed_nodes
+from eval_scripts.llama_embedding import EncoderEmbedding
+from eval_scripts.llm_cache import cached_llama_llm
+from eval_scripts.generator import AbstractGenerator
 
 
 from logging import getLogger
@@ -21,65 +25,126 @@ logger = getLogger(__name__)
 
 COLLECTION_NAME = "quickstart"
 PERSIST_DIR = "./storage"
+BATCH_SIZE = 500
+SIMILARITY_TOP_K = 3
+# Chroma metadata key holding the llama_index hash of a node's text and metadata
+HASH_KEY = "node_hash"
+
+
+def collection_name(datasource_id: Optional[int] = None) -> str:
+    return f"datasource-{datasource_id}" if datasource_id is not None else COLLECTION_NAME
+
 
 class LlamaIndex(AbstractGenerator):
+    """ Query engine over a persistent Chroma collection per datasource.
 
-    def __init__(self, nodes: List[Dataset]):
+    Building it compares the nodes with the ids and hashes stored in the collection: only new and
+    changed nodes are embedded (reusing the embeddings table when a db is given) and upserted, and
+    ids that are gone are deleted, so an unchanged index opens without embedding or writing anything.
+    nodes may be a stream such as iter_documents; it is read BATCH_SIZE nodes at a time.
+    """
+
+    def __init__(self, nodes: Iterable[TextNode], datasource_id: Optional[int] = None, db: Optional[Connection] = None, persist_dir: str = PERSIST_DIR):
         logger.info("Building llama_index query engine")
 
         # Split documents that are longer than 8192 tokens
-        nodes = chunk_documents(nodes)
+        nodes = iter_chunked_documents(nodes)
 
-        # Create a new index
-        # vector_store = SimpleVectorStore()
-        # create client and a new collection
-        chroma_client = chromadb.EphemeralClient()
-        try:
-            chroma_collection = chroma_client.get_collection(COLLECTION_NAME)
-            logger.info(f"Collection {COLLECTION_NAME} already exists")
-        except Exception as e:
-            chroma_collection = chroma_client.create_collection(COLLECTION_NAME)
-            logger.info(f"Created collection {COLLECTION_NAME}")
-
-        # Save nodes to collection
-        logger.info("Saving nodes to collection")
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        # Batch add
-        BATCH_SIZE = 500
-        for i in range(0, len(nodes), BATCH_SIZE):
-            vector_store.add(nodes[i:i+BATCH_SIZE])
-
-        # Create embedding model
-        embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-        #Create a new index
-        logger.info("Building index")
-        vector_index = VectorStoreIndex(
-            nodes=nodes,
-            vector_store=vector_store,
-            node_parser=SimpleNodeParser(),
-            embed_model=embed_model
-        )
+        chroma_client = chromadb.PersistentClient(path=persist_dir)
+        chroma_collection = chroma_client.get_or_create_collection(collection_name(datasource_id))
+        sync_collection(db, chroma_collection, nodes)
 
-        # Persist the index
-        logger.info("Persisting index")
-        vector_index.storage_context.persist(persist_dir=PERSIST_DIR)
+        self.chroma_collection = chroma_collection
+        self.embed_model = EncoderEmbedding()
+        self.query_engine = build_query_engine(chroma_collection, self.embed_model)
 
-        #llm = OpenAI(model="gpt-4o-mini")
-        self.query_engine = vector_index.as_query_engine(similarity_top_k=3)
-
-
-    def load_query_engine(persist_dir=PERSIST_DIR):
+    @staticmethod
+    def load_query_engine(datasource_id: Optional[int] = None, persist_dir: str = PERSIST_DIR):
+        """ Opens the query engine of an index built earlier, or returns None when there is none. """
         logger.info("Loading query engine")
-        if os.path.exists(persist_dir):
-            chroma_client = chromadb.EphemeralClient()
-            chroma_collection = chroma_client.get_collection("quickstart")
-            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-            storage_context = StorageContext.from_defaults(vector_store=vector_store, persist_dir=persist_dir)
-            vector_index = load_index_from_storage(storage_context)
-            return vector_index.as_query_engine(similarity_top_k=3)
-        else:
+        if not os.path.exists(persist_dir):
+            return None
+        chroma_client = chromadb.PersistentClient(path=persist_dir)
+        try:
+            chroma_collection = chroma_client.get_collection(collection_name(datasource_id))
+        except Exception:
             return None
+        return build_query_engine(chroma_collection)
 
     def query(self, query: str) -> List[Dict[str, Any]]:
-        return self.query_engine.query(query)
\ No newline at end of file
+        return self.query_engine.query(query)
+
+    def query_batch(self, queries: List[str]) -> List[RESPONSE_TYPE]:
+        """ Embeds all queries in one encoder call and searches them in one collection query, then synthesizes each response. """
+        if not queries:
+            return []
+        embeddings = self.embed_model.encoder.encode(queries).tolist()
+        results = self.chroma_collection.query(query_embeddings=embeddings, n_results=SIMILARITY_TOP_K, include=["metadatas", "documents", "distances"])
+        responses = []
+        for i, query in enumerate(queries):
+            nodes = []
+            for metadata, text, distance in zip(results["metadatas"][i], results["documents"][i], results["distances"][i]):
+                node = metadata_dict_to_node(metadata)
+                node.set_content(text)
+                # Same distance to similarity conversion as ChromaVectorStore
+                nodes.append(NodeWithScore(node=node, score=math.exp(-distance)))
+            responses.append(self.query_engine.synthesize(QueryBundle(query, embedding=embeddings[i]), nodes))
+        return responses
+
+
+def build_query_engine(chroma_collection, embed_model: Optional[EncoderEmbedding] = None):
+    # The index reads the collection as it is; nodes are written only by sync_collection
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    vector_index = VectorStoreIndex.from_vector_store(vector_store, embed_model=embed_model or EncoderEmbedding())
+    #llm = OpenAI(model="gpt-4o-mini")
+    return vector_index.as_query_engine(similarity_top_k=SIMILARITY_TOP_K, llm=cached_llama_llm())
+
+
+def stored_hashes(chroma_collection) -> Dict[str, Optional[str]]:
+    """ Returns the node hash stored with every id of the collection. """
+    hashes = {}
+    offset = 0
+    while True:
+        result = chroma_collection.get(include=["metadatas"], limit=10000, offset=offset)
+        hashes.update((id, (metadata or {}).get(HASH_KEY)) for id, metadata in zip(result["ids"], result["metadatas"]))
+        if len(result["ids"]) < 10000:
+            return hashes
+        offset += len(result["ids"])
+
+
+def batched(nodes: Iterable[TextNode], size: int) -> Iterator[List[TextNode]]:
+    nodes = iter(nodes)
+    while batch := list(itertools.islice(nodes, size)):
+        yield batch
+
+
+def sync_collection(db: Optional[Connection], chroma_collection, nodes: Iterable[TextNode]):
+    """ Upserts the nodes whose id or hash is not in the collection yet, a batch at a time as they are read, then deletes the ids that are no longer among the nodes. """
+    stored = stored_hashes(chroma_collection)
+    seen = set()
+    unchanged = upserted = 0
+    for nodes_batch in batched(nodes, BATCH_SIZE):
+        batch_by_id = {node.id_: node for node in nodes_batch if node.id_ not in seen}
+        seen.update(batch_by_id)
+        batch = [node for node in batch_by_id.values() if stored.get(node.id_) != node.hash]
+        unchanged += len(batch_by_id) - len(batch)
+        if not batch:
+            continue
+        embed_nodes(db, batch, changed_ids={node.id_ for node in batch if node.id_ in stored})
+        metadatas = []
+        for node in batch:
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+            metadata[HASH_KEY] = node.hash
+            metadatas.append(metadata)
+        chroma_collection.upsert(
+            ids=[node.id_ for node in batch],
+            embeddings=[node.embedding for node in batch],
+            metadatas=metadatas,
+            documents=[node.get_content(metadata_mode=MetadataMode.NONE) for node in batch],
+        )
+        upserted += len(batch)
+
+    stale = [id for id in stored if id not in seen]
+    logger.info(f"Collection {chroma_collection.name}: {unchanged} unchanged, {upserted} upserted, {len(stale)} to delete")
+    for i in range(0, len(stale), BATCH_SIZE):
+        chroma_collection.delete(ids=stale[i:i+BATCH_SIZE])
@@ -8,7 +8,16 @@ from ragas import evaluate
 from datasets import Dataset
 import math
 
-def eval_ragas(test_function, questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[list[str]]):
+# Local metrics without LLM calls: cosine similarity of the MiniLM embeddings of the answer and the
+# contexts to the ground truth, scored thousands of rows per encoder call
+from eval_scripts.similarity_eval import eval_answer_similarity, eval_context_similarity
+from eval_scripts.metrics import eval_attributes
+
+# Eval functions take N rows and return N scores. Functions that share a `batch_evaluator` are scored
+# together by the eval_scripts.evaluation runner, which passes all of their `metric`s to one call.
+
+def eval_ragas_batch(metrics: list, questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[list[float]]:
+    """ Scores N rows with several ragas metrics in a single evaluate call; returns one list of N scores per metric, None where ragas failed. """
     dataset = Dataset.from_dict({
         'question': questions,
         'contexts': contexts,
@@ -17,28 +26,33 @@ def eval_ragas(test_function, questions: list[str], contexts: list[list[str]], a
     })
     result = evaluate(
         dataset,
-        metrics=[
-            test_function
-        ],
+        metrics=metrics,
     )
 
-    print(f">>> eval_rags > result = {result}")
-    res = next(iter(result.values()))
-    if math.isnan(res):
-        return 0.0
-    else:
-        return res
+    df = result.to_pandas()
+    return [[None if math.isnan(score) else float(score) for score in df[metric.name]] for metric in metrics]
+
+def eval_ragas(test_function, questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[float]:
+    return eval_ragas_batch([test_function], questions, contexts, answers, ground_truths)[0]
+
+def ragas_metric(metric):
+    """ Marks an eval function as a single ragas metric, so it can share an evaluate call with other ragas metrics. """
+    return eval_attributes(metric=metric, batch_evaluator=eval_ragas_batch)
 
-def eval_ragas_precision(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[list[str]])->float:
+@ragas_metric(context_precision)
+def eval_ragas_precision(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[float]:
     return eval_ragas(context_precision, questions, contexts, answers, ground_truths)
 
-def eval_ragas_recall(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[list[str]])->float:
+@ragas_metric(context_recall)
+def eval_ragas_recall(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[float]:
     return eval_ragas(context_recall, questions, contexts, answers, ground_truths)
 
-def eval_ragas_faithfulness(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[list[str]])->float:
+@ragas_metric(faithfulness)
+def eval_ragas_faithfulness(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[float]:
     return eval_ragas(faithfulness, questions, contexts, answers, ground_truths)
 
-def eval_ragas_answer_relevancy(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[list[str]])->float:
+@ragas_metric(answer_relevancy)
+def eval_ragas_answer_relevancy(questions: list[str], contexts: list[list[str]], answers: list[str], ground_truths: list[str]) -> list[float]:
     return eval_ragas(answer_relevancy, questions, contexts, answers, ground_truths)
 
-#Dataset[question: list[str], contexts: list[list[str]], answer: list[str], ground_truth: list[list[str]]]
+#Dataset[question: list[str], contexts: list[list[str]], answer: list[str], ground_truth: list[str]]
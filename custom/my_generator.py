@@ -1,6 +1,7 @@
-from typing import Dict, Any, List
+from sqlite3 import Connection
+from typing import Dict, Any, Iterable, List, Optional
 import os
-from datasets.arrow_dataset import Dataset
+from llama_index.core.schema import TextNode
 
 from custom.default_llama_index import LlamaIndex
 
@@ -8,6 +9,6 @@ from logging import getLogger
 logger = getLogger(__name__)
 
 
-def build_query_engine(nodes: List[Dataset]):
+def build_query_engine(nodes: Iterable[TextNode], datasource_id: Optional[int] = None, db: Optional[Connection] = None):
     """ Customize this function to return a query engine of your choice. The engine """
-    return LlamaIndex(nodes)
+    return LlamaIndex(nodes, datasource_id=datasource_id, db=db)
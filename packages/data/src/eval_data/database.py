@@ -0,0 +1,276 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterable, List, Sequence, Tuple
+from logging import getLogger
+
+from eval_data.models.embedding import pack_embedding, unpack_embedding
+from eval_data.registry import function_code_hash, pickled_reference, resolve_function
+from eval_data.models import (
+    DatasourceModel,
+    DocumentModel,
+    QASetModel,
+    QuestionModel,
+    QuestionSampleModel,
+    TestRunModel,
+    ResponseModel,
+    ContextModel,
+    EvalFunctionModel,
+    TestEvalConfigModel,
+    TestEvalModel,
+    ResponseEvalModel,
+    EmbeddingModel,
+    EvalMemoModel,
+    QuestionEmbeddingModel,
+)
+
+
+logger = getLogger(__name__)
+
+# Models in foreign key order, used to bootstrap the schema
+MODELS = [
+    DatasourceModel,
+    DocumentModel,
+    QASetModel,
+    QuestionModel,
+    QuestionSampleModel,
+    TestRunModel,
+    ResponseModel,
+    ContextModel,
+    EvalFunctionModel,
+    TestEvalConfigModel,
+    TestEvalModel,
+    ResponseEvalModel,
+    EmbeddingModel,
+    EvalMemoModel,
+    QuestionEmbeddingModel,
+]
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 64 * 1024
+
+
+class EvalConnection(sqlite3.Connection):
+    """ sqlite3 connection that remembers whether the schema has been bootstrapped, so models can skip their DDL. """
+    schema_ready = False
+
+
+def connect(path: str, read_only: bool = False, foreign_keys: bool = True, check_same_thread: bool = True) -> EvalConnection:
+    """ Opens a tuned connection to the experiment database.
+
+    A writer connection switches the database to WAL and creates the schema once. A read-only
+    connection is meant for analytics and can run alongside a writer without blocking it.
+    """
+    if read_only:
+        db = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, factory=EvalConnection, check_same_thread=check_same_thread)
+        db.execute('PRAGMA query_only = ON')
+    else:
+        db = sqlite3.connect(path, factory=EvalConnection, check_same_thread=check_same_thread)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+
+    db.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    db.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    db.execute(f'PRAGMA foreign_keys = {"ON" if foreign_keys else "OFF"}')
+
+    if not read_only:
+        create_schema(db)
+        migrate(db)
+    db.schema_ready = True
+    return db
+
+
+def create_schema(db: sqlite3.Connection):
+    """ Creates every table used by the eval_data models. Models run their DDL while the connection is not yet marked schema_ready. """
+    logger.info("Bootstrapping eval_data schema")
+    with db:
+        for model in MODELS:
+            model(db)
+
+
+def migrate(db: sqlite3.Connection):
+    """ Applies pending schema migrations, tracking the applied version in PRAGMA user_version. """
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+
+    # Table rebuilds drop tables that others reference, so foreign keys are off while migrating
+    db.commit()
+    foreign_keys = db.execute('PRAGMA foreign_keys').fetchone()[0]
+    db.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying schema migration {target}: {migration.__doc__.strip()}")
+            with db:
+                db.execute('BEGIN')
+                migration(db)
+                db.execute(f'PRAGMA user_version = {target}')
+    finally:
+        db.execute(f'PRAGMA foreign_keys = {foreign_keys}')
+
+
+def query_plan(db: sqlite3.Connection, sql: str, params: Sequence = ()) -> List[str]:
+    """ Returns the EXPLAIN QUERY PLAN details for a statement, e.g. to check that it does not fall back to a table SCAN. """
+    return [row[3] for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def _dedupe(db: sqlite3.Connection, table: str, key_columns: Iterable[str], references: Iterable[Tuple[str, str]] = ()):
+    """ Merges rows that are exact copies of an older row, re-pointing the given (table, column) references to the row that is kept.
+
+    Rows that share the natural key but differ in any column other than id and timestamps are
+    left alone and abort the migration with a report of the conflicting ids.
+    """
+    keys = ', '.join(key_columns)
+    content_columns = [row[1] for row in db.execute(f'PRAGMA table_info({table})') if row[1] not in ('id', 'timestamp', 'created_at')]
+    content = ', '.join(content_columns)
+    join = ' AND '.join(f't.{c} IS k.{c}' for c in content_columns)
+    duplicates = db.execute(f'''SELECT t.id, k.keep_id FROM {table} t
+                               JOIN (SELECT {content}, MIN(id) AS keep_id FROM {table} GROUP BY {content} HAVING COUNT(*) > 1) k
+                               ON {join} AND t.id <> k.keep_id''').fetchall()
+    if duplicates:
+        logger.warning(f"Merging {len(duplicates)} duplicate rows in {table}")
+        for ref_table, ref_column in references:
+            db.executemany(f'UPDATE {ref_table} SET {ref_column} = ? WHERE {ref_column} = ?', [(keep_id, id) for id, keep_id in duplicates])
+        db.executemany(f'DELETE FROM {table} WHERE id = ?', [(id,) for id, _ in duplicates])
+
+    conflicts = db.execute(f'''SELECT {keys}, group_concat(id) FROM {table}
+                              GROUP BY {keys} HAVING COUNT(*) > 1''').fetchall()
+    if conflicts:
+        report = '\n'.join(f"  ({', '.join(map(repr, row[:-1]))}): ids {row[-1]}" for row in conflicts[:20])
+        raise RuntimeError(f"{len(conflicts)} ({keys}) values of {table} are shared by rows with different contents; "
+                           f"resolve them before migrating:\n{report}")
+
+
+def _add_lookup_indexes(db: sqlite3.Connection):
+    """ Add lookup indexes and natural key uniqueness """
+    _dedupe(db, 'datasources', ['name'], [('documents', 'datasource_id'), ('qasets', 'datasource_id'), ('test_runs', 'datasource_id')])
+    _dedupe(db, 'documents', ['name'], [('qasets', 'document_id'), ('questions', 'document_id')])
+    _dedupe(db, 'qasets', ['name'], [('questions', 'qaset_id')])
+    _dedupe(db, 'questions', ['qaset_id', 'question'], [('responses', 'question_id'), ('response_evals', 'question_id')])
+    _dedupe(db, 'response_evals', ['response_id', 'test_eval_config_id'])
+
+    for statement in [
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_datasources_name ON datasources(name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_documents_name ON documents(name)',
+        'CREATE INDEX IF NOT EXISTS ix_documents_datasource_id ON documents(datasource_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_qasets_name ON qasets(name)',
+        'CREATE INDEX IF NOT EXISTS ix_qasets_datasource_id ON qasets(datasource_id)',
+        'CREATE INDEX IF NOT EXISTS ix_qasets_document_id ON qasets(document_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_questions_qaset_id_question ON questions(qaset_id, question)',
+        'CREATE INDEX IF NOT EXISTS ix_questions_document_id ON questions(document_id)',
+        'CREATE INDEX IF NOT EXISTS ix_test_runs_datasource_id ON test_runs(datasource_id)',
+        'CREATE INDEX IF NOT EXISTS ix_test_runs_description ON test_runs(description)',
+        'CREATE INDEX IF NOT EXISTS ix_responses_test_run_id_question_id ON responses(test_run_id, question_id)',
+        'CREATE INDEX IF NOT EXISTS ix_responses_question_id ON responses(question_id)',
+        'CREATE INDEX IF NOT EXISTS ix_contexts_response_id_sort_index ON contexts(response_id, sort_index)',
+        'CREATE INDEX IF NOT EXISTS ix_eval_functions_name ON eval_functions(name)',
+        'CREATE INDEX IF NOT EXISTS ix_test_eval_configs_test_run_id ON test_eval_configs(test_run_id, eval_function_id)',
+        'CREATE INDEX IF NOT EXISTS ix_test_evals_test_run_id ON test_evals(test_run_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_response_evals_response_id_config_id ON response_evals(response_id, test_eval_config_id)',
+        'CREATE INDEX IF NOT EXISTS ix_response_evals_test_run_id ON response_evals(test_run_id, response_id)',
+        'CREATE INDEX IF NOT EXISTS ix_response_evals_question_id ON response_evals(question_id)',
+        'CREATE INDEX IF NOT EXISTS ix_response_evals_test_eval_config_id ON response_evals(test_eval_config_id)',
+    ]:
+        db.execute(statement)
+
+
+def _pack_embeddings(db: sqlite3.Connection):
+    """ Store embeddings as packed float32 blobs instead of JSON text """
+    db.execute('''CREATE TABLE embeddings_packed (
+                    id TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL
+                )''')
+    cursor = db.execute('SELECT id, embedding FROM embeddings')
+    while rows := cursor.fetchmany(10000):
+        db.executemany('INSERT INTO embeddings_packed (id, embedding) VALUES (?, ?)',
+                       [(id, pack_embedding(unpack_embedding(embedding))) for id, embedding in rows])
+    db.execute('DROP TABLE embeddings')
+    db.execute('ALTER TABLE embeddings_packed RENAME TO embeddings')
+
+
+def _reference_eval_functions(db: sqlite3.Connection):
+    """ Store eval functions as import references with a code hash instead of pickles """
+    db.execute('''CREATE TABLE eval_functions_referenced (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    eval_function BLOB,
+                    reference TEXT,
+                    code_hash TEXT
+                )''')
+    rows = []
+    for id, name, description, data in db.execute('SELECT id, name, description, eval_function FROM eval_functions').fetchall():
+        if reference := pickled_reference(data):
+            try:
+                code_hash = function_code_hash(resolve_function(reference))
+            except Exception as e:
+                # Hashed by EvalFunctionModel on the first load that resolves it
+                logger.warning(f"Eval function {name} cannot be imported yet ({e}); its code hash is left unset")
+                code_hash = None
+            rows.append((id, name, description, None, reference, code_hash))
+        else:
+            logger.warning(f"Eval function {name} is not a plain function reference; keeping its pickle")
+            rows.append((id, name, description, data, None, None))
+    db.executemany('''INSERT INTO eval_functions_referenced (id, name, description, eval_function, reference, code_hash)
+                      VALUES (?, ?, ?, ?, ?, ?)''', rows)
+    db.execute('DROP TABLE eval_functions')
+    db.execute('ALTER TABLE eval_functions_referenced RENAME TO eval_functions')
+    db.execute('CREATE INDEX IF NOT EXISTS ix_eval_functions_name ON eval_functions(name)')
+
+
+def _add_column(db: sqlite3.Connection, table: str, column: str, declaration: str):
+    """ Adds a column unless the table was created with it already. """
+    if column not in {row[1] for row in db.execute(f'PRAGMA table_info({table})')}:
+        db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+
+def _add_document_file_state(db: sqlite3.Connection):
+    """ Record the content hash and mtime of file documents """
+    _add_column(db, 'documents', 'content_hash', 'TEXT')
+    _add_column(db, 'documents', 'mtime', 'REAL')
+    db.execute('CREATE INDEX IF NOT EXISTS ix_documents_location ON documents(location)')
+
+
+def _add_retrieval_ids(db: sqlite3.Connection):
+    """ Record the node ids of retrieved contexts and the gold ids of questions """
+    _add_column(db, 'contexts', 'node_id', 'TEXT')
+    _add_column(db, 'questions', 'relevant_ids', 'TEXT')
+
+
+def _add_eval_config_stats(db: sqlite3.Connection):
+    """ Record the score mean and confidence interval reached by each test eval config """
+    _add_column(db, 'test_eval_configs', 'score_mean', 'REAL')
+    _add_column(db, 'test_eval_configs', 'ci_half_width', 'REAL')
+    _add_column(db, 'test_eval_configs', 'sample_count', 'INTEGER')
+
+
+def _add_test_run_question_sample(db: sqlite3.Connection):
+    """ Let test runs target a question sample """
+    _add_column(db, 'test_runs', 'question_sample_id', 'INTEGER REFERENCES question_samples(id)')
+
+
+def _scope_document_names(db: sqlite3.Connection):
+    """ Make document names unique per datasource instead of globally """
+    db.execute('DROP INDEX IF EXISTS ux_documents_name')
+    # Covered by the leading column of the unique index
+    db.execute('DROP INDEX IF EXISTS ix_documents_datasource_id')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_documents_datasource_id_name ON documents(datasource_id, name)')
+    db.execute('CREATE INDEX IF NOT EXISTS ix_documents_name ON documents(name)')
+
+
+def _add_embedding_node_hashes(db: sqlite3.Connection):
+    """ Record the hash of the node each embedding was computed from """
+    _add_column(db, 'embeddings', 'node_hash', 'TEXT')
+
+
+# Schema migrations, applied in order; a database at user_version N has the first N applied
+MIGRATIONS = [
+    _add_lookup_indexes,
+    _pack_embeddings,
+    _reference_eval_functions,
+    _add_document_file_state,
+    _add_retrieval_ids,
+    _add_eval_config_stats,
+    _add_test_run_question_sample,
+    _scope_document_names,
+    _add_embedding_node_hashes,
+]
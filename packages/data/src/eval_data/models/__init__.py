@@ -9,4 +9,7 @@ from .testevalconfig import TestEvalConfigModel, TestEvalConfigType
 from .testrun import TestRunModel, TestRunType
 from .context import ContextModel, ContextType
 from .evalfunction import EvalFunctionModel, EvalFunctionType
-from .embedding import EmbeddingModel, EmbeddingType
\ No newline at end of file
+from .embedding import EmbeddingModel, EmbeddingType
+from .evalmemo import EvalMemoModel, EvalMemoType
+from .questionsample import QuestionSampleModel, QuestionSampleType
+from .questionembedding import QuestionEmbeddingModel, QuestionEmbeddingType
@@ -1,11 +1,16 @@
+from typing import List, Optional
+
+from .utils import insert_many, schema_ready
+
 class ContextType:
     """ Represents a context associated with a response. """
-    def __init__(self, response_id: int, text: str, similarity_score: float, sort_index: int = None, id: int = None):
+    def __init__(self, response_id: int, text: str, similarity_score: float, sort_index: int = None, id: int = None, node_id: Optional[str] = None):
         self.id = id
         self.response_id = response_id
         self.text = text
         self.similarity_score = similarity_score
         self.sort_index = sort_index or 0
+        self.node_id = node_id
 
     def to_dict(self):
         """ Converts the context object to a dictionary. """
@@ -14,7 +19,8 @@ class ContextType:
             'response_id': self.response_id,
             'text': self.text,
             'similarity_score': self.similarity_score,
-            'sort_index': self.sort_index
+            'sort_index': self.sort_index,
+            'node_id': self.node_id
         }
 
     @staticmethod
@@ -25,7 +31,8 @@ class ContextType:
             response_id=data.get('response_id'),
             text=data.get('text'),
             similarity_score=data.get('similarity_score'),
-            sort_index=data.get('sort_index', 0)  # Default sort_index to 0 if not provided
+            sort_index=data.get('sort_index', 0),  # Default sort_index to 0 if not provided
+            node_id=data.get('node_id')
         )
     
     @staticmethod
@@ -38,14 +45,16 @@ class ContextType:
             response_id=data[1],
             text=data[2],
             similarity_score=data[3],
-            sort_index=data[4]
+            sort_index=data[4],
+            node_id=data[5]
         )
 
 class ContextModel:
     """ Handles database operations for context data. """
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         """ Creates the contexts table in the database if it does not exist. """
@@ -55,16 +64,22 @@ class ContextModel:
                             text TEXT NOT NULL,
                             similarity_score REAL NOT NULL,
                             sort_index INTEGER NOT NULL,
+                            node_id TEXT,
                             FOREIGN KEY(response_id) REFERENCES responses(id)
                         )''')
 
     def add_context(self, context: ContextType):
         """ Adds a new context to the database. """
         with self.db:
-            cursor = self.db.execute('''INSERT INTO contexts (response_id, text, similarity_score, sort_index)
-                                        VALUES (?, ?, ?, ?)''', (context.response_id, context.text, context.similarity_score, context.sort_index))
+            cursor = self.db.execute('''INSERT INTO contexts (response_id, text, similarity_score, sort_index, node_id)
+                                        VALUES (?, ?, ?, ?, ?)''', (context.response_id, context.text, context.similarity_score, context.sort_index, context.node_id))
             return cursor.lastrowid
 
+    def add_contexts(self, contexts: List[ContextType], autocommit: bool = True) -> List[int]:
+        """ Adds several contexts to the database in a single transaction and returns their IDs. autocommit=False leaves the commit to the caller. """
+        return insert_many(self.db, '''INSERT INTO contexts (response_id, text, similarity_score, sort_index, node_id)
+                                    VALUES (?, ?, ?, ?, ?)''', [(c.response_id, c.text, c.similarity_score, c.sort_index, c.node_id) for c in contexts], autocommit)
+
     def get_contexts_by_response_id(self, response_id):
         """ Retrieves all contexts from the database by response ID. """
         cursor = self.db.execute('SELECT * FROM contexts WHERE response_id = ? ORDER BY sort_index', (response_id,))
@@ -1,4 +1,6 @@
-from typing import Optional
+from typing import Optional, List
+
+from .utils import insert_many, schema_ready
 
 class DatasourceType:
     id: Optional[int]
@@ -41,7 +43,8 @@ class DatasourceType:
 class DatasourceModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS datasources (
@@ -57,6 +60,10 @@ class DatasourceModel:
                                         VALUES (?, ?)''', (data.name, data.description))
             return cursor.lastrowid
 
+    def add_datasources(self, datasources: List[DatasourceType]) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO datasources (name, description)
+                                    VALUES (?, ?)''', [(d.name, d.description) for d in datasources])
+
     def add_or_get_datasource(self, data: DatasourceType):
         """Adds a new Datasource to the database if it does not exist, otherwise returns the existing record, matching by name."""
         existing_datasource = self.get_datasource_by_name( data.name )
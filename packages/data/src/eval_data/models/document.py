@@ -1,4 +1,7 @@
-from typing import Literal
+import json
+from typing import Dict, Iterable, Literal, List, Optional, Tuple
+
+from .utils import insert_many, schema_ready
 
 class DocumentType:
     id: int
@@ -8,8 +11,11 @@ class DocumentType:
     source: Literal["huggingface", "file"]
     col_text: str
     col_id: str
+    content_hash: Optional[str]
+    mtime: Optional[float]
 
-    def __init__(self, datasource_id: int, name: str, location: str, id: int = None, source: str = "huggingface", col_text: str = "", col_id: str = ""):
+    def __init__(self, datasource_id: int, name: str, location: str, id: int = None, source: str = "huggingface", col_text: str = "", col_id: str = "",
+                 content_hash: Optional[str] = None, mtime: Optional[float] = None):
         self.id = id
         self.datasource_id = datasource_id
         self.name = name
@@ -17,6 +23,8 @@ class DocumentType:
         self.source = source
         self.col_text = col_text
         self.col_id = col_id
+        self.content_hash = content_hash
+        self.mtime = mtime
 
     def to_dict(self):
         return {
@@ -26,7 +34,9 @@ class DocumentType:
             'location': self.location,
             'source': self.source,
             'col_text': self.col_text,
-            'col_id': self.col_id
+            'col_id': self.col_id,
+            'content_hash': self.content_hash,
+            'mtime': self.mtime
         }
 
     @staticmethod
@@ -38,7 +48,9 @@ class DocumentType:
             location=data.get('location'),
             source=data.get('source'),
             col_text=data.get('col_text'),
-            col_id=data.get('col_id')
+            col_id=data.get('col_id'),
+            content_hash=data.get('content_hash'),
+            mtime=data.get('mtime')
         )
     
     @staticmethod
@@ -52,13 +64,20 @@ class DocumentType:
             location=data[3],
             source=data[4],
             col_text=data[5],
-            col_id=data[6]
+            col_id=data[6],
+            content_hash=data[7],
+            mtime=data[8]
         )
 
+    def to_row(self) -> tuple:
+        """ Returns the column values in insert order, without the id. """
+        return (self.datasource_id, self.name, self.location, self.source, self.col_text, self.col_id, self.content_hash, self.mtime)
+
 class DocumentModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS documents (
@@ -69,17 +88,67 @@ class DocumentModel:
                             source TEXT NOT NULL,
                             col_text TEXT,
                             col_id TEXT,
+                            content_hash TEXT,
+                            mtime REAL,
                             FOREIGN KEY(datasource_id) REFERENCES datasources(id)
                         )''')
 
     def add_document(self, document: DocumentType):
         with self.db:
-            cursor = self.db.execute('''INSERT INTO documents (datasource_id, name, location, source, col_text, col_id)
-                                        VALUES (?, ?, ?, ?, ?, ?)''', (document.datasource_id, document.name, document.location, document.source, document.col_text, document.col_id))
+            cursor = self.db.execute('''INSERT INTO documents (datasource_id, name, location, source, col_text, col_id, content_hash, mtime)
+                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', document.to_row())
             return cursor.lastrowid
 
+    def add_documents(self, documents: List[DocumentType]) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO documents (datasource_id, name, location, source, col_text, col_id, content_hash, mtime)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', [d.to_row() for d in documents])
+
+    def upsert_documents(self, documents: List[DocumentType], autocommit: bool = True):
+        """ Adds documents or updates the ones whose name exists already in their datasource, in a single transaction.
+        With autocommit=False the rows join the caller's open transaction. """
+        if autocommit:
+            with self.db:
+                return self.upsert_documents(documents, autocommit=False)
+        self.db.executemany('''INSERT INTO documents (datasource_id, name, location, source, col_text, col_id, content_hash, mtime)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(datasource_id, name) DO UPDATE SET location = excluded.location,
+                               source = excluded.source, col_text = excluded.col_text, col_id = excluded.col_id,
+                               content_hash = excluded.content_hash, mtime = excluded.mtime''', [d.to_row() for d in documents])
+
+    def sync_file_documents(self, datasource_id: int, documents: List[DocumentType], locations: Iterable[str]) -> int:
+        """ Saves the pages of files that were read again and deletes the pages those files no longer have, in one transaction.
+
+        documents holds every page of the re-read files; locations lists these files and the ones that
+        are gone, whose pages are all deleted. Pages that QA sets or questions were generated from are
+        kept. Returns the number of deleted pages.
+        """
+        names: Dict[str, List[str]] = {location: [] for location in locations}
+        for document in documents:
+            names.setdefault(document.location, []).append(document.name)
+        with self.db:
+            self.upsert_documents(documents, autocommit=False)
+            cursor = self.db.executemany('''DELETE FROM documents
+                                            WHERE datasource_id = ? AND location = ? AND source = 'file'
+                                            AND name NOT IN (SELECT value FROM json_each(?))
+                                            AND NOT EXISTS (SELECT 1 FROM qasets WHERE qasets.document_id = documents.id)
+                                            AND NOT EXISTS (SELECT 1 FROM questions WHERE questions.document_id = documents.id)''',
+                                         [(datasource_id, location, json.dumps(location_names)) for location, location_names in names.items()])
+            return cursor.rowcount
+
+    def get_file_states(self, datasource_id: int) -> Dict[str, Tuple[Optional[str], Optional[float]]]:
+        """ Returns the (content_hash, mtime) recorded for each file location of a datasource. """
+        cursor = self.db.execute('''SELECT location, content_hash, mtime FROM documents
+                                    WHERE datasource_id = ? AND source = 'file' ''', (datasource_id,))
+        return {location: (content_hash, mtime) for location, content_hash, mtime in cursor.fetchall()}
+
+    def update_file_mtimes(self, datasource_id: int, mtimes: Dict[str, float]):
+        """ Records new modification times for files whose content did not change. """
+        with self.db:
+            self.db.executemany('''UPDATE documents SET mtime = ? WHERE datasource_id = ? AND location = ?''',
+                                [(mtime, datasource_id, location) for location, mtime in mtimes.items()])
+
     def upsert_document(self, document: DocumentType):
-        existing_document = self.get_document_by_name(document.name)
+        existing_document = self.get_document_by_name(document.name, document.datasource_id)
         if existing_document:
             document.id = existing_document.id
             self.update_document(document)
@@ -99,7 +168,7 @@ class DocumentModel:
 
     def update_document(self, doc: DocumentType):
         with self.db:
-            cursor = self.db.execute('''UPDATE documents SET datasource_id = ?, name = ?, location = ?, source = ?, col_text = ?, col_id = ? WHERE id = ?''', (doc.datasource_id, doc.name, doc.location, doc.source, doc.col_text, doc.col_id, doc.id))
+            cursor = self.db.execute('''UPDATE documents SET datasource_id = ?, name = ?, location = ?, source = ?, col_text = ?, col_id = ?, content_hash = ?, mtime = ? WHERE id = ?''', (*doc.to_row(), doc.id))
             return cursor.rowcount > 0
 
     def get_document_by_id(self, document_id):
@@ -109,7 +178,11 @@ class DocumentModel:
             return DocumentType.from_tuple(row)
         return None
 
-    def get_document_by_name(self, name):
-        cursor = self.db.execute('''SELECT * FROM documents WHERE name = ?''', (name,))
+    def get_document_by_name(self, name, datasource_id=None):
+        """ Retrieves a document by name, within one datasource when datasource_id is given. """
+        if datasource_id is not None:
+            cursor = self.db.execute('''SELECT * FROM documents WHERE datasource_id = ? AND name = ?''', (datasource_id, name))
+        else:
+            cursor = self.db.execute('''SELECT * FROM documents WHERE name = ?''', (name,))
         document = DocumentType.from_tuple(cursor.fetchone())
         return document
\ No newline at end of file
@@ -1,25 +1,46 @@
 import json
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .utils import schema_ready, variable_limit
+
+
+def pack_embedding(embedding: Union[Sequence[float], np.ndarray]) -> bytes:
+    """ Packs an embedding vector into the float32 blob stored in the embeddings table. """
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def unpack_embedding(data: Union[bytes, str]) -> np.ndarray:
+    """ Unpacks a stored embedding, accepting legacy JSON text rows that have not been migrated yet. """
+    if isinstance(data, str):
+        return np.asarray(json.loads(data), dtype=np.float32)
+    return np.frombuffer(data, dtype=np.float32)
+
 
 class EmbeddingType:
     id: str
     embedding: List[float]
+    node_hash: Optional[str]
 
-    def __init__(self, embedding: List[float], id: str = None):
+    def __init__(self, embedding: List[float], id: str = None, node_hash: Optional[str] = None):
         self.id = id
         self.embedding = embedding
+        self.node_hash = node_hash
 
     def to_dict(self):
         return {
             'id': self.id,
-            'embedding': self.embedding
+            'embedding': self.embedding,
+            'node_hash': self.node_hash
         }
 
     @staticmethod
     def from_dict(data: dict):
         return EmbeddingType(
             id=data.get('id'),
-            embedding=data.get('embedding')
+            embedding=data.get('embedding'),
+            node_hash=data.get('node_hash')
         )
 
     @staticmethod
@@ -28,26 +49,42 @@ class EmbeddingType:
             return None
         return EmbeddingType(
             id=data[0],
-            embedding=json.loads(data[1])
+            embedding=unpack_embedding(data[1]).tolist(),
+            node_hash=data[2]
         )
 
 class EmbeddingModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS embeddings (
                             id TEXT PRIMARY KEY,
-                            embedding TEXT NOT NULL
+                            embedding BLOB NOT NULL,
+                            node_hash TEXT
                         )''')
 
     def add_embedding(self, embedding: EmbeddingType):
         with self.db:
-            cursor = self.db.execute('''INSERT INTO embeddings (id, embedding)
-                                        VALUES (?, ?)''', (embedding.id, json.dumps(embedding.embedding),))
+            cursor = self.db.execute('''INSERT INTO embeddings (id, embedding, node_hash)
+                                        VALUES (?, ?, ?)''', (embedding.id, pack_embedding(embedding.embedding), embedding.node_hash))
             return cursor.lastrowid
 
+    def add_embeddings(self, embeddings: List[EmbeddingType]) -> List[str]:
+        with self.db:
+            self.db.executemany('''INSERT INTO embeddings (id, embedding, node_hash)
+                                   VALUES (?, ?, ?)''', [(e.id, pack_embedding(e.embedding), e.node_hash) for e in embeddings])
+        return [e.id for e in embeddings]
+
+    def upsert_embeddings(self, embeddings: List[EmbeddingType]) -> List[str]:
+        """ Adds embeddings or replaces the stored ones with the same ids, in a single transaction. """
+        with self.db:
+            self.db.executemany('''INSERT OR REPLACE INTO embeddings (id, embedding, node_hash)
+                                   VALUES (?, ?, ?)''', [(e.id, pack_embedding(e.embedding), e.node_hash) for e in embeddings])
+        return [e.id for e in embeddings]
+
     def get_embedding_by_id(self, embedding_id: int):
         cursor = self.db.execute('''SELECT * FROM embeddings WHERE id = ?''', (embedding_id,))
         row = cursor.fetchone()
@@ -57,8 +94,8 @@ class EmbeddingModel:
 
     def update_embedding(self, embedding: EmbeddingType):
         with self.db:
-            cursor = self.db.execute('''UPDATE embeddings SET embedding = ? WHERE id = ?''', 
-                                     (json.dumps(embedding.embedding), embedding.id))
+            cursor = self.db.execute('''UPDATE embeddings SET embedding = ?, node_hash = ? WHERE id = ?''', 
+                                     (pack_embedding(embedding.embedding), embedding.node_hash, embedding.id))
             return cursor.rowcount > 0
 
     def delete_embedding(self, embedding_id: int):
@@ -69,4 +106,48 @@ class EmbeddingModel:
     def get_all_embeddings(self):
         cursor = self.db.execute('''SELECT * FROM embeddings''')
         embeddings = [EmbeddingType.from_tuple(row) for row in cursor.fetchall()]
-        return embeddings
\ No newline at end of file
+        return embeddings
+
+    def find_embeddings(self, ids: Sequence[str], node_hashes: Optional[Dict[str, str]] = None) -> Dict[str, np.ndarray]:
+        """ Returns the stored embeddings for whichever of the given ids have one, keyed by id.
+        With node_hashes, an embedding is only returned when it was stored for the node hash given for its id. """
+        if node_hashes is None:
+            return {id: unpack_embedding(blob) for id, blob in self._fetch_blobs(ids).items()}
+        return {
+            id: unpack_embedding(blob)
+            for id, (blob, node_hash) in self._fetch_blobs(ids, with_hashes=True).items()
+            if node_hash is not None and node_hash == node_hashes.get(id)
+        }
+
+    def get_embeddings_by_ids(self, ids: Sequence[str]) -> np.ndarray:
+        """ Returns the embeddings for the given ids as one float32 matrix, in the order of the ids. """
+        blobs = self._fetch_blobs(ids)
+        if missing := [id for id in ids if id not in blobs]:
+            raise KeyError(f"No stored embedding for {len(missing)} ids, e.g. {missing[0]}")
+        return _stack([blobs[id] for id in ids])
+
+    def get_all_embeddings_matrix(self) -> Tuple[List[str], np.ndarray]:
+        """ Returns the ids of all stored embeddings and their vectors as one float32 matrix, row aligned with the ids. """
+        cursor = self.db.execute('''SELECT id, embedding FROM embeddings ORDER BY id''')
+        rows = cursor.fetchall()
+        return [row[0] for row in rows], _stack([row[1] for row in rows])
+
+    def _fetch_blobs(self, ids: Sequence[str], with_hashes: bool = False) -> Dict[str, Union[bytes, str, Tuple]]:
+        blobs = {}
+        ids = list(ids)
+        columns = 'embedding, node_hash' if with_hashes else 'embedding'
+        chunk_size = variable_limit(self.db)
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i+chunk_size]
+            cursor = self.db.execute(f'''SELECT id, {columns} FROM embeddings WHERE id IN ({', '.join('?' * len(chunk))})''', chunk)
+            blobs.update((row[0], row[1:] if with_hashes else row[1]) for row in cursor.fetchall())
+        return blobs
+
+
+def _stack(blobs: List[Union[bytes, str]]) -> np.ndarray:
+    """ Stacks stored embeddings into an (n, dim) float32 matrix without a per-row Python float conversion. """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    if any(isinstance(blob, str) for blob in blobs):
+        return np.vstack([unpack_embedding(blob) for blob in blobs])
+    return np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(blobs), -1)
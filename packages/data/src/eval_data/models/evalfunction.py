@@ -1,12 +1,26 @@
-import pickle
+from typing import Callable, List, Optional
+
+from eval_data.registry import (
+    database_key,
+    function_code_hash,
+    function_reference,
+    get_record,
+    invalidate,
+    load_function,
+    put_record,
+)
+
+from .utils import insert_many, schema_ready
 
 class EvalFunctionType:
     """ Represents an evaluation function. """
-    def __init__(self, name: str, description: str, eval_function: bytes, id: int=None):
+    def __init__(self, name: str, description: str, eval_function: Callable, id: int=None, reference: Optional[str] = None, code_hash: Optional[str] = None):
         self.id = id
         self.name = name
         self.description = description
         self.eval_function = eval_function
+        self.reference = reference
+        self.code_hash = code_hash
 
     def to_dict(self):
         """ Converts the eval function object to a dictionary. """
@@ -14,7 +28,9 @@ class EvalFunctionType:
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'eval_function': self.eval_function
+            'eval_function': self.eval_function,
+            'reference': self.reference,
+            'code_hash': self.code_hash
         }
 
     @staticmethod
@@ -24,24 +40,40 @@ class EvalFunctionType:
             id=data.get('id'),
             name=data.get('name'),
             description=data.get('description'),
-            eval_function=data.get('eval_function')
+            eval_function=data.get('eval_function'),
+            reference=data.get('reference'),
+            code_hash=data.get('code_hash')
         )
-    
+
     @staticmethod
     def from_tuple(data: tuple):
-        """ Creates an eval function object from a tuple. """
+        """ Creates an eval function object from a tuple, resolving the stored import reference. """
         return EvalFunctionType(
             id=data[0],
             name=data[1],
             description=data[2],
-            eval_function=pickle.loads(data[3])
+            eval_function=load_function(data[4], data[5], data[3]),
+            reference=data[4],
+            code_hash=data[5]
         )
 
+    def to_row(self) -> tuple:
+        """ Returns the (name, description, eval_function, reference, code_hash) column values; the function itself is stored as its import reference. """
+        return (self.name, self.description, None, self.reference, self.code_hash)
+
 class EvalFunctionModel:
-    """ Handles database operations for evaluation functions. """
+    """ Handles database operations for evaluation functions.
+
+    Functions are stored as module:qualname import references with a hash of their code. Each
+    function is imported once per process, and records fetched by id are cached until they are
+    updated or deleted through this model. References migrated without a code hash get one on
+    their first load.
+    """
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
+        self._key = None
 
     def create_table(self):
         """ Creates the eval_functions table in the database if it does not exist. """
@@ -49,33 +81,65 @@ class EvalFunctionModel:
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                             name TEXT NOT NULL,
                             description TEXT NOT NULL,
-                            eval_function BLOB NOT NULL
+                            eval_function BLOB,
+                            reference TEXT,
+                            code_hash TEXT
                         )''')
 
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            self._key = database_key(self.db)
+        return self._key
+
+    @staticmethod
+    def _reference(eval_function: EvalFunctionType) -> tuple:
+        """ Fills in the import reference and code hash of the function to be saved and returns its column values. """
+        eval_function.reference = function_reference(eval_function.eval_function)
+        eval_function.code_hash = function_code_hash(eval_function.eval_function)
+        return eval_function.to_row()
+
     def add_eval_function(self, eval_function: EvalFunctionType):
         """ Adds a new eval function to the database. """
-        serialized_blob = pickle.dumps(eval_function.eval_function)
         with self.db:
-            cursor = self.db.execute('''INSERT INTO eval_functions (name, description, eval_function)
-                                        VALUES (?, ?, ?)''', (eval_function.name, eval_function.description, serialized_blob))
+            cursor = self.db.execute('''INSERT INTO eval_functions (name, description, eval_function, reference, code_hash)
+                                        VALUES (?, ?, ?, ?, ?)''', self._reference(eval_function))
             return cursor.lastrowid
 
+    def add_eval_functions(self, eval_functions: List[EvalFunctionType]) -> List[int]:
+        """ Adds several eval functions to the database in a single transaction and returns their IDs. """
+        return insert_many(self.db, '''INSERT INTO eval_functions (name, description, eval_function, reference, code_hash)
+                                    VALUES (?, ?, ?, ?, ?)''', [self._reference(e) for e in eval_functions])
+
+    def _load(self, data: tuple) -> EvalFunctionType:
+        """ Builds an eval function from a row, storing the code hash of a reference that has none yet. """
+        eval_function = EvalFunctionType.from_tuple(data)
+        if eval_function.reference and eval_function.code_hash is None:
+            eval_function.code_hash = function_code_hash(eval_function.eval_function)
+            with self.db:
+                self.db.execute('UPDATE eval_functions SET code_hash = ? WHERE id = ? AND code_hash IS NULL', (eval_function.code_hash, eval_function.id))
+        return eval_function
+
     def get_eval_function_by_id(self, eval_function_id: int):
         """ Retrieves an eval function from the database by its ID. """
+        if eval_function := get_record(self.key, eval_function_id):
+            return eval_function
         cursor = self.db.execute('SELECT * FROM eval_functions WHERE id = ?', (eval_function_id,))
         data = cursor.fetchone()
         if data:
-            return EvalFunctionType.from_tuple(data)
+            eval_function = self._load(data)
+            put_record(self.key, eval_function_id, eval_function)
+            return eval_function
         return None
-    
+
     def get_eval_function_by_name(self, name: str):
         """ Retrieves an eval function from the database by its name. """
         cursor = self.db.execute('SELECT * FROM eval_functions WHERE name = ?', (name,))
         data = cursor.fetchone()
         if data:
-            return EvalFunctionType.from_tuple(data)
+            return self._load(data)
         return None
-    
+
     def add_or_get_eval_function(self, eval_function: EvalFunctionType):
         """ Adds a new eval function to the database if it does not exist, otherwise retrieves the existing eval function. """
         existing_eval_function = self.get_eval_function_by_name(eval_function.name)
@@ -84,24 +148,26 @@ class EvalFunctionModel:
         else:
             eval_function.id = self.add_eval_function(eval_function)
             return eval_function
-            
+
 
     def update_eval_function(self, eval_function: EvalFunctionType):
         """ Updates an existing eval function in the database. """
-        serialized_blob = pickle.dumps(eval_function.eval_function)
+        name, description, data, reference, code_hash = self._reference(eval_function)
         with self.db:
             cursor = self.db.execute('''UPDATE eval_functions
-                                SET name = ?, description = ?, eval_function = ?
-                                WHERE id = ?''', (eval_function.name, eval_function.description, serialized_blob, eval_function.id))
-            return cursor.rowcount > 0
+                                SET name = ?, description = ?, eval_function = ?, reference = ?, code_hash = ?
+                                WHERE id = ?''', (name, description, data, reference, code_hash, eval_function.id))
+        invalidate(self.key, eval_function.id)
+        return cursor.rowcount > 0
 
     def delete_eval_function(self, eval_function_id: int):
         """ Deletes an eval function from the database by its ID. """
         with self.db:
             self.db.execute('DELETE FROM eval_functions WHERE id = ?', (eval_function_id,))
-            return True
+        invalidate(self.key, eval_function_id)
+        return True
 
     def get_all_eval_functions(self):
         """ Retrieves all eval functions from the database. """
         cursor = self.db.execute('SELECT * FROM eval_functions')
-        return [EvalFunctionType.from_tuple(row) for row in cursor.fetchall()]
+        return [self._load(row) for row in cursor.fetchall()]
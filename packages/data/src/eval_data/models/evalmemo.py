@@ -0,0 +1,70 @@
+from typing import Dict, List, Sequence
+
+from .utils import schema_ready, variable_limit
+
+class EvalMemoType:
+    """ Represents a memoized eval score, keyed by the eval function code hash and a hash of the normalized eval inputs. """
+    def __init__(self, code_hash: str, input_hash: str, eval_score: float):
+        self.code_hash = code_hash
+        self.input_hash = input_hash
+        self.eval_score = eval_score
+
+    def to_dict(self):
+        """ Converts the eval memo object to a dictionary. """
+        return {
+            'code_hash': self.code_hash,
+            'input_hash': self.input_hash,
+            'eval_score': self.eval_score
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        """ Creates an eval memo object from a dictionary. """
+        return EvalMemoType(
+            code_hash=data.get('code_hash'),
+            input_hash=data.get('input_hash'),
+            eval_score=data.get('eval_score')
+        )
+
+    @staticmethod
+    def from_tuple(data: tuple):
+        """ Creates an eval memo object from a tuple. """
+        return EvalMemoType(
+            code_hash=data[0],
+            input_hash=data[1],
+            eval_score=data[2]
+        )
+
+class EvalMemoModel:
+    """ Handles database operations for memoized eval scores shared across test runs. """
+    def __init__(self, db):
+        self.db = db
+        if not schema_ready(db):
+            self.create_table()
+
+    def create_table(self):
+        """ Creates the eval_memos table in the database if it does not exist. """
+        self.db.execute('''CREATE TABLE IF NOT EXISTS eval_memos (
+                            code_hash TEXT NOT NULL,
+                            input_hash TEXT NOT NULL,
+                            eval_score REAL NOT NULL,
+                            PRIMARY KEY (code_hash, input_hash)
+                        ) WITHOUT ROWID''')
+
+    def add_eval_memos(self, eval_memos: List[EvalMemoType]):
+        """ Adds or replaces several eval memos in a single transaction. """
+        with self.db:
+            self.db.executemany('''INSERT OR REPLACE INTO eval_memos (code_hash, input_hash, eval_score)
+                                   VALUES (?, ?, ?)''', [(m.code_hash, m.input_hash, m.eval_score) for m in eval_memos])
+
+    def get_eval_scores(self, code_hash: str, input_hashes: Sequence[str]) -> Dict[str, float]:
+        """ Returns the memoized scores of an eval function for whichever of the input hashes have one, keyed by input hash. """
+        scores = {}
+        input_hashes = list(input_hashes)
+        chunk_size = variable_limit(self.db) - 1
+        for i in range(0, len(input_hashes), chunk_size):
+            chunk = input_hashes[i:i+chunk_size]
+            cursor = self.db.execute(f'''SELECT input_hash, eval_score FROM eval_memos
+                                         WHERE code_hash = ? AND input_hash IN ({', '.join('?' * len(chunk))})''', [code_hash, *chunk])
+            scores.update(cursor.fetchall())
+        return scores
@@ -1,5 +1,7 @@
 from typing import Optional, List
 
+from .utils import insert_many, schema_ready
+
 class QASetType:
     id: Optional[int]
     datasource_id: int
@@ -58,7 +60,8 @@ class QASetType:
 class QASetModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS qasets (
@@ -79,6 +82,10 @@ class QASetModel:
                                         VALUES (?, ?, ?, ?, ?, ?)''', (qaset.datasource_id, qaset.document_id, qaset.name, qaset.location, qaset.col_question, qaset.col_answer))
             return cursor.lastrowid
 
+    def add_qasets(self, qasets: List[QASetType]) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO qasets (datasource_id, document_id, name, location, col_question, col_answer)
+                                    VALUES (?, ?, ?, ?, ?, ?)''', [(q.datasource_id, q.document_id, q.name, q.location, q.col_question, q.col_answer) for q in qasets])
+
     def add_or_get_qaset(self, qaset: QASetType):
         existing_qaset = self.get_qaset_by_name(qaset.name)
         if existing_qaset:
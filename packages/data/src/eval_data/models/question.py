@@ -1,4 +1,7 @@
-from typing import Optional
+import json
+from typing import Dict, Optional, List
+
+from .utils import insert_many, schema_ready
 
 class QuestionType:
     id: Optional[int]
@@ -6,13 +9,15 @@ class QuestionType:
     document_id: int
     question: str
     answer: str
+    relevant_ids: Optional[List[str]]
 
-    def __init__(self, qaset_id: int, document_id: int, question: str, answer: str, id: int = None):
+    def __init__(self, qaset_id: int, document_id: int, question: str, answer: str, id: int = None, relevant_ids: Optional[List[str]] = None):
         self.id = id
         self.qaset_id = qaset_id
         self.document_id = document_id
         self.question = question
         self.answer = answer
+        self.relevant_ids = relevant_ids
 
     def to_dict(self):
         return {
@@ -20,7 +25,8 @@ class QuestionType:
             'qaset_id': self.qaset_id,
             'document_id': self.document_id,
             'question': self.question,
-            'answer': self.answer
+            'answer': self.answer,
+            'relevant_ids': self.relevant_ids
         }
 
     @staticmethod
@@ -30,7 +36,8 @@ class QuestionType:
             qaset_id=data.get('qaset_id'),
             document_id=data.get('document_id'),
             question=data.get('question'),
-            answer=data.get('answer')
+            answer=data.get('answer'),
+            relevant_ids=data.get('relevant_ids')
         )
     
     @staticmethod
@@ -40,13 +47,20 @@ class QuestionType:
             qaset_id=data[1],
             document_id=data[2],
             question=data[3],
-            answer=data[4]
+            answer=data[4],
+            relevant_ids=json.loads(data[5]) if data[5] is not None else None
         )
 
+    def to_row(self) -> tuple:
+        """ Returns the column values in insert order, without the id; relevant_ids are stored as a JSON list. """
+        relevant_ids = json.dumps(self.relevant_ids) if self.relevant_ids is not None else None
+        return (self.qaset_id, self.document_id, self.question, self.answer, relevant_ids)
+
 class QuestionModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS questions (
@@ -55,16 +69,27 @@ class QuestionModel:
                             document_id INTEGER NOT NULL,
                             question TEXT NOT NULL,
                             answer TEXT NOT NULL,
+                            relevant_ids TEXT,
                             FOREIGN KEY(qaset_id) REFERENCES qasets(id),
                             FOREIGN KEY(document_id) REFERENCES documents(id)
                         )''')
 
     def add_question(self, question: QuestionType):
         with self.db:
-            cursor = self.db.execute('''INSERT INTO questions (qaset_id, document_id, question, answer)
-                                        VALUES (?, ?, ?, ?)''', (question.qaset_id, question.document_id, question.question, question.answer))
+            cursor = self.db.execute('''INSERT INTO questions (qaset_id, document_id, question, answer, relevant_ids)
+                                        VALUES (?, ?, ?, ?, ?)''', question.to_row())
             return cursor.lastrowid
 
+    def add_questions(self, questions: List[QuestionType]) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO questions (qaset_id, document_id, question, answer, relevant_ids)
+                                    VALUES (?, ?, ?, ?, ?)''', [q.to_row() for q in questions])
+
+    def set_relevant_ids(self, relevant_ids: Dict[int, List[str]]):
+        """ Stores the gold retrieval ids of several questions, keyed by question id, in a single transaction. """
+        with self.db:
+            self.db.executemany('''UPDATE questions SET relevant_ids = ? WHERE id = ?''',
+                                [(json.dumps(ids), question_id) for question_id, ids in relevant_ids.items()])
+
     def get_question_by_id(self, question_id):
         cursor = self.db.execute('''SELECT * FROM questions WHERE id = ?''', (question_id,))
         if row := cursor.fetchone():
@@ -77,6 +102,10 @@ class QuestionModel:
         questions = [QuestionType.from_tuple(row) for row in cursor.fetchall()]
         return questions
 
+    def count_questions_by_qaset_id(self, qaset_id) -> int:
+        cursor = self.db.execute('''SELECT COUNT(*) FROM questions WHERE qaset_id = ?''', (qaset_id,))
+        return cursor.fetchone()[0]
+
     def get_questions_by_document_id(self, document_id):
         cursor = self.db.execute('''SELECT * FROM questions WHERE document_id = ?''', (document_id,))
         questions = [QuestionType.from_tuple(row) for row in cursor.fetchall()]
@@ -84,8 +113,8 @@ class QuestionModel:
 
     def update_question(self, question: QuestionType):
         with self.db:
-            cursor = self.db.execute('''UPDATE questions SET qaset_id = ?, document_id = ?, question = ?, answer = ? WHERE id = ?''',
-                            (question.qaset_id, question.document_id, question.question, question.answer, question.id))
+            cursor = self.db.execute('''UPDATE questions SET qaset_id = ?, document_id = ?, question = ?, answer = ?, relevant_ids = ? WHERE id = ?''',
+                            (*question.to_row(), question.id))
             return cursor.rowcount > 0
 
     def delete_question(self, question_id):
@@ -0,0 +1,73 @@
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .embedding import pack_embedding, unpack_embedding
+from .utils import schema_ready, variable_limit
+
+class QuestionEmbeddingType:
+    """ Represents the embedding of a question text by one embedding model, keyed by the model name and a hash of the text. """
+    def __init__(self, model_name: str, text_hash: str, embedding: List[float]):
+        self.model_name = model_name
+        self.text_hash = text_hash
+        self.embedding = embedding
+
+    def to_dict(self):
+        """ Converts the question embedding object to a dictionary. """
+        return {
+            'model_name': self.model_name,
+            'text_hash': self.text_hash,
+            'embedding': self.embedding
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        """ Creates a question embedding object from a dictionary. """
+        return QuestionEmbeddingType(
+            model_name=data.get('model_name'),
+            text_hash=data.get('text_hash'),
+            embedding=data.get('embedding')
+        )
+
+    @staticmethod
+    def from_tuple(data: tuple):
+        """ Creates a question embedding object from a tuple. """
+        return QuestionEmbeddingType(
+            model_name=data[0],
+            text_hash=data[1],
+            embedding=unpack_embedding(data[2]).tolist()
+        )
+
+class QuestionEmbeddingModel:
+    """ Handles database operations for question embeddings, kept apart from the node embeddings of the retrieval index. """
+    def __init__(self, db):
+        self.db = db
+        if not schema_ready(db):
+            self.create_table()
+
+    def create_table(self):
+        """ Creates the question_embeddings table in the database if it does not exist. """
+        self.db.execute('''CREATE TABLE IF NOT EXISTS question_embeddings (
+                            model_name TEXT NOT NULL,
+                            text_hash TEXT NOT NULL,
+                            embedding BLOB NOT NULL,
+                            PRIMARY KEY (model_name, text_hash)
+                        ) WITHOUT ROWID''')
+
+    def add_question_embeddings(self, question_embeddings: List[QuestionEmbeddingType]):
+        """ Adds or replaces several question embeddings in a single transaction. """
+        with self.db:
+            self.db.executemany('''INSERT OR REPLACE INTO question_embeddings (model_name, text_hash, embedding)
+                                   VALUES (?, ?, ?)''', [(e.model_name, e.text_hash, pack_embedding(e.embedding)) for e in question_embeddings])
+
+    def find_question_embeddings(self, model_name: str, text_hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """ Returns the stored embeddings of a model for whichever of the text hashes have one, keyed by text hash. """
+        embeddings = {}
+        text_hashes = list(text_hashes)
+        chunk_size = variable_limit(self.db) - 1
+        for i in range(0, len(text_hashes), chunk_size):
+            chunk = text_hashes[i:i+chunk_size]
+            cursor = self.db.execute(f'''SELECT text_hash, embedding FROM question_embeddings
+                                         WHERE model_name = ? AND text_hash IN ({', '.join('?' * len(chunk))})''', [model_name, *chunk])
+            embeddings.update((text_hash, unpack_embedding(blob)) for text_hash, blob in cursor.fetchall())
+        return embeddings
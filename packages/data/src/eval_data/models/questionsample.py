@@ -0,0 +1,102 @@
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from .question import QuestionType
+from .utils import schema_ready
+
+class QuestionSampleType:
+    """ Represents a named, reusable subset of the questions of one or more QA sets. """
+    def __init__(self, name: str, description: str = "", timestamp: str = None, id: int = None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def to_dict(self):
+        """ Converts the question sample object to a dictionary. """
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'timestamp': self.timestamp
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        """ Creates a question sample object from a dictionary. """
+        return QuestionSampleType(
+            id=data.get('id'),
+            name=data.get('name'),
+            description=data.get('description'),
+            timestamp=data.get('timestamp')
+        )
+
+    @staticmethod
+    def from_tuple(data: tuple):
+        """ Creates a question sample object from a tuple. """
+        return QuestionSampleType(
+            id=data[0],
+            name=data[1],
+            description=data[2],
+            timestamp=data[3]
+        )
+
+class QuestionSampleModel:
+    """ Handles database operations for question samples and the questions they hold. """
+    def __init__(self, db):
+        self.db = db
+        if not schema_ready(db):
+            self.create_table()
+
+    def create_table(self):
+        """ Creates the question_samples and question_sample_items tables in the database if they do not exist. """
+        self.db.execute('''CREATE TABLE IF NOT EXISTS question_samples (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            name TEXT NOT NULL UNIQUE,
+                            description TEXT,
+                            timestamp TEXT NOT NULL
+                        )''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS question_sample_items (
+                            question_sample_id INTEGER NOT NULL,
+                            question_id INTEGER NOT NULL,
+                            PRIMARY KEY (question_sample_id, question_id),
+                            FOREIGN KEY(question_sample_id) REFERENCES question_samples(id),
+                            FOREIGN KEY(question_id) REFERENCES questions(id)
+                        ) WITHOUT ROWID''')
+
+    def add_question_sample(self, question_sample: QuestionSampleType, question_ids: Sequence[int]) -> int:
+        """ Adds a question sample together with its questions in a single transaction and returns its ID. """
+        with self.db:
+            cursor = self.db.execute('''INSERT INTO question_samples (name, description, timestamp)
+                                        VALUES (?, ?, ?)''', (question_sample.name, question_sample.description, question_sample.timestamp))
+            self.db.executemany('''INSERT OR IGNORE INTO question_sample_items (question_sample_id, question_id)
+                                   VALUES (?, ?)''', [(cursor.lastrowid, question_id) for question_id in question_ids])
+            return cursor.lastrowid
+
+    def get_question_sample_by_id(self, question_sample_id: int) -> Optional[QuestionSampleType]:
+        cursor = self.db.execute('''SELECT * FROM question_samples WHERE id = ?''', (question_sample_id,))
+        row = cursor.fetchone()
+        return QuestionSampleType.from_tuple(row) if row else None
+
+    def get_question_sample_by_name(self, name: str) -> Optional[QuestionSampleType]:
+        cursor = self.db.execute('''SELECT * FROM question_samples WHERE name = ?''', (name,))
+        row = cursor.fetchone()
+        return QuestionSampleType.from_tuple(row) if row else None
+
+    def get_question_ids(self, question_sample_id: int) -> List[int]:
+        cursor = self.db.execute('''SELECT question_id FROM question_sample_items WHERE question_sample_id = ? ORDER BY question_id''', (question_sample_id,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_questions(self, question_sample_id: int) -> List[QuestionType]:
+        """ Returns the questions of a sample in id order. """
+        cursor = self.db.execute('''SELECT q.* FROM question_sample_items i
+                                    JOIN questions q ON q.id = i.question_id
+                                    WHERE i.question_sample_id = ?
+                                    ORDER BY q.id''', (question_sample_id,))
+        return [QuestionType.from_tuple(row) for row in cursor.fetchall()]
+
+    def delete_question_sample(self, question_sample_id: int) -> bool:
+        with self.db:
+            self.db.execute('''DELETE FROM question_sample_items WHERE question_sample_id = ?''', (question_sample_id,))
+            cursor = self.db.execute('''DELETE FROM question_samples WHERE id = ?''', (question_sample_id,))
+            return cursor.rowcount > 0
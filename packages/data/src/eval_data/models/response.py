@@ -1,5 +1,8 @@
 import sqlite3
 from datetime import datetime
+from typing import List, Set
+
+from .utils import insert_many, schema_ready
 
 class ResponseType:
     def __init__(self, test_run_id: int, question_id: int, response: str, timestamp: str = None, id: int = None):
@@ -41,7 +44,8 @@ class ResponseType:
 class ResponseModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
@@ -60,10 +64,18 @@ class ResponseModel:
                                         VALUES (?, ?, ?, ?)''', (response.test_run_id, response.question_id, response.response, response.timestamp))
             return cursor.lastrowid
 
+    def add_responses(self, responses: List[ResponseType], autocommit: bool = True) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO responses (test_run_id, question_id, response, timestamp)
+                                    VALUES (?, ?, ?, ?)''', [(r.test_run_id, r.question_id, r.response, r.timestamp) for r in responses], autocommit)
+
     def get_responses_by_test_run_id(self, test_run_id):
         cursor = self.db.execute('''SELECT * FROM responses WHERE test_run_id = ?''', (test_run_id,))
         return [ResponseType.from_tuple(row) for row in cursor.fetchall()]
 
+    def get_answered_question_ids(self, test_run_id) -> Set[int]:
+        cursor = self.db.execute('''SELECT DISTINCT question_id FROM responses WHERE test_run_id = ?''', (test_run_id,))
+        return {row[0] for row in cursor.fetchall()}
+
     def get_responses_by_question_id(self, question_id):
         cursor = self.db.execute('''SELECT * FROM responses WHERE question_id = ?''', (question_id,))
         return [ResponseType.from_tuple(row) for row in cursor.fetchall()]
@@ -2,6 +2,9 @@
 # This module handles the response evaluation used in the application.
 
 import sqlite3
+from typing import Dict, List, Tuple
+
+from .utils import insert_many, schema_ready
 
 class ResponseEvalType:
     """ Represents a response evaluation. """
@@ -52,7 +55,8 @@ class ResponseEvalModel:
     """ Handles database operations for response evaluations. """
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         """ Creates the response_evals table in the database if it does not exist. """
@@ -76,6 +80,11 @@ class ResponseEvalModel:
                                         VALUES (?, ?, ?, ?, ?)''', (response_eval.test_run_id, response_eval.question_id, response_eval.response_id, response_eval.test_eval_config_id, response_eval.eval_score))
             return cursor.lastrowid
 
+    def add_response_evals(self, response_evals: List[ResponseEvalType]) -> List[int]:
+        """ Adds several response evals to the database in a single transaction and returns their IDs. """
+        return insert_many(self.db, '''INSERT INTO response_evals (test_run_id, question_id, response_id, test_eval_config_id, eval_score)
+                                    VALUES (?, ?, ?, ?, ?)''', [(e.test_run_id, e.question_id, e.response_id, e.test_eval_config_id, e.eval_score) for e in response_evals])
+
     def get_response_evals_by_test_run_id(self, test_run_id):
         """ Retrieves all response evals from the database by test run ID. """
         cursor = self.db.execute('SELECT * FROM response_evals WHERE test_run_id = ?', (test_run_id,))
@@ -95,3 +104,14 @@ class ResponseEvalModel:
         """ Retrieves all response evals from the database by test eval config ID. """
         cursor = self.db.execute('SELECT * FROM response_evals WHERE test_eval_config_id = ?', (test_eval_config_id,))
         return [ResponseEvalType.from_tuple(row) for row in cursor.fetchall()]
+
+    def get_score_sums(self, test_eval_config_ids: List[int]) -> Dict[int, Tuple[int, float, float]]:
+        """ Returns the (count, sum, sum of squares) of the scores of each test eval config that has any. """
+        sums = {}
+        for i in range(0, len(test_eval_config_ids), 500):
+            ids = test_eval_config_ids[i:i+500]
+            cursor = self.db.execute(f'''SELECT test_eval_config_id, COUNT(*), SUM(eval_score), SUM(eval_score * eval_score)
+                                         FROM response_evals WHERE test_eval_config_id IN ({', '.join('?' * len(ids))})
+                                         GROUP BY test_eval_config_id''', ids)
+            sums.update((row[0], (row[1], row[2], row[3])) for row in cursor.fetchall())
+        return sums
@@ -1,3 +1,7 @@
+from typing import List
+
+from .utils import insert_many, schema_ready
+
 class TestEvalType:
     """ Represents a test evaluation. """
     def __init__(self, id: int, test_run_id: int):
@@ -23,7 +27,8 @@ class TestEvalModel:
     """ Handles database operations for test evaluations. """
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         """ Creates the test_evals table in the database if it does not exist. """
@@ -40,6 +45,11 @@ class TestEvalModel:
                                         VALUES (?)''', (test_eval.test_run_id,))
             return cursor.lastrowid
 
+    def add_test_evals(self, test_evals: List[TestEvalType]) -> List[int]:
+        """ Adds several test evals to the database in a single transaction and returns their IDs. """
+        return insert_many(self.db, '''INSERT INTO test_evals (test_run_id)
+                                    VALUES (?)''', [(t.test_run_id,) for t in test_evals])
+
     def get_test_evals_by_test_run_id(self, test_run_id):
         """ Retrieves all test evals from the database by test run ID. """
         cursor = self.db.execute('SELECT * FROM test_evals WHERE test_run_id = ?', (test_run_id,))
@@ -1,17 +1,28 @@
+from typing import List, Optional
+
+from .utils import insert_many, schema_ready
 
 class TestEvalConfigType:
-    """ Represents a test evaluation configuration. """
-    def __init__(self, test_run_id: int, eval_function_id: int, id: int=None):
+    """ Represents a test evaluation configuration, with the score mean and confidence interval half-width
+    over the sample_count responses it has scored, as recorded by the adaptive evaluation. """
+    def __init__(self, test_run_id: int, eval_function_id: int, id: int=None, score_mean: Optional[float] = None,
+                 ci_half_width: Optional[float] = None, sample_count: Optional[int] = None):
         self.id = id
         self.test_run_id = test_run_id
         self.eval_function_id = eval_function_id
+        self.score_mean = score_mean
+        self.ci_half_width = ci_half_width
+        self.sample_count = sample_count
 
     def to_dict(self):
         """ Converts the test eval config object to a dictionary. """
         return {
             'id': self.id,
             'test_run_id': self.test_run_id,
-            'eval_function_id': self.eval_function_id
+            'eval_function_id': self.eval_function_id,
+            'score_mean': self.score_mean,
+            'ci_half_width': self.ci_half_width,
+            'sample_count': self.sample_count
         }
 
     @staticmethod
@@ -20,7 +31,10 @@ class TestEvalConfigType:
         return TestEvalConfigType(
             id=data.get('id'),
             test_run_id=data.get('test_run_id'),
-            eval_function_id=data.get('eval_function_id')
+            eval_function_id=data.get('eval_function_id'),
+            score_mean=data.get('score_mean'),
+            ci_half_width=data.get('ci_half_width'),
+            sample_count=data.get('sample_count')
         )
     
     @staticmethod
@@ -29,14 +43,18 @@ class TestEvalConfigType:
         return TestEvalConfigType(
             id=data[0],
             test_run_id=data[1],
-            eval_function_id=data[2]
+            eval_function_id=data[2],
+            score_mean=data[3],
+            ci_half_width=data[4],
+            sample_count=data[5]
         )
 
 class TestEvalConfigModel:
     """ Handles database operations for test evaluation configurations. """
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         """ Creates the test_eval_configs table in the database if it does not exist. """
@@ -44,6 +62,9 @@ class TestEvalConfigModel:
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                             test_run_id INTEGER NOT NULL,
                             eval_function_id INTEGER NOT NULL,
+                            score_mean REAL,
+                            ci_half_width REAL,
+                            sample_count INTEGER,
                             FOREIGN KEY(test_run_id) REFERENCES test_runs(id),
                             FOREIGN KEY(eval_function_id) REFERENCES eval_functions(id)
                         )''')
@@ -55,6 +76,11 @@ class TestEvalConfigModel:
                                         VALUES (?, ?)''', (test_eval_config.test_run_id, test_eval_config.eval_function_id))
             return cursor.lastrowid
 
+    def add_test_eval_configs(self, test_eval_configs: List[TestEvalConfigType]) -> List[int]:
+        """ Adds several test eval configs to the database in a single transaction and returns their IDs. """
+        return insert_many(self.db, '''INSERT INTO test_eval_configs (test_run_id, eval_function_id)
+                                    VALUES (?, ?)''', [(c.test_run_id, c.eval_function_id) for c in test_eval_configs])
+
     def get_test_eval_config_by_id(self, test_eval_config_id):
         """ Retrieves a test eval config from the database by its ID. """
         cursor = self.db.execute('SELECT * FROM test_eval_configs WHERE id = ?', (test_eval_config_id,))
@@ -64,3 +90,10 @@ class TestEvalConfigModel:
         """ Retrieves all test eval configs from the database by test run ID. """
         cursor = self.db.execute('SELECT * FROM test_eval_configs WHERE test_run_id = ?', (test_run_id,))
         return [TestEvalConfigType.from_tuple(row) for row in cursor.fetchall()]
+
+    def update_score_stats(self, test_eval_config_id: int, score_mean: float, ci_half_width: float, sample_count: int):
+        """ Records the score mean, confidence interval half-width and sample count of a test eval config. """
+        with self.db:
+            cursor = self.db.execute('''UPDATE test_eval_configs SET score_mean = ?, ci_half_width = ?, sample_count = ? WHERE id = ?''',
+                                     (score_mean, ci_half_width, sample_count, test_eval_config_id))
+            return cursor.rowcount > 0
@@ -1,18 +1,23 @@
 from datetime import datetime
+from typing import List, Optional
+
+from .utils import insert_many, schema_ready
 
 class TestRunType:
-    def __init__(self, datasource_id: int, description: str, timestamp: str = None, id: int = None):
+    def __init__(self, datasource_id: int, description: str, timestamp: str = None, id: int = None, question_sample_id: Optional[int] = None):
         self.id = id
         self.datasource_id = datasource_id
         self.description = description
         self.timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.question_sample_id = question_sample_id
 
     def to_dict(self):
         return {
             'id': self.id,
             'datasource_id': self.datasource_id,
             'description': self.description,
-            'timestamp': self.timestamp
+            'timestamp': self.timestamp,
+            'question_sample_id': self.question_sample_id
         }
 
     @staticmethod
@@ -21,7 +26,8 @@ class TestRunType:
             id=data.get('id'),
             datasource_id=data.get('datasource_id'),
             description=data.get('description'),
-            timestamp=data.get('timestamp')
+            timestamp=data.get('timestamp'),
+            question_sample_id=data.get('question_sample_id')
         )
     
     @staticmethod
@@ -30,13 +36,15 @@ class TestRunType:
             id=data[0],
             datasource_id=data[1],
             description=data[2],
-            timestamp=data[3]
+            timestamp=data[3],
+            question_sample_id=data[4]
         )
 
 class TestRunModel:
     def __init__(self, db):
         self.db = db
-        self.create_table()
+        if not schema_ready(db):
+            self.create_table()
 
     def create_table(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS test_runs (
@@ -44,15 +52,21 @@ class TestRunModel:
                             datasource_id INTEGER NOT NULL,
                             description TEXT NOT NULL,
                             timestamp TEXT NOT NULL,
-                            FOREIGN KEY(datasource_id) REFERENCES datasources(id)
+                            question_sample_id INTEGER,
+                            FOREIGN KEY(datasource_id) REFERENCES datasources(id),
+                            FOREIGN KEY(question_sample_id) REFERENCES question_samples(id)
                         )''')
 
     def add_test_run(self, test_run: TestRunType):
         with self.db:
-            cursor = self.db.execute('''INSERT INTO test_runs (datasource_id, description, timestamp)
-                                        VALUES (?, ?, ?)''', (test_run.datasource_id, test_run.description, test_run.timestamp))
+            cursor = self.db.execute('''INSERT INTO test_runs (datasource_id, description, timestamp, question_sample_id)
+                                        VALUES (?, ?, ?, ?)''', (test_run.datasource_id, test_run.description, test_run.timestamp, test_run.question_sample_id))
             return cursor.lastrowid
 
+    def add_test_runs(self, test_runs: List[TestRunType]) -> List[int]:
+        return insert_many(self.db, '''INSERT INTO test_runs (datasource_id, description, timestamp, question_sample_id)
+                                    VALUES (?, ?, ?, ?)''', [(t.datasource_id, t.description, t.timestamp, t.question_sample_id) for t in test_runs])
+
     def add_or_get_test_run(self, test_run: TestRunType):
         cursor = self.db.execute('''SELECT * FROM test_runs WHERE description = ?''', (test_run.description,))
         row = cursor.fetchone()
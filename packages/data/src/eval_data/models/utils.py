@@ -0,0 +1,33 @@
+import sqlite3
+from typing import Iterable, List, Sequence
+
+
+def insert_many(db, sql: str, rows: Iterable[Sequence], autocommit: bool = True) -> List[int]:
+    """ Inserts all rows with a single executemany inside one transaction and returns the assigned ids in row order.
+
+    The tables use AUTOINCREMENT and the transaction holds the write lock, so the new rows
+    receive consecutive ids ending at last_insert_rowid(). With autocommit=False the rows join
+    the caller's open transaction, which commits them.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    if autocommit:
+        with db:
+            return insert_many(db, sql, rows, autocommit=False)
+    db.executemany(sql, rows)
+    last_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def schema_ready(db) -> bool:
+    """ True when the connection was opened by eval_data.database.connect, which has already created every table. """
+    return getattr(db, 'schema_ready', False)
+
+
+def variable_limit(db) -> int:
+    """ Maximum number of ? parameters allowed in one statement, used to chunk IN (...) lookups. """
+    try:
+        return db.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError:
+        return 999
@@ -0,0 +1,102 @@
+import hashlib
+import importlib
+import inspect
+import marshal
+import pickle
+import pickletools
+from typing import Callable, Dict, Optional, Tuple
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Resolved callables by import reference, shared by every connection in the process
+_callables: Dict[str, Callable] = {}
+# Eval function records by (database, id), invalidated by EvalFunctionModel on update and delete
+_records: Dict[Tuple[str, int], object] = {}
+
+
+def function_reference(func: Callable) -> str:
+    """ Returns the module:qualname import reference of a module level function. """
+    reference = f"{func.__module__}:{func.__qualname__}"
+    if '<' in func.__qualname__:
+        raise ValueError(f"Eval functions must be importable module level functions, got {reference}")
+    return reference
+
+
+def function_code_hash(func: Callable) -> str:
+    """ Hashes the source of a function, or its bytecode when the source is not available. """
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = marshal.dumps(func.__code__)
+    return hashlib.sha256(code).hexdigest()
+
+
+def resolve_function(reference: str, code_hash: Optional[str] = None) -> Callable:
+    """ Returns the function behind a module:qualname reference; its module is imported once per process.
+
+    A function redefined since it was last resolved, e.g. by reloading its module, replaces the
+    cached one, and the cached records that still hold the old function are dropped.
+    """
+    module_name, qualname = reference.split(':', 1)
+    func = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        func = getattr(func, name)
+    if (cached := _callables.get(reference)) is not func:
+        if cached is not None:
+            logger.info(f"Eval function {reference} was redefined")
+            for key in [key for key, record in _records.items() if record.reference == reference]:
+                del _records[key]
+        _callables[reference] = func
+        if code_hash and function_code_hash(func) != code_hash:
+            logger.warning(f"Eval function {reference} has changed since it was registered")
+    return func
+
+
+def pickled_reference(data: bytes) -> Optional[str]:
+    """ Reads the import reference out of a pickled function without unpickling it, or None when the pickle holds anything else. """
+    strings = []
+    reference = None
+    for opcode, arg, _ in pickletools.genops(data):
+        if opcode.name in ('PROTO', 'FRAME', 'MEMOIZE', 'PUT', 'BINPUT', 'LONG_BINPUT', 'STOP'):
+            continue
+        if reference is None and opcode.name in ('SHORT_BINUNICODE', 'BINUNICODE', 'UNICODE'):
+            strings.append(arg)
+        elif reference is None and opcode.name == 'STACK_GLOBAL' and len(strings) == 2:
+            reference = f"{strings[0]}:{strings[1]}"
+        elif reference is None and opcode.name == 'GLOBAL' and not strings:
+            reference = ':'.join(arg.split(' ', 1))
+        else:
+            return None
+    return reference
+
+
+def load_function(reference: Optional[str], code_hash: Optional[str], data: Optional[bytes]) -> Callable:
+    """ Resolves a stored eval function, falling back to unpickling rows saved before references were introduced. """
+    if reference:
+        return resolve_function(reference, code_hash)
+    return pickle.loads(data)
+
+
+def database_key(db) -> str:
+    """ Identifies the database behind a connection, so cached records of different databases do not collide. """
+    path = next((row[2] for row in db.execute('PRAGMA database_list') if row[1] == 'main'), '')
+    return path or f"memory:{id(db)}"
+
+
+def get_record(key: str, eval_function_id: int):
+    """ Returns the cached record of an eval function, or None when there is none or its function has been redefined. """
+    record = _records.get((key, eval_function_id))
+    if record is not None and record.reference:
+        resolve_function(record.reference)
+        record = _records.get((key, eval_function_id))
+    return record
+
+
+def put_record(key: str, eval_function_id: int, record):
+    _records[(key, eval_function_id)] = record
+
+
+def invalidate(key: str, eval_function_id: int):
+    _records.pop((key, eval_function_id), None)
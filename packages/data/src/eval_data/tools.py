@@ -1,32 +1,166 @@
+import random
 from sqlite3 import Connection
-from typing import List
+from typing import Iterator, List, NamedTuple, Optional, Tuple
 from logging import getLogger
 
 from eval_data.models.question import QuestionModel, QuestionType
 from eval_data.models.qaset import QASetModel, QASetType
+from eval_data.models.response import ResponseModel, ResponseType
+from eval_data.models.context import ContextModel, ContextType
+from eval_data.models.utils import variable_limit
 
 
 logger = getLogger(__name__)
 
-def save_question_answers(db: Connection, question_list: List[str], answer_list: List[str], qaset: QASetType):
+def save_question_answers(db: Connection, question_list: List[str], answer_list: List[str], qaset: QASetType,
+                          relevant_ids: Optional[List[List[str]]] = None):
+    """ Saves the questions that are not in the QA set yet. relevant_ids optionally gives the gold node ids of each
+    question for retrieval evals; existing questions that have none get them too. """
     logger.info(f"Saving {len(question_list)} questions and {len(answer_list)} answers for QASet {qaset.name}")
 
     question_model = QuestionModel(db)
-    existing_questions = [ q.question for q in question_model.get_questions_by_qaset_id(qaset.id) ]
+    existing_questions = { q.question: q for q in question_model.get_questions_by_qaset_id(qaset.id) }
+    new_questions = []
+    backfill = {}
     count_existing = 0
-    count_new = 0
-    for question, answer in zip(question_list, answer_list):
+    for i, (question, answer) in enumerate(zip(question_list, answer_list)):
+        ids = relevant_ids[i] if relevant_ids is not None else None
         if not question or question in existing_questions:
             count_existing += 1
+            if ids is not None and (existing := existing_questions.get(question)) and existing.id and existing.relevant_ids is None:
+                backfill[existing.id] = ids
             continue
 
-        question = QuestionType(
+        new_question = QuestionType(
             qaset_id=qaset.id,
             document_id=qaset.document_id,
             question=question,
             answer=answer,
+            relevant_ids=ids,
         )
-        question_id = question_model.add_question(question)
-        count_new += 1
+        existing_questions[question] = new_question
+        new_questions.append(new_question)
 
-    return count_new, count_existing
\ No newline at end of file
+    question_model.add_questions(new_questions)
+    if backfill:
+        question_model.set_relevant_ids(backfill)
+    return len(new_questions), count_existing
+
+
+def save_responses(db: Connection, test_run_id: int, question_ids: List[int], responses: List[str], contexts: List[List[tuple]]) -> List[int]:
+    """ Saves a batch of generated responses and their (text, similarity_score) or (text, similarity_score, node_id)
+    contexts in a single transaction, so a response is never stored without its contexts. """
+    with db:
+        response_ids = ResponseModel(db).add_responses([
+            ResponseType(test_run_id=test_run_id, question_id=question_id, response=response)
+            for question_id, response in zip(question_ids, responses)
+        ], autocommit=False)
+        ContextModel(db).add_contexts([
+            ContextType(response_id=response_id, text=context[0], similarity_score=context[1], sort_index=i,
+                        node_id=context[2] if len(context) > 2 else None)
+            for response_id, response_contexts in zip(response_ids, contexts)
+            for i, context in enumerate(response_contexts)
+        ], autocommit=False)
+    return response_ids
+
+
+class PendingEval(NamedTuple):
+    """ A response of a test run with its question, its contexts in rank order and the test eval configs that have not scored it yet. """
+    response: ResponseType
+    question: QuestionType
+    contexts: List[ContextType]
+    test_eval_config_ids: List[int]
+
+
+def _pending_evals(rows) -> Iterator[PendingEval]:
+    """ Groups the rows of the pending query, ordered by response, into a PendingEval per response. """
+    current: Optional[PendingEval] = None
+    for row in rows:
+        if current is None or current.response.id != row[0]:
+            if current is not None:
+                yield current
+            current = PendingEval(
+                response=ResponseType.from_tuple(row[0:5]),
+                question=QuestionType.from_tuple(row[5:11]),
+                contexts=[],
+                test_eval_config_ids=sorted(int(id) for id in row[17].split(',')),
+            )
+        if row[11] is not None:
+            current.contexts.append(ContextType.from_tuple(row[11:17]))
+    if current is not None:
+        yield current
+
+
+def iter_pending_evals(db: Connection, test_run_id: int, test_eval_config_ids: Optional[List[int]] = None, chunk_size: int = 500,
+                       seed: Optional[int] = None, require_node_ids: bool = False) -> Iterator[List[PendingEval]]:
+    """ Streams the evaluation work left in a test run, in chunks of up to chunk_size responses.
+
+    A single joined query finds the (response, test eval config) pairs without a response eval
+    through an anti-join on the response_evals index, and returns each pending response together
+    with its question and contexts. Pass test_eval_config_ids to plan only those configs.
+    Responses come in id order or, when a seed is given, in a uniformly random order fixed by the
+    seed: the pending response ids are planned first, shuffled with random.Random(seed), and each
+    chunk is then read by id. Any prefix of that order is a simple random sample of the pending
+    responses.
+    With require_node_ids, only responses that retrieval metrics can score are planned: their
+    question has relevant ids and every one of their contexts has a node id.
+    """
+    config_filter = ''
+    params: list = [test_run_id]
+    if test_eval_config_ids is not None:
+        # Leaves room for at least one response id in the seeded reads
+        if len(test_eval_config_ids) > variable_limit(db) - 2:
+            raise ValueError(f"Too many test eval configs: {len(test_eval_config_ids)}")
+        config_filter = f"AND c.id IN ({', '.join('?' * len(test_eval_config_ids))})"
+        params.extend(test_eval_config_ids)
+    node_id_filter = ''
+    if require_node_ids:
+        node_id_filter = '''AND EXISTS (SELECT 1 FROM questions q WHERE q.id = r.question_id AND q.relevant_ids IS NOT NULL)
+                                AND NOT EXISTS (SELECT 1 FROM contexts x WHERE x.response_id = r.id AND x.node_id IS NULL)'''
+
+    def pending(response_filter: str = '') -> str:
+        return f'''WITH pending AS (
+                        SELECT r.id AS response_id, group_concat(c.id) AS config_ids
+                        FROM responses r
+                        JOIN test_eval_configs c ON c.test_run_id = r.test_run_id
+                        WHERE r.test_run_id = ? {config_filter} {node_id_filter} {response_filter}
+                        AND NOT EXISTS (SELECT 1 FROM response_evals e WHERE e.response_id = r.id AND e.test_eval_config_id = c.id)
+                        GROUP BY r.id
+                    )'''
+
+    def select(response_filter: str = '') -> str:
+        return f'''{pending(response_filter)}
+                    SELECT r.id, r.test_run_id, r.question_id, r.response, r.timestamp,
+                           q.id, q.qaset_id, q.document_id, q.question, q.answer, q.relevant_ids,
+                           x.id, x.response_id, x.text, x.similarity_score, x.sort_index, x.node_id,
+                           p.config_ids
+                    FROM pending p
+                    JOIN responses r ON r.id = p.response_id
+                    JOIN questions q ON q.id = r.question_id
+                    LEFT JOIN contexts x ON x.response_id = r.id
+                    ORDER BY r.id, x.sort_index, x.id'''
+
+    if seed is None:
+        chunk: List[PendingEval] = []
+        for pending_eval in _pending_evals(db.execute(select(), params)):
+            chunk.append(pending_eval)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    plan = [row[0] for row in db.execute(f'{pending()} SELECT response_id FROM pending ORDER BY response_id', params)]
+    random.Random(seed).shuffle(plan)
+    batch_size = variable_limit(db) - len(params)
+    for start in range(0, len(plan), chunk_size):
+        ids = plan[start:start+chunk_size]
+        chunk = []
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i+batch_size]
+            chunk.extend(_pending_evals(db.execute(select(f"AND r.id IN ({', '.join('?' * len(batch))})"), params + batch)))
+        if chunk:
+            position = {id: i for i, id in enumerate(ids)}
+            chunk.sort(key=lambda pending_eval: position[pending_eval.response.id])
+            yield chunk
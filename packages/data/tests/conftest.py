@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from eval_data.database import connect
+from eval_data.models.datasource import DatasourceModel, DatasourceType
+from eval_data.models.document import DocumentModel, DocumentType
+from eval_data.models.evalfunction import EvalFunctionModel, EvalFunctionType
+from eval_data.models.qaset import QASetModel, QASetType
+from eval_data.models.question import QuestionModel, QuestionType
+from eval_data.models.testevalconfig import TestEvalConfigModel, TestEvalConfigType
+from eval_data.models.testrun import TestRunModel, TestRunType
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / "eval.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def run(db):
+    """ A test run over three questions, the first two with relevant ids, and two test eval configs. """
+    datasource_id = DatasourceModel(db).add_datasource(DatasourceType(name="datasource"))
+    document_id = DocumentModel(db).add_document(DocumentType(datasource_id=datasource_id, name="doc", location="doc.pdf", source="file"))
+    qaset_id = QASetModel(db).add_qaset(QASetType(datasource_id, document_id, "doc-qa", "doc.pdf", "question", "ground_truth"))
+    question_ids = QuestionModel(db).add_questions([
+        QuestionType(qaset_id, document_id, "q1", "a1", relevant_ids=["n1"]),
+        QuestionType(qaset_id, document_id, "q2", "a2", relevant_ids=["n2"]),
+        QuestionType(qaset_id, document_id, "q3", "a3"),
+    ])
+    test_run_id = TestRunModel(db).add_test_run(TestRunType(datasource_id, "run"))
+    eval_function_id = EvalFunctionModel(db).add_eval_function(EvalFunctionType("dumps", "score", json.dumps))
+    config_ids = TestEvalConfigModel(db).add_test_eval_configs([
+        TestEvalConfigType(test_run_id, eval_function_id),
+        TestEvalConfigType(test_run_id, eval_function_id),
+    ])
+    return test_run_id, question_ids, config_ids
@@ -0,0 +1,131 @@
+import json
+import pickle
+import sqlite3
+
+import numpy as np
+import pytest
+
+from eval_data.database import MIGRATIONS, connect
+from eval_data.models.embedding import unpack_embedding
+
+
+# Schema of the databases written before the first migration
+LEGACY_SCHEMA = '''
+CREATE TABLE datasources (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, datasource_id INTEGER NOT NULL, name TEXT NOT NULL, location TEXT NOT NULL,
+                        source TEXT NOT NULL, col_text TEXT, col_id TEXT, FOREIGN KEY(datasource_id) REFERENCES datasources(id));
+CREATE TABLE qasets (id INTEGER PRIMARY KEY AUTOINCREMENT, datasource_id INTEGER NOT NULL, document_id INTEGER NOT NULL, name TEXT NOT NULL,
+                     location TEXT NOT NULL, col_question TEXT NOT NULL, col_answer TEXT NOT NULL,
+                     FOREIGN KEY(datasource_id) REFERENCES datasources(id), FOREIGN KEY(document_id) REFERENCES documents(id));
+CREATE TABLE questions (id INTEGER PRIMARY KEY AUTOINCREMENT, qaset_id INTEGER NOT NULL, document_id INTEGER NOT NULL, question TEXT NOT NULL,
+                        answer TEXT NOT NULL, FOREIGN KEY(qaset_id) REFERENCES qasets(id), FOREIGN KEY(document_id) REFERENCES documents(id));
+CREATE TABLE test_runs (id INTEGER PRIMARY KEY AUTOINCREMENT, datasource_id INTEGER NOT NULL, description TEXT NOT NULL, timestamp TEXT NOT NULL,
+                        FOREIGN KEY(datasource_id) REFERENCES datasources(id));
+CREATE TABLE responses (id INTEGER PRIMARY KEY AUTOINCREMENT, test_run_id INTEGER NOT NULL, question_id INTEGER NOT NULL, response TEXT NOT NULL,
+                        timestamp TEXT NOT NULL, FOREIGN KEY(test_run_id) REFERENCES test_runs(id), FOREIGN KEY(question_id) REFERENCES questions(id));
+CREATE TABLE contexts (id INTEGER PRIMARY KEY AUTOINCREMENT, response_id INTEGER NOT NULL, text TEXT NOT NULL, similarity_score REAL NOT NULL,
+                       sort_index INTEGER NOT NULL, FOREIGN KEY(response_id) REFERENCES responses(id));
+CREATE TABLE eval_functions (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT NOT NULL, eval_function BLOB NOT NULL);
+CREATE TABLE test_eval_configs (id INTEGER PRIMARY KEY AUTOINCREMENT, test_run_id INTEGER NOT NULL, eval_function_id INTEGER NOT NULL,
+                                FOREIGN KEY(test_run_id) REFERENCES test_runs(id), FOREIGN KEY(eval_function_id) REFERENCES eval_functions(id));
+CREATE TABLE test_evals (id INTEGER PRIMARY KEY AUTOINCREMENT, test_run_id INTEGER NOT NULL, FOREIGN KEY(test_run_id) REFERENCES test_runs(id));
+CREATE TABLE response_evals (id INTEGER PRIMARY KEY AUTOINCREMENT, test_run_id INTEGER NOT NULL, question_id INTEGER NOT NULL,
+                             response_id INTEGER NOT NULL, test_eval_config_id INTEGER NOT NULL, eval_score REAL NOT NULL,
+                             FOREIGN KEY(test_run_id) REFERENCES test_runs(id), FOREIGN KEY(question_id) REFERENCES questions(id),
+                             FOREIGN KEY(response_id) REFERENCES responses(id), FOREIGN KEY(test_eval_config_id) REFERENCES test_eval_configs(id));
+CREATE TABLE embeddings (id TEXT PRIMARY KEY, embedding TEXT NOT NULL);
+'''
+
+
+def _legacy_db(path, rows):
+    db = sqlite3.connect(path)
+    db.executescript(LEGACY_SCHEMA)
+    with db:
+        for sql, params in rows:
+            db.execute(sql, params)
+    db.close()
+
+
+LEGACY_ROWS = [
+    ("INSERT INTO datasources (name, description) VALUES (?, ?)", ("wiki", "articles")),
+    # An exact copy of the first datasource, merged into it
+    ("INSERT INTO datasources (name, description) VALUES (?, ?)", ("wiki", "articles")),
+    ("INSERT INTO datasources (name, description) VALUES (?, ?)", ("papers", None)),
+    ("INSERT INTO documents (datasource_id, name, location, source) VALUES (?, ?, ?, ?)", (1, "doc", "doc.pdf", "file")),
+    ("INSERT INTO documents (datasource_id, name, location, source) VALUES (?, ?, ?, ?)", (3, "paper", "paper.pdf", "file")),
+    ("INSERT INTO qasets (datasource_id, document_id, name, location, col_question, col_answer) VALUES (?, ?, ?, ?, ?, ?)",
+     (2, 1, "doc-qa", "doc.pdf", "question", "ground_truth")),
+    ("INSERT INTO questions (qaset_id, document_id, question, answer) VALUES (?, ?, ?, ?)", (1, 1, "q", "a")),
+    ("INSERT INTO test_runs (datasource_id, description, timestamp) VALUES (?, ?, ?)", (2, "run", "2024-01-01")),
+    ("INSERT INTO responses (test_run_id, question_id, response, timestamp) VALUES (?, ?, ?, ?)", (1, 1, "r", "2024-01-01")),
+    ("INSERT INTO contexts (response_id, text, similarity_score, sort_index) VALUES (?, ?, ?, ?)", (1, "c", 0.5, 0)),
+    ("INSERT INTO eval_functions (name, description, eval_function) VALUES (?, ?, ?)", ("dumps", "score", pickle.dumps(json.dumps))),
+    ("INSERT INTO test_eval_configs (test_run_id, eval_function_id) VALUES (?, ?)", (1, 1)),
+    ("INSERT INTO response_evals (test_run_id, question_id, response_id, test_eval_config_id, eval_score) VALUES (?, ?, ?, ?, ?)", (1, 1, 1, 1, 1.0)),
+    ("INSERT INTO embeddings (id, embedding) VALUES (?, ?)", ("node", "[1.0, 2.0]")),
+]
+
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+
+
+def _indexes(db):
+    return {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    _legacy_db(path, LEGACY_ROWS)
+    db = connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+
+    # 1: duplicates merged, references re-pointed, natural keys unique
+    assert db.execute('SELECT id, name FROM datasources ORDER BY id').fetchall() == [(1, "wiki"), (3, "papers")]
+    assert db.execute('SELECT datasource_id FROM qasets').fetchall() == [(1,)]
+    assert db.execute('SELECT datasource_id FROM test_runs').fetchall() == [(1,)]
+    assert {"ux_datasources_name", "ux_qasets_name", "ux_questions_qaset_id_question", "ux_response_evals_response_id_config_id"} <= _indexes(db)
+    # 2: embeddings packed
+    rows = db.execute('SELECT id, embedding FROM embeddings').fetchall()
+    assert [id for id, _ in rows] == ["node"]
+    assert isinstance(rows[0][1], bytes)
+    np.testing.assert_array_equal(unpack_embedding(rows[0][1]), [1.0, 2.0])
+    # 3: pickles replaced by import references with a code hash
+    eval_function, reference, code_hash = db.execute('SELECT eval_function, reference, code_hash FROM eval_functions').fetchone()
+    assert eval_function is None and reference == "json:dumps" and code_hash
+    # 4-7, 9: new columns
+    assert {"content_hash", "mtime"} <= _columns(db, "documents")
+    assert "node_id" in _columns(db, "contexts")
+    assert "relevant_ids" in _columns(db, "questions")
+    assert {"score_mean", "ci_half_width", "sample_count"} <= _columns(db, "test_eval_configs")
+    assert "question_sample_id" in _columns(db, "test_runs")
+    assert "node_hash" in _columns(db, "embeddings")
+    # 8: document names are unique per datasource
+    assert "ux_documents_datasource_id_name" in _indexes(db)
+    assert not {"ux_documents_name", "ix_documents_datasource_id"} & _indexes(db)
+    with db:
+        db.execute("INSERT INTO documents (datasource_id, name, location, source) VALUES (3, 'doc', 'doc.pdf', 'file')")
+    with pytest.raises(sqlite3.IntegrityError):
+        with db:
+            db.execute("INSERT INTO documents (datasource_id, name, location, source) VALUES (1, 'doc', 'doc.pdf', 'file')")
+    db.close()
+
+
+def test_conflicting_duplicates_abort_the_migration(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    _legacy_db(path, LEGACY_ROWS + [("INSERT INTO datasources (name, description) VALUES (?, ?)", ("wiki", "other articles"))])
+    with pytest.raises(RuntimeError, match="datasources"):
+        connect(path)
+    db = sqlite3.connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == 0
+    assert db.execute('SELECT COUNT(*) FROM datasources').fetchone()[0] == 4
+    db.close()
+
+
+def test_new_database_starts_at_the_latest_version(tmp_path):
+    path = str(tmp_path / "eval.db")
+    connect(path).close()
+    db = connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    assert {"ux_documents_datasource_id_name", "ux_response_evals_response_id_config_id"} <= _indexes(db)
+    db.close()
@@ -0,0 +1,62 @@
+import pytest
+
+from eval_data.models.context import ContextModel
+from eval_data.models.document import DocumentModel, DocumentType
+from eval_data.models.response import ResponseModel, ResponseType
+from eval_data.models.utils import insert_many
+from eval_data.tools import save_responses
+
+
+def test_insert_many_returns_consecutive_ids_in_row_order(db, run):
+    test_run_id, question_ids, _ = run
+    first = ResponseModel(db).add_responses([ResponseType(test_run_id, question_ids[0], "first")])
+    ids = ResponseModel(db).add_responses([ResponseType(test_run_id, question_id, f"r{question_id}") for question_id in question_ids])
+    assert ids == list(range(first[0] + 1, first[0] + 1 + len(question_ids)))
+    for id, question_id in zip(ids, question_ids):
+        assert db.execute('SELECT question_id, response FROM responses WHERE id = ?', (id,)).fetchone() == (question_id, f"r{question_id}")
+
+
+def test_insert_many_without_rows(db):
+    assert insert_many(db, 'INSERT INTO datasources (name) VALUES (?)', []) == []
+
+
+def test_insert_many_joins_the_open_transaction(db, run):
+    test_run_id, question_ids, _ = run
+    with pytest.raises(RuntimeError):
+        with db:
+            ResponseModel(db).add_responses([ResponseType(test_run_id, question_ids[0], "r")], autocommit=False)
+            raise RuntimeError("rolled back")
+    assert db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] == 0
+
+
+def test_save_responses_links_contexts_in_rank_order(db, run):
+    test_run_id, question_ids, _ = run
+    response_ids = save_responses(db, test_run_id, question_ids[:2], ["r1", "r2"],
+                                  [[("c1", 0.9, "n1"), ("c2", 0.5)], [("c3", 0.7, "n3")]])
+    contexts = [ContextModel(db).get_contexts_by_response_id(id) for id in response_ids]
+    assert [[(c.text, c.sort_index, c.node_id) for c in cs] for cs in contexts] == [
+        [("c1", 0, "n1"), ("c2", 1, None)],
+        [("c3", 0, "n3")],
+    ]
+
+
+def test_save_responses_rolls_back_responses_with_failed_contexts(db, run):
+    test_run_id, question_ids, _ = run
+    with pytest.raises(Exception):
+        save_responses(db, test_run_id, question_ids[:1], ["r1"], [[(None, 0.9)]])
+    assert db.execute('SELECT COUNT(*) FROM responses').fetchone()[0] == 0
+
+
+def test_sync_file_documents_deletes_stale_pages(db, run):
+    datasource_id = db.execute('SELECT id FROM datasources').fetchone()[0]
+    model = DocumentModel(db)
+    page = lambda name, location: DocumentType(datasource_id=datasource_id, name=name, location=location, source="file", content_hash="h1")
+    model.upsert_documents([page("doc_part_1", "doc.pdf"), page("doc_part_2", "doc.pdf"),
+                            page("old_part_0", "old.pdf"), page("kept_part_0", "kept.pdf")])
+
+    deleted = model.sync_file_documents(datasource_id, [page("doc_part_1", "doc.pdf")], ["doc.pdf", "old.pdf"])
+
+    # doc.pdf lost a page and old.pdf was removed; "doc" keeps its row as the qaset was generated from it
+    assert deleted == 2
+    names = {document.name for document in model.get_documents_by_datasource(datasource_id)}
+    assert names == {"doc", "doc_part_1", "kept_part_0"}
@@ -0,0 +1,112 @@
+import re
+
+import pytest
+
+from eval_data.database import query_plan
+from eval_data.models.context import ContextModel
+from eval_data.models.datasource import DatasourceModel
+from eval_data.models.document import DocumentModel
+from eval_data.models.embedding import EmbeddingModel, EmbeddingType
+from eval_data.models.evalfunction import EvalFunctionModel
+from eval_data.models.evalmemo import EvalMemoModel
+from eval_data.models.qaset import QASetModel
+from eval_data.models.question import QuestionModel
+from eval_data.models.questionembedding import QuestionEmbeddingModel
+from eval_data.models.questionsample import QuestionSampleModel, QuestionSampleType
+from eval_data.models.response import ResponseModel
+from eval_data.models.responseeval import ResponseEvalModel
+# Imported as modules so pytest does not try to collect the Test* model classes
+from eval_data.models import testeval, testevalconfig, testrun
+from eval_data.tools import iter_pending_evals, save_responses
+
+
+# Every lookup the models and tools run, called with the ids of the seeded run fixture.
+# get_all_* methods read whole tables by design and are left out.
+LOOKUPS = [
+    pytest.param(lambda db, s: DatasourceModel(db).get_datasource_by_id(s.datasource_id), id="get_datasource_by_id"),
+    pytest.param(lambda db, s: DatasourceModel(db).get_datasource_by_name("datasource"), id="get_datasource_by_name"),
+    pytest.param(lambda db, s: DocumentModel(db).get_document_by_id(s.document_id), id="get_document_by_id"),
+    pytest.param(lambda db, s: DocumentModel(db).get_document_by_name("doc"), id="get_document_by_name"),
+    pytest.param(lambda db, s: DocumentModel(db).get_document_by_name("doc", s.datasource_id), id="get_document_by_name in datasource"),
+    pytest.param(lambda db, s: DocumentModel(db).get_documents_by_datasource(s.datasource_id), id="get_documents_by_datasource"),
+    pytest.param(lambda db, s: DocumentModel(db).get_file_states(s.datasource_id), id="get_file_states"),
+    pytest.param(lambda db, s: DocumentModel(db).update_file_mtimes(s.datasource_id, {"doc.pdf": 1.0}), id="update_file_mtimes"),
+    pytest.param(lambda db, s: DocumentModel(db).sync_file_documents(s.datasource_id, [], ["doc.pdf"]), id="sync_file_documents"),
+    pytest.param(lambda db, s: QASetModel(db).get_qaset_by_id(s.qaset_id), id="get_qaset_by_id"),
+    pytest.param(lambda db, s: QASetModel(db).get_qaset_by_name("doc-qa"), id="get_qaset_by_name"),
+    pytest.param(lambda db, s: QASetModel(db).get_qasets_by_document_id(s.document_id), id="get_qasets_by_document_id"),
+    pytest.param(lambda db, s: QASetModel(db).get_qasets_by_datasource_id(s.datasource_id), id="get_qasets_by_datasource_id"),
+    pytest.param(lambda db, s: QuestionModel(db).get_question_by_id(s.question_ids[0]), id="get_question_by_id"),
+    pytest.param(lambda db, s: QuestionModel(db).get_questions_by_qaset_id(s.qaset_id), id="get_questions_by_qaset_id"),
+    pytest.param(lambda db, s: QuestionModel(db).count_questions_by_qaset_id(s.qaset_id), id="count_questions_by_qaset_id"),
+    pytest.param(lambda db, s: QuestionModel(db).get_questions_by_document_id(s.document_id), id="get_questions_by_document_id"),
+    pytest.param(lambda db, s: QuestionModel(db).set_relevant_ids({s.question_ids[2]: ["n3"]}), id="set_relevant_ids"),
+    pytest.param(lambda db, s: testrun.TestRunModel(db).get_test_run_by_id(s.test_run_id), id="get_test_run_by_id"),
+    pytest.param(lambda db, s: testrun.TestRunModel(db).get_test_run_by_name("run"), id="get_test_run_by_name"),
+    pytest.param(lambda db, s: testrun.TestRunModel(db).get_test_runs_by_datasource_id(s.datasource_id), id="get_test_runs_by_datasource_id"),
+    pytest.param(lambda db, s: ResponseModel(db).get_responses_by_test_run_id(s.test_run_id), id="get_responses_by_test_run_id"),
+    pytest.param(lambda db, s: ResponseModel(db).get_answered_question_ids(s.test_run_id), id="get_answered_question_ids"),
+    pytest.param(lambda db, s: ResponseModel(db).get_responses_by_question_id(s.question_ids[0]), id="get_responses_by_question_id"),
+    pytest.param(lambda db, s: ContextModel(db).get_contexts_by_response_id(s.response_ids[0]), id="get_contexts_by_response_id"),
+    pytest.param(lambda db, s: EvalFunctionModel(db).get_eval_function_by_name("dumps"), id="get_eval_function_by_name"),
+    pytest.param(lambda db, s: testevalconfig.TestEvalConfigModel(db).get_test_eval_config_by_id(s.config_ids[0]), id="get_test_eval_config_by_id"),
+    pytest.param(lambda db, s: testevalconfig.TestEvalConfigModel(db).get_test_eval_configs_by_test_run_id(s.test_run_id), id="get_test_eval_configs_by_test_run_id"),
+    pytest.param(lambda db, s: testevalconfig.TestEvalConfigModel(db).update_score_stats(s.config_ids[0], 0.5, 0.1, 2), id="update_score_stats"),
+    pytest.param(lambda db, s: testeval.TestEvalModel(db).get_test_evals_by_test_run_id(s.test_run_id), id="get_test_evals_by_test_run_id"),
+    pytest.param(lambda db, s: ResponseEvalModel(db).get_response_evals_by_test_run_id(s.test_run_id), id="get_response_evals_by_test_run_id"),
+    pytest.param(lambda db, s: ResponseEvalModel(db).get_response_evals_by_question_id(s.question_ids[0]), id="get_response_evals_by_question_id"),
+    pytest.param(lambda db, s: ResponseEvalModel(db).get_response_evals_by_response_id(s.response_ids[0]), id="get_response_evals_by_response_id"),
+    pytest.param(lambda db, s: ResponseEvalModel(db).get_response_evals_by_test_eval_config_id(s.config_ids[0]), id="get_response_evals_by_test_eval_config_id"),
+    pytest.param(lambda db, s: ResponseEvalModel(db).get_score_sums(s.config_ids), id="get_score_sums"),
+    pytest.param(lambda db, s: EmbeddingModel(db).get_embedding_by_id("n1"), id="get_embedding_by_id"),
+    pytest.param(lambda db, s: EmbeddingModel(db).find_embeddings(["n1", "n2"]), id="find_embeddings"),
+    pytest.param(lambda db, s: EmbeddingModel(db).find_embeddings(["n1"], node_hashes={"n1": "h1"}), id="find_embeddings by node hash"),
+    pytest.param(lambda db, s: EmbeddingModel(db).get_embeddings_by_ids(["n1"]), id="get_embeddings_by_ids"),
+    pytest.param(lambda db, s: EvalMemoModel(db).get_eval_scores("code", ["input"]), id="get_eval_scores"),
+    pytest.param(lambda db, s: QuestionEmbeddingModel(db).find_question_embeddings("model", ["hash"]), id="find_question_embeddings"),
+    pytest.param(lambda db, s: QuestionSampleModel(db).get_question_sample_by_id(s.question_sample_id), id="get_question_sample_by_id"),
+    pytest.param(lambda db, s: QuestionSampleModel(db).get_question_sample_by_name("sample"), id="get_question_sample_by_name"),
+    pytest.param(lambda db, s: QuestionSampleModel(db).get_questions(s.question_sample_id), id="get_questions of sample"),
+    pytest.param(lambda db, s: list(iter_pending_evals(db, s.test_run_id)), id="iter_pending_evals"),
+    pytest.param(lambda db, s: list(iter_pending_evals(db, s.test_run_id, test_eval_config_ids=s.config_ids[:1], seed=1, require_node_ids=True)),
+                 id="iter_pending_evals filtered"),
+]
+
+# Statements whose plans are checked; transaction control and PRAGMAs have none
+PLANNED = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+SCAN = re.compile(r"^SCAN (\w+)")
+# Sources that may be scanned: the CTE of iter_pending_evals and its alias in the outer query,
+# and json_each over a bound parameter
+TRIVIAL = {"pending", "p", "json_each"}
+
+
+class Seeded:
+    def __init__(self, db, run):
+        self.test_run_id, self.question_ids, self.config_ids = run
+        self.datasource_id, self.document_id, self.qaset_id = db.execute(
+            'SELECT datasource_id, document_id, id FROM qasets').fetchone()
+        self.response_ids = save_responses(db, self.test_run_id, self.question_ids, ["r1", "r2", "r3"],
+                                           [[("c1", 0.9, "n1")], [("c2", 0.8, "n2")], [("c3", 0.7)]])
+        EmbeddingModel(db).add_embeddings([EmbeddingType([1.0, 0.0], id="n1", node_hash="h1")])
+        self.question_sample_id = QuestionSampleModel(db).add_question_sample(QuestionSampleType("sample"), self.question_ids[:2])
+
+
+def _traced(db, call):
+    statements = []
+    db.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        db.set_trace_callback(None)
+    return [sql for sql in statements if PLANNED.match(sql)]
+
+
+@pytest.mark.parametrize("lookup", LOOKUPS)
+def test_lookup_uses_index(db, run, lookup):
+    seeded = Seeded(db, run)
+    statements = _traced(db, lambda: lookup(db, seeded))
+    assert statements
+    for sql in statements:
+        plan = query_plan(db, sql)
+        scans = [step for step in plan if (match := SCAN.match(step)) and match.group(1) not in TRIVIAL]
+        assert not scans, f"{sql}\n{plan}"
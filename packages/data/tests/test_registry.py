@@ -0,0 +1,57 @@
+import importlib
+import json
+import sys
+
+import pytest
+
+from eval_data.models.evalfunction import EvalFunctionModel, EvalFunctionType
+from eval_data.registry import function_code_hash
+
+
+VERSIONS = [
+    "def score(response):\n    return 1.0\n",
+    "def score(response):\n    # Rewritten\n    return 0.5\n",
+]
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    """ A module level eval function whose source can be rewritten and reloaded. """
+    path = tmp_path / "registry_eval_module.py"
+    path.write_text(VERSIONS[0])
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("registry_eval_module")
+    yield path, module
+    sys.modules.pop("registry_eval_module", None)
+
+
+def test_to_row_leaves_the_function_unchanged():
+    eval_function = EvalFunctionType("dumps", "score", json.dumps)
+    assert eval_function.to_row() == ("dumps", "score", None, None, None)
+    assert eval_function.reference is None and eval_function.code_hash is None
+
+
+def test_add_stores_the_reference_and_code_hash(db):
+    eval_function = EvalFunctionType("dumps", "score", json.dumps)
+    id = EvalFunctionModel(db).add_eval_function(eval_function)
+    assert (eval_function.reference, eval_function.code_hash) == ("json:dumps", function_code_hash(json.dumps))
+    assert db.execute('SELECT eval_function, reference, code_hash FROM eval_functions WHERE id = ?', (id,)).fetchone() == (
+        None, "json:dumps", function_code_hash(json.dumps))
+
+
+def test_redefined_function_replaces_the_cached_record(db, module):
+    path, module = module
+    model = EvalFunctionModel(db)
+    id = model.add_eval_function(EvalFunctionType("score", "score", module.score))
+    first = model.get_eval_function_by_id(id)
+    assert first.eval_function("r") == 1.0
+    assert model.get_eval_function_by_id(id) is first
+
+    path.write_text(VERSIONS[1])
+    importlib.reload(module)
+    assert function_code_hash(module.score) != first.code_hash
+
+    second = model.get_eval_function_by_id(id)
+    assert second is not first
+    assert second.eval_function is module.score
+    assert second.eval_function("r") == 0.5
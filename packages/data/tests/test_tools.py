@@ -0,0 +1,66 @@
+import random
+
+from eval_data.models.responseeval import ResponseEvalModel, ResponseEvalType
+from eval_data.tools import iter_pending_evals, save_responses
+
+
+def _save(db, run, count=None):
+    test_run_id, question_ids, _ = run
+    question_ids = (question_ids * 4)[:count or len(question_ids)]
+    return save_responses(db, test_run_id, question_ids, [f"r{i}" for i in range(len(question_ids))],
+                          [[(f"c{i}-0", 0.9, f"n{i}"), (f"c{i}-1", 0.5, f"m{i}")] for i in range(len(question_ids))])
+
+
+def _pending(db, test_run_id, **kwargs):
+    return [(p.response.id, p.test_eval_config_ids) for chunk in iter_pending_evals(db, test_run_id, **kwargs) for p in chunk]
+
+
+def test_pending_evals_cover_every_unscored_pair(db, run):
+    test_run_id, question_ids, config_ids = run
+    response_ids = _save(db, run)
+    chunks = list(iter_pending_evals(db, test_run_id))
+    assert len(chunks) == 1
+    pending = chunks[0]
+    assert [p.response.id for p in pending] == response_ids
+    assert [p.question.id for p in pending] == question_ids
+    assert all(p.test_eval_config_ids == config_ids for p in pending)
+    assert [[c.text for c in p.contexts] for p in pending] == [[f"c{i}-0", f"c{i}-1"] for i in range(len(response_ids))]
+
+
+def test_scored_pairs_are_not_pending(db, run):
+    test_run_id, question_ids, config_ids = run
+    response_ids = _save(db, run)
+    ResponseEvalModel(db).add_response_evals([
+        ResponseEvalType(test_run_id, question_ids[0], response_ids[0], config_ids[0], 1.0),
+        ResponseEvalType(test_run_id, question_ids[1], response_ids[1], config_ids[0], 0.0),
+        ResponseEvalType(test_run_id, question_ids[1], response_ids[1], config_ids[1], 0.5),
+    ])
+    assert _pending(db, test_run_id) == [(response_ids[0], [config_ids[1]]), (response_ids[2], config_ids)]
+    assert _pending(db, test_run_id, test_eval_config_ids=[config_ids[0]]) == [(response_ids[2], [config_ids[0]])]
+
+
+def test_pending_evals_come_in_chunks(db, run):
+    test_run_id, _, _ = run
+    response_ids = _save(db, run, count=10)
+    chunks = list(iter_pending_evals(db, test_run_id, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert [p.response.id for chunk in chunks for p in chunk] == response_ids
+    assert all(len(p.contexts) == 2 for chunk in chunks for p in chunk)
+
+
+def test_seed_fixes_a_permutation_of_the_responses(db, run):
+    test_run_id, _, _ = run
+    response_ids = _save(db, run, count=12)
+    shuffled = _pending(db, test_run_id, seed=7)
+    assert shuffled == _pending(db, test_run_id, seed=7, chunk_size=5)
+    expected = list(response_ids)
+    random.Random(7).shuffle(expected)
+    assert [id for id, _ in shuffled] == expected != response_ids
+
+
+def test_require_node_ids_plans_only_scorable_responses(db, run):
+    test_run_id, question_ids, _ = run
+    response_ids = save_responses(db, test_run_id, question_ids, ["r1", "r2", "r3"],
+                                  [[("c1", 0.9, "n1")], [("c2", 0.9, "n2"), ("c3", 0.5)], [("c4", 0.9, "n4")]])
+    # The second response has a context without a node id and the third question has no relevant ids
+    assert [id for id, _ in _pending(db, test_run_id, require_node_ids=True)] == response_ids[:1]
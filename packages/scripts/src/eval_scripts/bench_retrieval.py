@@ -0,0 +1,95 @@
+import argparse
+import time
+import uuid
+from typing import List, Tuple
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from .retriever import normalize, top_k
+
+CHROMA_BATCH_SIZE = 5000
+
+
+def synthetic_nodes(count: int, dimension: int, seed: int = 0) -> List[TextNode]:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimension), dtype=np.float32)
+    return [TextNode(id_=str(i), text=f"node {i}", embedding=vector.tolist()) for i, vector in enumerate(vectors)]
+
+
+def database_nodes(path: str, datasource_id: int) -> List[TextNode]:
+    from eval_data.database import connect
+    from eval_data.models.document import DocumentModel
+    from .database import embed_nodes
+    from .documents import load_documents
+
+    db = connect(path)
+    nodes = load_documents(db, DocumentModel(db).get_documents_by_datasource(datasource_id))
+    embed_nodes(db, nodes)
+    return nodes
+
+
+def timed(func, *args, **kwargs) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_numpy(matrix: np.ndarray, queries: np.ndarray, k: int) -> Tuple[float, float, np.ndarray]:
+    build, normalized = timed(normalize, matrix)
+    search, (indices, _) = timed(top_k, normalize(queries), normalized, k)
+    return build, search, indices
+
+
+def bench_chroma(ids: List[str], matrix: np.ndarray, queries: np.ndarray, k: int) -> Tuple[float, float, List[List[str]]]:
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(f"bench-{uuid.uuid4().hex}", metadata={"hnsw:space": "cosine"})
+
+    def build():
+        for i in range(0, len(ids), CHROMA_BATCH_SIZE):
+            collection.add(ids=ids[i:i+CHROMA_BATCH_SIZE], embeddings=matrix[i:i+CHROMA_BATCH_SIZE].tolist())
+
+    build_time, _ = timed(build)
+    search_time, result = timed(collection.query, query_embeddings=queries.tolist(), n_results=k, include=[])
+    client.delete_collection(collection.name)
+    return build_time, search_time, result["ids"]
+
+
+def main():
+    """ Times index building and a batch of top k searches for both backends. Query vectors are
+    pre-computed, so encoding is not measured; Chroma's recall is measured against the exact NumPy top k. """
+    parser = argparse.ArgumentParser(description="Benchmark NumpyRetriever against Chroma")
+    parser.add_argument("--nodes", type=int, default=20000, help="Number of synthetic nodes")
+    parser.add_argument("--dimension", type=int, default=384, help="Dimension of the synthetic vectors")
+    parser.add_argument("--db", help="Benchmark the nodes of a datasource in this database instead of synthetic ones")
+    parser.add_argument("--datasource-id", type=int)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    nodes = database_nodes(args.db, args.datasource_id) if args.db else synthetic_nodes(args.nodes, args.dimension)
+    ids = [node.id_ for node in nodes]
+    matrix = np.array([node.embedding for node in nodes], dtype=np.float32)
+    # Queries are perturbed node vectors, so each one has clear nearest neighbours
+    rng = np.random.default_rng(1)
+    sample = rng.choice(len(nodes), size=min(args.queries, len(nodes)), replace=False)
+    queries = matrix[sample] + rng.standard_normal((len(sample), matrix.shape[1]), dtype=np.float32) * matrix.std()
+
+    numpy_build, numpy_search, exact = bench_numpy(matrix, queries, args.k)
+    chroma_build, chroma_search, approximate = bench_chroma(ids, matrix, queries, args.k)
+    recall = np.mean([
+        len({ids[i] for i in exact_row} & set(approximate_row)) / len(exact_row)
+        for exact_row, approximate_row in zip(exact, approximate)
+    ])
+
+    print(f"{len(nodes)} nodes x {matrix.shape[1]} dimensions, {len(queries)} queries, k={args.k}")
+    print(f"{'':8}{'build (s)':>12}{'search (s)':>12}{'queries/s':>12}")
+    for name, build, search in (("numpy", numpy_build, numpy_search), ("chroma", chroma_build, chroma_search)):
+        print(f"{name:8}{build:12.3f}{search:12.3f}{len(queries) / search:12.0f}")
+    print(f"chroma recall@{args.k} against exact search: {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
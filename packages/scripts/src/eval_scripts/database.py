@@ -1,24 +1,86 @@
 from sqlite3 import Connection
-from llama_index.core.schema import TextNode
+from typing import AbstractSet, List, Optional
+from llama_index.core.schema import Document, MetadataMode, TextNode
 
+from eval_data.models.document import DocumentModel, DocumentType
 from eval_data.models.embedding import EmbeddingModel, EmbeddingType
+from eval_data.models.qaset import QASetModel, QASetType
+
+from .embeddings import Encoder, get_encoder
 
 
 from logging import getLogger
 logger = getLogger(__name__)
 
-def upsert_text_node(db: Connection, text: str, id: str, embedding) -> TextNode:
-    logger.info(f"upsert_text_node: {id}")
-    embed_model = EmbeddingModel(db)
-    if embed := embed_model.get_embedding_by_id(id):
-        embedding_value = embed.embedding
-    else:
-        logger.info(f"new embedding for {id}")
-        embedding_value = embedding
-        embed_model.add_embedding(EmbeddingType(id=id, embedding=embedding_value))
-    
-    return TextNode(
-        id_=id,
-        text=text,
-        embedding=embedding_value
-    )
\ No newline at end of file
+def upsert_text_nodes(db: Connection, texts: List[str], ids: List[str], encoder: Optional[Encoder] = None) -> List[TextNode]:
+    """ Builds text nodes using the stored embeddings of unchanged texts, encoding and saving only the others. """
+    nodes = [TextNode(id_=id, text=text) for text, id in zip(texts, ids)]
+    embed_nodes(db, nodes, encoder=encoder)
+    return nodes
+
+
+def embed_nodes(db: Optional[Connection], nodes: List[TextNode], changed_ids: AbstractSet[str] = frozenset(), encoder: Optional[Encoder] = None):
+    """ Fills in the embeddings of nodes that have none, or whose id is in changed_ids.
+
+    A stored embedding is reused only when it was computed from a node with the same hash; the
+    remaining nodes are encoded in one call and saved with their hashes, replacing stale vectors.
+    """
+    missing = [node for node in nodes if node.embedding is None or node.id_ in changed_ids]
+    if not missing:
+        return
+    embed_model = EmbeddingModel(db) if db else None
+    stored = embed_model.find_embeddings([node.id_ for node in missing], node_hashes={node.id_: node.hash for node in missing}) if embed_model else {}
+    for node in missing:
+        if node.id_ in stored:
+            node.embedding = stored[node.id_].tolist()
+    to_encode = [node for node in missing if node.id_ not in stored]
+    logger.info(f"embed_nodes: {len(stored)} stored, {len(to_encode)} to encode")
+    if not to_encode:
+        return
+    embeddings = (encoder or get_encoder()).encode([node.get_content(metadata_mode=MetadataMode.EMBED) for node in to_encode])
+    for node, embedding in zip(to_encode, embeddings):
+        node.embedding = embedding.tolist()
+    if embed_model:
+        embed_model.upsert_embeddings([EmbeddingType(id=node.id_, embedding=embedding, node_hash=node.hash) for node, embedding in zip(to_encode, embeddings)])
+
+
+def document_name(doc: Document) -> str:
+    """ Names a document loaded from a file after its path and, for paged files, its page label. """
+    path = doc.metadata.get("file_path") or doc.metadata.get("file_name") or doc.id_
+    if page := doc.metadata.get("page_label"):
+        return f"{path}#{page}"
+    return path
+
+
+def add_or_get_document(db: Connection, doc: Document, datasource_id: int) -> DocumentType:
+    """ Returns the document row of a file document, adding it on first sight. """
+    document_model = DocumentModel(db)
+    name = document_name(doc)
+    if document := document_model.get_document_by_name(name, datasource_id):
+        return document
+    document = DocumentType(
+        datasource_id=datasource_id,
+        name=name,
+        location=doc.metadata.get("file_path", name),
+        source="file",
+    )
+    document.id = document_model.add_document(document)
+    return document
+
+
+def add_or_get_qaset(db: Connection, doc: Document, datasource_id: int, document_id: int) -> QASetType:
+    """ Returns the QA set generated from a file document, adding it on first sight. """
+    qaset_model = QASetModel(db)
+    name = f"{document_name(doc)}-qa"
+    if qaset := qaset_model.get_qaset_by_name(name):
+        return qaset
+    qaset = QASetType(
+        datasource_id=datasource_id,
+        document_id=document_id,
+        name=name,
+        location=doc.metadata.get("file_path", name),
+        col_question="question",
+        col_answer="ground_truth",
+    )
+    qaset.id = qaset_model.add_qaset(qaset)
+    return qaset
@@ -1,38 +1,163 @@
+import hashlib
+import multiprocessing
 import os
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 from sqlite3 import Connection
 from llama_index.core.readers import SimpleDirectoryReader
 from llama_index.core.schema import Document, TextNode
 
-from eval_data.models.document import DocumentType
-from eval_scripts.hface import load_huggingface_document
+from eval_data.models.document import DocumentModel, DocumentType
+from eval_scripts.hface import DEFAULT_BATCH_SIZE, DEFAULT_QUEUE_SIZE, iter_huggingface_document
 
-from .embeddings import get_embeddings
+from .database import document_name
+from .embeddings import Encoder, get_encoder
 
 from logging import getLogger
 logger = getLogger(__name__)
 
+DEFAULT_EXTS = (".pdf",)
 
-def empty_set() -> List[TextNode]:
-    return [TextNode(text="empty set", id_="empty-set", embedding=get_embeddings("empty set"))]
 
+def empty_set(encoder: Optional[Encoder] = None) -> List[TextNode]:
+    return [TextNode(text="empty set", id_="empty-set", embedding=(encoder or get_encoder()).encode(["empty set"])[0].tolist())]
 
-def load_documents(db: Connection, doclist: List[DocumentType]) -> List[TextNode]:
-    documents = []
+
+def load_documents(db: Connection, doclist: List[DocumentType], encoder: Optional[Encoder] = None) -> List[TextNode]:
+    return list(iter_documents(db, doclist, encoder=encoder))
+
+
+def iter_documents(db: Connection, doclist: List[DocumentType], batch_size: int = DEFAULT_BATCH_SIZE, queue_size: int = DEFAULT_QUEUE_SIZE,
+                   encoder: Optional[Encoder] = None, processes: Optional[int] = None) -> Iterator[TextNode]:
+    """ Streams the nodes of every document; HuggingFace sources are embedded and saved batch_size nodes at a time,
+    files are parsed after them across a process pool. """
+    # Each page of a file is a document row of its own; the file is read once
+    locations = {}
     for doc in doclist:
         if doc.source == "huggingface":
-            documents.extend(load_huggingface_document(db, doc))
+            yield from iter_huggingface_document(db, doc, batch_size=batch_size, queue_size=queue_size, encoder=encoder)
         elif doc.source == "file":
-            documents.extend(load_documents_from_path(doc.location))
+            locations[doc.location] = None
         else:
             raise ValueError(f"Unknown source: {doc.source}")
-    return documents
+    for path_data in locations:
+        yield from read_files(find_files(path_data), processes=processes)
+
+
+def find_files(path_data: str, required_exts: Sequence[str] = DEFAULT_EXTS) -> List[str]:
+    """ Lists the files under a directory, recursively and in a stable order, or the path itself when it is a file. """
+    if not os.path.isdir(path_data):
+        return [path_data]
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path_data)
+        for name in names
+        if name.lower().endswith(tuple(required_exts))
+    )
+
+
+def read_file(path: str) -> List[Document]:
+    """ Parses one file into documents, one per page for PDFs, with ids derived from the file path so they are stable across runs. Runs in the ingestion worker processes. """
+    return SimpleDirectoryReader(input_files=[path], filename_as_id=True).load_data()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_changed_file(path: str, known_hash: Optional[str]) -> Tuple[str, Optional[List[Document]]]:
+    """ Hashes a file and parses it unless its content matches known_hash. """
+    content_hash = file_hash(path)
+    if content_hash == known_hash:
+        return content_hash, None
+    return content_hash, read_file(path)
+
+
+def _process_pool(processes: Optional[int]) -> ProcessPoolExecutor:
+    # Spawned workers, so a parent that holds an encoder model or threads is not forked
+    return ProcessPoolExecutor(max_workers=processes or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+
+def read_files(paths: Sequence[str], processes: Optional[int] = None) -> Iterator[Document]:
+    """ Parses each file once, spreading several files across a process pool, and yields their pages in file order. """
+    if len(paths) <= 1 or processes == 1:
+        for path in paths:
+            yield from read_file(path)
+        return
+    with _process_pool(processes) as pool:
+        for docs in pool.map(read_file, paths):
+            yield from docs
+
+
+def load_documents_from_path(path_data: str, processes: Optional[int] = None) -> List[Document]:
+    """ Parses every file under path_data, spreading several files across a process pool. """
+    return list(read_files(find_files(path_data), processes=processes))
+
+
+def _missing_files(path_data: str, known: Iterable[str], files: Sequence[str]) -> List[str]:
+    """ Lists the known locations under path_data that are no longer among its files. """
+    prefix = os.path.join(path_data, "")
+    found = set(files)
+    return [location for location in known
+            if (location == path_data or location.startswith(prefix)) and location not in found]
+
+
+def ingest_directory(db: Connection, path_data: str, datasource_id: int, processes: Optional[int] = None) -> List[Document]:
+    """ Parses the new and changed files under path_data into documents of the datasource and returns their pages.
 
+    Files whose mtime matches the one stored with their documents are skipped without being read.
+    The others are hashed and, when their content hash changed, parsed in a process pool; their
+    pages are saved as documents with the new content_hash and mtime. Pages that changed files no
+    longer have, and the pages of files removed from path_data, are deleted.
+    """
+    document_model = DocumentModel(db)
+    states = document_model.get_file_states(datasource_id)
+    files = find_files(path_data)
+    missing = _missing_files(path_data, states, files)
+    candidates = {}
+    for path in files:
+        known_hash, known_mtime = states.get(path, (None, None))
+        mtime = os.path.getmtime(path)
+        if known_hash is None or mtime != known_mtime:
+            candidates[path] = (known_hash, mtime)
+    logger.info(f"Ingesting {path_data}: {len(candidates)} new or modified files, {len(files) - len(candidates)} unchanged, {len(missing)} removed")
+    if not candidates and not missing:
+        return []
 
-def load_documents_from_path(path_data: str) -> List[Document]:
-    if os.path.isdir(path_data):
-        reader = SimpleDirectoryReader(input_dir=path_data, num_files_limit=1, required_exts=[".pdf"])
-    else:
-        reader = SimpleDirectoryReader(input_files=[path_data], num_files_limit=1, required_exts=[".pdf"])
-    return reader.load_data()
+    changed: List[Document] = []
+    parsed = []
+    touched = {}
+    rows = []
+    with _process_pool(processes) as pool:
+        futures = {pool.submit(_read_changed_file, path, known_hash): path for path, (known_hash, _) in candidates.items()}
+        for future in as_completed(futures):
+            path = futures[future]
+            mtime = candidates[path][1]
+            try:
+                content_hash, docs = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to read {path}: {e}")
+                continue
+            if docs is None:
+                # Touched but not modified
+                touched[path] = mtime
+                continue
+            parsed.append(path)
+            changed.extend(docs)
+            rows.extend(DocumentType(
+                datasource_id=datasource_id,
+                name=document_name(doc),
+                location=path,
+                source="file",
+                content_hash=content_hash,
+                mtime=mtime,
+            ) for doc in docs)
 
+    deleted = document_model.sync_file_documents(datasource_id, rows, parsed + missing)
+    document_model.update_file_mtimes(datasource_id, touched)
+    logger.info(f"Ingested {len(changed)} pages from {len(parsed)} files, deleted {deleted} stale pages")
+    return changed
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import time
+from queue import Empty, Queue
+from threading import Event, Thread, local
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .embeddings import MODEL_NAME, Encoder
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/eval-embed.sock"
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT_MS = 5
+
+_HEADER = struct.Struct("!I")
+
+
+def _send_message(sock: socket.socket, header: dict, payload: bytes = b""):
+    """ Sends a length-prefixed JSON header followed by a raw payload of header["size"] bytes. """
+    header = json.dumps({**header, "size": len(payload)}).encode()
+    sock.sendall(_HEADER.pack(len(header)) + header + payload)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _recv_message(sock: socket.socket) -> Optional[Tuple[dict, bytes]]:
+    """ Receives one message, or None when the peer closed the connection. """
+    if (prefix := _recv_exactly(sock, _HEADER.size)) is None:
+        return None
+    header = json.loads(_recv_exactly(sock, _HEADER.unpack(prefix)[0]))
+    payload = _recv_exactly(sock, header["size"]) if header["size"] else b""
+    return header, payload
+
+
+class _Job:
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[str] = None
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Local embedding daemon that keeps one model resident and serves it over a Unix socket, merging concurrent requests into micro-batches. """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, encoder: Optional[Encoder] = None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+        self.socket_path = socket_path
+        self.encoder = encoder or Encoder()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.jobs: Queue = Queue()
+        self.batcher = Thread(target=self._run_batcher, daemon=True)
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        logger.info(f"Loading {self.encoder.model_name}")
+        self.dimension = self.encoder.dimension
+        self.batcher.start()
+        logger.info(f"Serving embeddings on {self.socket_path}")
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            os.unlink(self.socket_path)
+
+    def submit(self, texts: List[str]) -> _Job:
+        job = _Job(texts)
+        self.jobs.put(job)
+        job.done.wait()
+        return job
+
+    def _run_batcher(self):
+        while True:
+            jobs = [self.jobs.get()]
+            count = len(jobs[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch_size and (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    jobs.append(self.jobs.get(timeout=timeout))
+                except Empty:
+                    break
+                count += len(jobs[-1].texts)
+
+            try:
+                embeddings = self.encoder.encode([text for job in jobs for text in job.texts])
+                start = 0
+                for job in jobs:
+                    job.result = embeddings[start:start+len(job.texts)]
+                    start += len(job.texts)
+            except Exception as e:
+                logger.exception("Embedding batch failed")
+                for job in jobs:
+                    job.error = str(e)
+            for job in jobs:
+                job.done.set()
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """ Serves requests on one client connection until the client disconnects. """
+
+    def handle(self):
+        while message := _recv_message(self.request):
+            header, _ = message
+            job = self.server.submit(header["texts"]) if header["texts"] else None
+            if job and job.error:
+                _send_message(self.request, {"error": job.error})
+            else:
+                result = job.result if job else np.empty((0, self.server.dimension), dtype=np.float32)
+                _send_message(self.request, {"rows": result.shape[0], "dim": self.server.dimension},
+                              np.ascontiguousarray(result, dtype=np.float32).tobytes())
+
+
+class RemoteEncoder(Encoder):
+    """ Encoder that delegates to a running EmbeddingServer instead of loading a model in this process. """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        super().__init__()
+        self.socket_path = socket_path
+        self._connections = local()
+        self._dimension = None
+
+    @property
+    def model(self):
+        raise RuntimeError("RemoteEncoder has no local model; the model is held by the embedding server")
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.encode([]).shape[1]
+        return self._dimension
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        sock = self._connection()
+        try:
+            _send_message(sock, {"texts": list(texts)})
+            message = _recv_message(sock)
+        except OSError:
+            self._connections.sock = None
+            raise
+        if message is None:
+            self._connections.sock = None
+            raise ConnectionError(f"Embedding server at {self.socket_path} closed the connection")
+        header, payload = message
+        if "error" in header:
+            raise RuntimeError(f"Embedding server error: {header['error']}")
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["rows"], header["dim"])
+
+    def _connection(self) -> socket.socket:
+        """ One persistent connection per thread, so concurrent callers are batched together by the server. """
+        if getattr(self._connections, "sock", None) is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self._connections.sock = sock
+        return self._connections.sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve sentence embeddings over a Unix socket")
+    parser.add_argument("--socket", default=os.environ.get("EVAL_EMBED_SOCKET", DEFAULT_SOCKET_PATH))
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = EmbeddingServer(args.socket, Encoder(model_name=args.model), args.max_batch_size, args.max_wait_ms)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
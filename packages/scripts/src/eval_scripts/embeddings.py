@@ -1,6 +1,167 @@
-from sentence_transformers import SentenceTransformer
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Iterable, List, Optional, Union
 
-model = SentenceTransformer('all-MiniLM-L6-v2')  # Smaller and efficient for sentence embeddings
+import numpy as np
 
-def get_embeddings(text):
-    return model.encode(text).tolist()
\ No newline at end of file
+MODEL_NAME = 'all-MiniLM-L6-v2'  # Smaller and efficient for sentence embeddings
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_CHUNK_SIZE = 1024
+
+# Number of worker processes for the shared encoder; more than 1 selects the MultiProcessEncoder
+EMBED_PROCESSES = int(os.environ.get("EVAL_EMBED_PROCESSES", "1"))
+# Unix socket of a running embedding server (python -m eval_scripts.embed_server); used by the shared encoder when present
+EMBED_SOCKET = os.environ.get("EVAL_EMBED_SOCKET")
+
+
+class Encoder:
+    """ Sentence embedding service that loads its model on first use.
+
+    Inputs are sorted by length and encoded in batches of similar length to minimise padding,
+    and the output rows are returned in the input order.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = DEFAULT_BATCH_SIZE, device: Optional[str] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+        self._lock = Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        """ Encodes the texts into a (len(texts), dimension) float32 matrix. """
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Longest first, so batches hold texts of similar length and memory peaks on the first batch
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        for start in range(0, len(texts), self.batch_size):
+            bucket = order[start:start+self.batch_size]
+            embeddings[bucket] = self.model.encode([texts[i] for i in bucket], batch_size=len(bucket), convert_to_numpy=True)
+        return embeddings
+
+
+class MultiProcessEncoder(Encoder):
+    """ Encoder that shards its input across worker processes, each holding one copy of the model.
+
+    Inputs are sorted by length before sharding so every chunk pads little, chunks are handed out
+    to idle workers as they finish, and the results are reassembled in the input order.
+    """
+
+    def __init__(self, processes: Optional[int] = None, model_name: str = MODEL_NAME, batch_size: int = DEFAULT_BATCH_SIZE,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, threads_per_process: Optional[int] = None):
+        super().__init__(model_name=model_name, batch_size=batch_size, device="cpu")
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.threads_per_process = threads_per_process or max(1, os.cpu_count() // self.processes)
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        # torch is not fork safe once its thread pool has started
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.model_name, self.batch_size, self.threads_per_process),
+                    )
+        return self._pool
+
+    @property
+    def dimension(self) -> int:
+        return self.pool.submit(_worker_dimension).result()
+
+    def encode(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        # Small inputs are split evenly so that every worker gets a share
+        chunk_size = min(self.chunk_size, -(-len(texts) // self.processes))
+        chunks = [order[start:start+chunk_size] for start in range(0, len(texts), chunk_size)]
+        results = self.pool.map(_encode_chunk, [[texts[i] for i in chunk] for chunk in chunks])
+
+        embeddings = None
+        for chunk, result in zip(chunks, results):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), result.shape[1]), dtype=np.float32)
+            embeddings[chunk] = result
+        return embeddings
+
+    def close(self):
+        """ Shuts down the worker processes. """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_worker_encoder: Optional[Encoder] = None
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    global _worker_encoder
+    import torch
+    torch.set_num_threads(threads)
+    _worker_encoder = Encoder(model_name=model_name, batch_size=batch_size, device="cpu")
+    _worker_encoder.model
+
+
+def _encode_chunk(texts: List[str]) -> np.ndarray:
+    return _worker_encoder.encode(texts)
+
+
+def _worker_dimension() -> int:
+    return _worker_encoder.dimension
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """ Scales the rows to unit length as a contiguous float32 matrix; zero rows stay zero. """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+_encoder: Optional[Encoder] = None
+
+
+def get_encoder() -> Encoder:
+    """ Returns the shared encoder, creating it on first use. """
+    global _encoder
+    if _encoder is None:
+        if EMBED_SOCKET and os.path.exists(EMBED_SOCKET):
+            from .embed_server import RemoteEncoder
+            _encoder = RemoteEncoder(EMBED_SOCKET)
+        elif EMBED_PROCESSES > 1:
+            _encoder = MultiProcessEncoder(processes=EMBED_PROCESSES)
+        else:
+            _encoder = Encoder()
+    return _encoder
+
+
+def set_encoder(encoder: Encoder):
+    """ Replaces the shared encoder used by get_embeddings. """
+    global _encoder
+    _encoder = encoder
+
+
+def get_embeddings(text: Union[str, Iterable[str]]) -> Union[List[float], List[List[float]]]:
+    if isinstance(text, str):
+        return get_encoder().encode([text])[0].tolist()
+    return get_encoder().encode(text).tolist()
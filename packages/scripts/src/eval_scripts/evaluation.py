@@ -0,0 +1,347 @@
+import hashlib
+import json
+import math
+from collections import defaultdict
+from statistics import NormalDist
+from sqlite3 import Connection
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from eval_data.models.evalfunction import EvalFunctionModel
+from eval_data.models.evalmemo import EvalMemoModel, EvalMemoType
+from eval_data.models.responseeval import ResponseEvalModel, ResponseEvalType
+from eval_data.models.testevalconfig import TestEvalConfigModel
+from eval_data.registry import function_code_hash
+from eval_data.tools import PendingEval, iter_pending_evals
+
+from .retrieval_eval import evaluate_retrieval, is_retrieval_eval
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 32
+DEFAULT_TARGET_HALF_WIDTH = 0.02
+DEFAULT_CONFIDENCE = 0.95
+# Scores a metric needs before its confidence interval is trusted to stop it
+DEFAULT_MIN_SAMPLES = 30
+
+
+def evaluate_test_run(db: Connection, test_run_id: int, chunk_size: int = DEFAULT_CHUNK_SIZE, use_memo: bool = True) -> "EvalStats":
+    """ Scores every response of a test run that is missing a score for one of its test eval configs; returns the saved, memo hit and memo miss counts. """
+    functions = load_eval_functions(db, test_run_id)
+    stats = EvalStats()
+    retrieval = {config_id: func for config_id, func in functions.items() if is_retrieval_eval(func)}
+    if retrieval:
+        stats.saved += evaluate_retrieval(db, test_run_id, retrieval)
+
+    passes: Dict[int, Dict[int, Callable]] = defaultdict(dict)
+    for config_id, func in functions.items():
+        if config_id not in retrieval:
+            passes[getattr(func, "chunk_size", None) or chunk_size][config_id] = func
+
+    memo = EvalMemo(db, {config_id: func for configs in passes.values() for config_id, func in configs.items()}) if use_memo else None
+    response_eval_model = ResponseEvalModel(db)
+    for pass_chunk_size, pass_functions in passes.items():
+        config_ids = list(pass_functions) if len(pass_functions) < len(functions) else None
+        for chunk in iter_pending_evals(db, test_run_id, test_eval_config_ids=config_ids, chunk_size=pass_chunk_size):
+            response_evals = evaluate_chunk(test_run_id, chunk, pass_functions, memo, stats)
+            response_eval_model.add_response_evals(response_evals)
+            if memo:
+                memo.flush()
+            stats.saved += len(response_evals)
+            logger.info(f"Test run {test_run_id}: {stats}")
+    record_score_stats(db, list(functions))
+    return stats
+
+
+def evaluate_adaptive(db: Connection, test_run_id: int, target_half_width: float = DEFAULT_TARGET_HALF_WIDTH, budget: Optional[int] = None,
+                      confidence: float = DEFAULT_CONFIDENCE, min_samples: int = DEFAULT_MIN_SAMPLES, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      seed: int = 0, use_memo: bool = True) -> Dict[int, "ScoreStats"]:
+    """ Scores a random sample of the responses of a test run, stopping each metric once its mean is known well enough.
+
+    Pending responses are evaluated in a random order fixed by the seed, chunk_size at a time, so
+    the scores gathered so far are a simple random sample of the pending responses, as the normal
+    confidence interval assumes. The running mean and variance of every test eval config is updated
+    with each chunk, starting from the scores it already has. A config stops once it has min_samples
+    scores and the half-width of its confidence interval is at most target_half_width, or once it
+    has scored budget responses in this call; chunks are trimmed so it never scores more. Retrieval
+    metrics are cheap and are scored in full. The reached mean, half-width and sample count are
+    recorded on the test_eval_configs rows. Returns them by test eval config id.
+    """
+    functions = load_eval_functions(db, test_run_id)
+    retrieval = {config_id: func for config_id, func in functions.items() if is_retrieval_eval(func)}
+    if retrieval:
+        evaluate_retrieval(db, test_run_id, retrieval)
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    running = load_score_stats(db, list(functions), confidence)
+    spent: Dict[int, int] = defaultdict(int)
+
+    def finished(config_id: int) -> bool:
+        stats = running[config_id]
+        if stats.count >= min_samples and stats.half_width(z) <= target_half_width:
+            return True
+        return budget is not None and spent[config_id] >= budget
+
+    active = {config_id: func for config_id, func in functions.items() if config_id not in retrieval and not finished(config_id)}
+    memo = EvalMemo(db, active) if use_memo else None
+    response_eval_model = ResponseEvalModel(db)
+    test_eval_config_model = TestEvalConfigModel(db)
+    eval_stats = EvalStats()
+    def assign(config_ids: List[int]) -> List[int]:
+        # Configs that stopped drop out of the rest of the planned work, and none is given more than its budget
+        assigned = [c for c in config_ids if c in active and (budget is None or spent[c] < budget)]
+        for config_id in assigned:
+            spent[config_id] += 1
+        return assigned
+
+    if active:
+        for chunk in iter_pending_evals(db, test_run_id, test_eval_config_ids=list(active), chunk_size=chunk_size, seed=seed):
+            chunk = [p._replace(test_eval_config_ids=assign(p.test_eval_config_ids)) for p in chunk]
+            chunk = [p for p in chunk if p.test_eval_config_ids]
+            response_evals = evaluate_chunk(test_run_id, chunk, active, memo, eval_stats)
+            response_eval_model.add_response_evals(response_evals)
+            if memo:
+                memo.flush()
+
+            scores: Dict[int, List[float]] = defaultdict(list)
+            for response_eval in response_evals:
+                scores[response_eval.test_eval_config_id].append(response_eval.eval_score)
+            for config_id, config_scores in scores.items():
+                running[config_id].add(config_scores)
+                stats = running[config_id]
+                test_eval_config_model.update_score_stats(config_id, stats.mean, stats.finite_half_width(z), stats.count)
+            for config_id in [c for c in active if finished(c)]:
+                logger.info(f"Test run {test_run_id}: config {config_id} stopped at {running[config_id]}")
+                del active[config_id]
+            if not active:
+                break
+
+    logger.info(f"Test run {test_run_id}: {eval_stats}")
+    return record_score_stats(db, list(functions), confidence)
+
+
+class ScoreStats:
+    """ Running count, mean and sum of squared deviations of a metric's scores (Welford), updated a batch at a time. """
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0, confidence: float = DEFAULT_CONFIDENCE):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.confidence = confidence
+
+    @staticmethod
+    def from_sums(count: int, total: float, squares: float, confidence: float = DEFAULT_CONFIDENCE) -> "ScoreStats":
+        if not count:
+            return ScoreStats(confidence=confidence)
+        mean = total / count
+        return ScoreStats(count, mean, max(squares - total * mean, 0.0), confidence)
+
+    def add(self, scores: Iterable[float]):
+        """ Merges a batch of scores, combining the batch mean and variance with the running ones. """
+        scores = list(scores)
+        if not scores:
+            return
+        count = len(scores)
+        mean = sum(scores) / count
+        m2 = sum((score - mean) ** 2 for score in scores)
+        delta = mean - self.mean
+        total = self.count + count
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else math.inf
+
+    def half_width(self, z: Optional[float] = None) -> float:
+        """ Half-width of the normal confidence interval of the mean. """
+        if z is None:
+            z = NormalDist().inv_cdf((1 + self.confidence) / 2)
+        return z * math.sqrt(self.variance / self.count) if self.count > 1 else math.inf
+
+    def finite_half_width(self, z: Optional[float] = None) -> Optional[float]:
+        half_width = self.half_width(z)
+        return half_width if math.isfinite(half_width) else None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'ci_half_width': self.finite_half_width()
+        }
+
+    def __repr__(self):
+        return f"mean {self.mean:.4f} ± {self.half_width():.4f} over {self.count} scores"
+
+
+def load_score_stats(db: Connection, test_eval_config_ids: List[int], confidence: float = DEFAULT_CONFIDENCE) -> Dict[int, ScoreStats]:
+    """ Computes the score stats of test eval configs from their saved response evals. """
+    sums = ResponseEvalModel(db).get_score_sums(test_eval_config_ids)
+    return {config_id: ScoreStats.from_sums(*sums.get(config_id, (0, 0.0, 0.0)), confidence=confidence) for config_id in test_eval_config_ids}
+
+
+def record_score_stats(db: Connection, test_eval_config_ids: List[int], confidence: float = DEFAULT_CONFIDENCE) -> Dict[int, ScoreStats]:
+    """ Records the score mean, confidence interval half-width and sample count of test eval configs on their rows. """
+    stats = load_score_stats(db, test_eval_config_ids, confidence)
+    test_eval_config_model = TestEvalConfigModel(db)
+    for config_id, config_stats in stats.items():
+        if config_stats.count:
+            test_eval_config_model.update_score_stats(config_id, config_stats.mean, config_stats.finite_half_width(), config_stats.count)
+    return stats
+
+
+class EvalStats:
+    """ Counts the response evals saved by an evaluation run and how many of them came from the memo. """
+    def __init__(self):
+        self.saved = 0
+        self.hits = 0
+        self.misses = 0
+
+    def to_dict(self):
+        return {
+            'saved': self.saved,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def __repr__(self):
+        return f"{self.saved} response evals saved, {self.hits} memo hits, {self.misses} memo misses"
+
+
+class EvalMemo:
+    """ Looks up and records eval scores keyed by (eval function code hash, normalized input hash). """
+    def __init__(self, db: Connection, functions: Dict[int, Callable]):
+        self.model = EvalMemoModel(db)
+        self.code_hashes = {config_id: memo_code_hash(func) for config_id, func in functions.items()}
+        self.input_hashes: Dict[int, str] = {}
+        self.pending: List[EvalMemoType] = []
+
+    def input_hash(self, pending: PendingEval) -> str:
+        if (digest := self.input_hashes.get(pending.response.id)) is None:
+            digest = self.input_hashes[pending.response.id] = memo_input_hash(pending)
+        return digest
+
+    def lookup(self, config_id: int, rows: List[PendingEval]) -> Dict[int, float]:
+        """ Returns the memoized scores of a config for the rows that have one, keyed by response id. """
+        scores = self.model.get_eval_scores(self.code_hashes[config_id], {self.input_hash(p) for p in rows})
+        return {p.response.id: scores[self.input_hash(p)] for p in rows if self.input_hash(p) in scores}
+
+    def record(self, config_id: int, rows: List[PendingEval], scores: List[float]):
+        self.pending.extend(
+            EvalMemoType(self.code_hashes[config_id], self.input_hash(p), score)
+            for p, score in zip(rows, scores)
+        )
+
+    def flush(self):
+        if self.pending:
+            self.model.add_eval_memos(self.pending)
+            self.pending = []
+        # Responses are not revisited after their chunk
+        self.input_hashes.clear()
+
+
+def memo_code_hash(func: Callable) -> str:
+    """ Hashes the code of an eval function together with the batch evaluator that scores it, if any. """
+    evaluator = getattr(func, "batch_evaluator", None)
+    if evaluator is None:
+        return function_code_hash(func)
+    return hashlib.sha256(f"{function_code_hash(func)}:{function_code_hash(evaluator)}".encode()).hexdigest()
+
+
+def memo_input_hash(pending: PendingEval) -> str:
+    """ Hashes the question, answer, ordered contexts and ground truth of a row with whitespace normalized. """
+    def normalize(text: Optional[str]) -> str:
+        return " ".join((text or "").split())
+    inputs = [
+        normalize(pending.question.question),
+        normalize(pending.response.response),
+        [normalize(c.text) for c in pending.contexts],
+        normalize(pending.question.answer),
+    ]
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False, separators=(',', ':')).encode()).hexdigest()
+
+
+def load_eval_functions(db: Connection, test_run_id: int) -> Dict[int, Callable]:
+    """ Returns the eval function of every test eval config of the run, keyed by test eval config id. """
+    eval_function_model = EvalFunctionModel(db)
+    return {
+        config.id: eval_function_model.get_eval_function_by_id(config.eval_function_id).eval_function
+        for config in TestEvalConfigModel(db).get_test_eval_configs_by_test_run_id(test_run_id)
+    }
+
+
+def evaluate_chunk(test_run_id: int, chunk: List[PendingEval], functions: Dict[int, Callable],
+                   memo: Optional[EvalMemo] = None, stats: Optional[EvalStats] = None) -> List[ResponseEvalType]:
+    """ Scores a chunk of pending responses, grouping the configs that can share a batch evaluator call. """
+    def response_eval(config_id: int, pending: PendingEval, score: float) -> ResponseEvalType:
+        return ResponseEvalType(
+            test_run_id=test_run_id,
+            question_id=pending.question.id,
+            response_id=pending.response.id,
+            test_eval_config_id=config_id,
+            eval_score=score
+        )
+
+    rows_by_config: Dict[int, List[PendingEval]] = defaultdict(list)
+    for pending in chunk:
+        for config_id in pending.test_eval_config_ids:
+            rows_by_config[config_id].append(pending)
+
+    response_evals = []
+    if memo:
+        for config_id in list(rows_by_config):
+            rows = rows_by_config[config_id]
+            hits = memo.lookup(config_id, rows)
+            response_evals.extend(response_eval(config_id, p, hits[p.response.id]) for p in rows if p.response.id in hits)
+            rows_by_config[config_id] = [p for p in rows if p.response.id not in hits]
+            if stats:
+                stats.hits += len(hits)
+                stats.misses += len(rows) - len(hits)
+            if not rows_by_config[config_id]:
+                del rows_by_config[config_id]
+
+    # Configs that score the same rows with the same batch evaluator are evaluated in one call
+    groups: Dict[Tuple, List[int]] = defaultdict(list)
+    for config_id, rows in rows_by_config.items():
+        evaluator = getattr(functions[config_id], "batch_evaluator", None)
+        key = (evaluator or config_id, tuple(p.response.id for p in rows))
+        groups[key].append(config_id)
+
+    for config_ids in groups.values():
+        rows = rows_by_config[config_ids[0]]
+        try:
+            scores = score_rows([functions[config_id] for config_id in config_ids], rows)
+        except Exception as e:
+            logger.warning(f"Eval configs {config_ids} failed on {len(rows)} responses: {e}")
+            continue
+        for config_id, config_scores in zip(config_ids, scores):
+            # None and NaN mark rows the function failed on; they stay pending and are retried on the next run
+            scored = [(p, float(score)) for p, score in zip(rows, config_scores) if score is not None and math.isfinite(score)]
+            if len(scored) < len(rows):
+                logger.warning(f"Eval config {config_id} returned no score for {len(rows) - len(scored)} of {len(rows)} responses")
+            response_evals.extend(response_eval(config_id, p, score) for p, score in scored)
+            if memo:
+                memo.record(config_id, [p for p, _ in scored], [score for _, score in scored])
+    return response_evals
+
+
+def score_rows(funcs: List[Callable], rows: List[PendingEval]) -> List[List[float]]:
+    """ Runs eval functions over the rows and returns one list of scores per function. """
+    inputs = dict(
+        questions=[p.question.question for p in rows],
+        contexts=[[c.text for c in p.contexts] for p in rows],
+        answers=[p.response.response for p in rows],
+        ground_truths=[p.question.answer for p in rows],
+    )
+    if len(funcs) > 1:
+        # Configs of the same metric would give the evaluator's result duplicate columns, so each metric is scored once
+        metrics = {func.metric.name: func.metric for func in funcs}
+        scores = dict(zip(metrics, funcs[0].batch_evaluator(list(metrics.values()), **inputs)))
+        return [scores[func.metric.name] for func in funcs]
+    scores = funcs[0](**inputs)
+    if not hasattr(scores, "__len__"):
+        # Eval functions written for single rows return a bare score
+        if len(rows) != 1:
+            raise TypeError(f"{funcs[0].__name__} returned a single score for {len(rows)} rows")
+        scores = [scores]
+    return [list(scores)]
@@ -1,18 +1,36 @@
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sqlite3 import Connection
+from threading import Lock
 from ragas.testset.generator import TestsetGenerator
 from ragas.testset.evolutions import simple, reasoning, multi_context
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from typing import Tuple, List, Dict, Any
+from langchain_core.embeddings import Embeddings
+from typing import Tuple, List, Dict, Any, Callable, Iterator, Optional
 from datasets import Dataset
 from abc import ABC, abstractmethod
 from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.schema import Document
+
+from eval_data.models.question import QuestionModel
+from eval_data.tools import save_question_answers
+
+from .database import add_or_get_document, add_or_get_qaset
+from .llm_cache import cached_chat_openai, cached_openai_embeddings
 
 from logging import getLogger
 logger = getLogger(__name__)
 
-def initialize_generator() -> Tuple[TestsetGenerator, OpenAIEmbeddings]:
-    generator_llm = ChatOpenAI(model="gpt-4o-mini")
-    critic_llm = ChatOpenAI(model="gpt-4o")
-    embeddings = OpenAIEmbeddings()
+DEFAULT_GENERATION_CONCURRENCY = 4
+DEFAULT_TOKENS_PER_MINUTE = 150_000
+# Rough cost of generating and critiquing one question, on top of reading the documents once
+TOKENS_PER_QUESTION = 2_000
+
+def initialize_generator() -> Tuple[TestsetGenerator, Embeddings]:
+    # Calls go through the LLM cache (EVAL_LLM_CACHE_MODE), so re-running on the same documents is free
+    generator_llm = cached_chat_openai(model="gpt-4o-mini")
+    critic_llm = cached_chat_openai(model="gpt-4o")
+    embeddings = cached_openai_embeddings()
     generator = TestsetGenerator.from_langchain(
         generator_llm,
         critic_llm,
@@ -27,6 +45,101 @@ def generate_testset(documents: List[Dict[str, Any]], test_size: int) -> Dataset
     return generator.generate_with_llamaindex_docs(documents, test_size=test_size, distributions={simple: 0.5, reasoning: 0.25, multi_context: 0.25}).to_dataset()
 
 
+class TokenBucket:
+    """ Thread safe rate limiter handing out at most tokens_per_minute tokens, refilled continuously. """
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self, tokens: int):
+        """ Blocks until the tokens are available; requests above the capacity wait for a full bucket. """
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def estimate_tokens(documents: List[Document], test_size: int) -> int:
+    """ Estimates the tokens used to generate test_size questions from the documents, at about 4 characters per token. """
+    return sum(len(doc.text) for doc in documents) // 4 + test_size * TOKENS_PER_QUESTION
+
+
+def iter_testsets(groups: List[List[Document]], test_size: int,
+                  concurrency: int = DEFAULT_GENERATION_CONCURRENCY,
+                  tokens_per_minute: Optional[int] = DEFAULT_TOKENS_PER_MINUTE,
+                  generate: Callable[[List[Document], int], Dataset] = generate_testset) -> Iterator[Tuple[int, Dataset]]:
+    """ Generates a test set for each group of documents on a thread pool, yielding (group index, dataset) as each one finishes.
+
+    At most `concurrency` groups are generated at once, and each group waits for its estimated
+    tokens from a tokens_per_minute bucket before it starts. Groups that fail are logged and skipped.
+    """
+    bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def run(group: List[Document]) -> Dataset:
+        if bucket:
+            bucket.acquire(estimate_tokens(group, test_size))
+        return generate(group, test_size)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = iter(enumerate(groups))
+        in_flight = {}
+        while True:
+            for index, group in pending:
+                in_flight[pool.submit(run, group)] = index
+                if len(in_flight) >= concurrency:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    dataset = future.result()
+                except Exception as e:
+                    logger.warning(f"Test set generation failed for group {index}: {e}")
+                    continue
+                yield index, dataset
+
+
+def generate_qasets(db: Connection, documents: List[Document], datasource_id: int, test_size: int = 5,
+                    concurrency: int = DEFAULT_GENERATION_CONCURRENCY,
+                    tokens_per_minute: Optional[int] = DEFAULT_TOKENS_PER_MINUTE) -> int:
+    """ Generates a QA set for every document that has no questions yet, saving each one as soon as it is generated.
+
+    Documents and their QA sets are registered up front; generation fans out through iter_testsets
+    while the questions are saved from the calling thread. Returns the number of questions saved.
+    """
+    question_model = QuestionModel(db)
+    targets = []
+    for doc in documents:
+        document = add_or_get_document(db, doc, datasource_id)
+        qaset = add_or_get_qaset(db, doc, datasource_id, document.id)
+        if question_model.count_questions_by_qaset_id(qaset.id) == 0:
+            targets.append((doc, qaset))
+    logger.info(f"Generating QA sets for {len(targets)} documents, {len(documents) - len(targets)} already populated")
+
+    count = 0
+    for index, dataset in iter_testsets([[doc] for doc, _ in targets], test_size, concurrency, tokens_per_minute):
+        qaset = targets[index][1]
+        if "question" not in dataset.column_names or "ground_truth" not in dataset.column_names:
+            logger.warning(f"No questions and answers generated for QASet {qaset.name}: {dataset.column_names}")
+            continue
+        count_new, _ = save_question_answers(db, dataset["question"], dataset["ground_truth"], qaset)
+        count += count_new
+    logger.info(f"Saved {count} questions")
+    return count
+
+
 class AbstractGenerator(ABC):
     @abstractmethod
     def __init__(self, nodes: List[Dataset]):
@@ -34,4 +147,13 @@ class AbstractGenerator(ABC):
 
     @abstractmethod
     def query(self, query: str) -> RESPONSE_TYPE:
-        pass
\ No newline at end of file
+        pass
+
+    def query_batch(self, queries: List[str]) -> List[RESPONSE_TYPE]:
+        """ Optional batched variant of query, returning one response per query in order. Override it to embed and search
+        many queries at once; the default calls query for each one. """
+        return [self.query(query) for query in queries]
+
+    async def aquery(self, query: str) -> RESPONSE_TYPE:
+        """ Optional async variant of query. Override it for generators with a native async client; the default runs query in a thread. """
+        return await asyncio.to_thread(self.query, query)
\ No newline at end of file
@@ -1,11 +1,14 @@
+import ast
 from datasets import load_dataset
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+from queue import Full, Queue
+from threading import Event, Thread
 from sqlite3 import Connection
 from llama_index.core.schema import TextNode
 from eval_data.models.qaset import QASetType
 from eval_data.models.document import DocumentType
-from .database import upsert_text_node
-from .embeddings import get_embeddings
+from .database import upsert_text_nodes
+from .embeddings import Encoder
 
 from logging import getLogger
 logger = getLogger(__name__)
@@ -25,38 +28,106 @@ def load_qa_dataset(qaset: QASetType):
 
     return test_questions, test_answers
 
-def load_huggingface_document(db: Connection, document: DocumentType) -> List[TextNode]:
+
+def load_qa_relevant_ids(qaset: QASetType, column: str = "relevant_passage_ids") -> List[Optional[List[str]]]:
+    """ Loads the gold passages of every question as the node ids given to them by iter_huggingface_texts.
+
+    The column may hold lists or their string form, e.g. BioASQ's "[9797007, 11431184]". The ids are
+    prefixed with the QA set's document id, so the document must be loaded with col_id set to the
+    passage id column. Questions without the column value get None.
+    """
+    location = qaset.location.split(";")
+    dataset_dict = load_dataset(location[0], location[1] if len(location) > 1 else None)
+    dataset = dataset_dict[list(dataset_dict.keys())[0]]
+
+    relevant_ids = []
+    for value in dataset[column]:
+        if isinstance(value, str):
+            value = ast.literal_eval(value) if value.strip() else None
+        relevant_ids.append([f"{qaset.document_id}_{id}" for id in value] if value is not None else None)
+    return relevant_ids
+
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_QUEUE_SIZE = 4
+
+_END = object()
+
+
+def load_huggingface_document(db: Connection, document: DocumentType, batch_size: int = DEFAULT_BATCH_SIZE, queue_size: int = DEFAULT_QUEUE_SIZE,
+                              encoder: Optional[Encoder] = None) -> List[TextNode]:
+    return list(iter_huggingface_document(db, document, batch_size=batch_size, queue_size=queue_size, encoder=encoder))
+
+
+def iter_huggingface_document(db: Connection, document: DocumentType, batch_size: int = DEFAULT_BATCH_SIZE, queue_size: int = DEFAULT_QUEUE_SIZE,
+                              encoder: Optional[Encoder] = None) -> Iterator[TextNode]:
+    """ Streams text nodes from a HuggingFace document, embedding and persisting them one batch at a time.
+
+    A reader thread fills a queue of at most queue_size batches while the calling thread embeds the
+    uncached texts of the current batch and saves them, so memory is bounded by the batch size.
+    Pass a MultiProcessEncoder to spread the embedding of each batch across CPU cores.
+    """
     logger.info(f"load_huggingface_document: {document.location}")
+    batches = Queue(maxsize=queue_size)
+    stop = Event()
+    reader = Thread(target=_read_batches, args=(document, batch_size, batches, stop), daemon=True)
+    reader.start()
+
+    count = 0
+    try:
+        while (batch := batches.get()) is not _END:
+            if isinstance(batch, Exception):
+                raise batch
+            ids, texts = batch
+            yield from upsert_text_nodes(db, texts, ids, encoder=encoder)
+            count += len(ids)
+            logger.info(f"loaded {count} text nodes from {document.location}")
+    finally:
+        stop.set()
+
+
+def iter_huggingface_texts(document: DocumentType) -> Iterator[Tuple[str, str]]:
+    """ Yields (node id, text) pairs from a streamed HuggingFace dataset. """
     location = document.location.split(";")
     path = location[0]
     name = location[1] if len(location) > 1 else None
     doc_dict = load_dataset(path=path, name=name, streaming=True)
 
-    logger.info(f"collecting text nodes from {document.location}")
-    nodes = []
-    texts = []
-    ids = []
-
     for i, doc in enumerate(doc_dict[list(doc_dict.keys())[0]]):
-        logger.info(f"loading document {i}")
+        logger.debug(f"loading document {i}")
         if doc[document.col_text]:
             try:
                 id = f"{document.id}_{doc[document.col_id] if document.col_id and document.col_id in doc else i}"
                 if isinstance(doc[document.col_text], list):
                     for j, text in enumerate(doc[document.col_text]):
-                        texts.append(text)
-                        ids.append(f"{id}_{j}")
+                        yield f"{id}_{j}", text
                 else:
-                    texts.append(doc[document.col_text])
-                    ids.append(id)
+                    yield id, doc[document.col_text]
             except Exception as e:
                 logger.warning(f"Error loading document: {e}")
 
-    # Get embeddings for all texts in a single batch
-    embeddings = get_embeddings(texts)
 
-    # Create text nodes with embeddings
-    for text, id, embedding in zip(texts, ids, embeddings):
-        nodes.append(upsert_text_node(db, text, id, embedding))
+def _read_batches(document: DocumentType, batch_size: int, batches: Queue, stop: Event):
+    """ Reader stage: groups streamed texts into (ids, texts) batches and hands them over through a bounded queue. """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
 
-    return nodes
+    try:
+        ids, texts = [], []
+        for id, text in iter_huggingface_texts(document):
+            ids.append(id)
+            texts.append(text)
+            if len(ids) >= batch_size:
+                if not put((ids, texts)):
+                    return
+                ids, texts = [], []
+        if ids and not put((ids, texts)):
+            return
+        put(_END)
+    except Exception as e:
+        put(e)
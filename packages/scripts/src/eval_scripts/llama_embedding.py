@@ -0,0 +1,39 @@
+from typing import List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from .embeddings import MODEL_NAME, Encoder, get_encoder
+
+
+class EncoderEmbedding(BaseEmbedding):
+    """ llama_index embedding model backed by an eval_scripts Encoder.
+
+    Uses the shared encoder by default, so a query engine reuses the model already loaded for the
+    documents, or the embedding server when EVAL_EMBED_SOCKET is set, instead of loading its own copy.
+    """
+    _encoder: Optional[Encoder] = PrivateAttr(default=None)
+
+    def __init__(self, encoder: Optional[Encoder] = None, **kwargs):
+        super().__init__(model_name=MODEL_NAME, **kwargs)
+        self._encoder = encoder
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EncoderEmbedding"
+
+    @property
+    def encoder(self) -> Encoder:
+        return self._encoder or get_encoder()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.encoder.encode([query])[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self.encoder.encode([text])[0].tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self.encoder.encode(texts).tolist()
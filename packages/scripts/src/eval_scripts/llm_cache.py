@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.embeddings import Embeddings
+from langchain_core.load import dumps, loads
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import (
+    LLM,
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+PASSTHROUGH = "passthrough"
+MODES = (RECORD, REPLAY, PASSTHROUGH)
+
+# record: serve cached calls and store new ones; replay: serve cached calls only, misses raise; passthrough: no cache
+LLM_CACHE_MODE = os.environ.get("EVAL_LLM_CACHE_MODE", RECORD)
+LLM_CACHE_PATH = os.environ.get("EVAL_LLM_CACHE_PATH", "llm_cache.db")
+# The query engine LLM is the system under test, so its calls are only cached on request: otherwise a rerun would measure the cache
+LLM_CACHE_QUERY_ENGINE = os.environ.get("EVAL_LLM_CACHE_QUERY_ENGINE", "0") == "1"
+
+
+class ReplayMiss(KeyError):
+    """ Raised in replay mode for a call that was never recorded. """
+
+
+def call_key(kind: str, model: str, params: Any, prompt: str) -> str:
+    """ Hashes the kind of call, the model, its parameters and the prompt into a cache key. """
+    data = json.dumps([kind, model, params, prompt], sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class LLMCache:
+    """ On-disk SQLite store of LLM and embedding call results keyed by call_key, shared by every wrapped client and safe across threads. """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, mode: str = LLM_CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode}, expected one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._db = None
+        if mode != PASSTHROUGH:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS llm_calls (
+                                    key TEXT PRIMARY KEY,
+                                    kind TEXT NOT NULL,
+                                    model TEXT NOT NULL,
+                                    response TEXT NOT NULL,
+                                    created_at INTEGER NOT NULL
+                                ) WITHOUT ROWID''')
+            self._db.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != PASSTHROUGH
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        """ Returns the stored responses of the keys that have one. In replay mode a missing key raises ReplayMiss. """
+        if not self.enabled or not keys:
+            return {}
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(keys), 900):
+                chunk = keys[i:i+900]
+                cursor = self._db.execute(f'''SELECT key, response FROM llm_calls
+                                             WHERE key IN ({', '.join('?' * len(chunk))})''', chunk)
+                found.update(cursor.fetchall())
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        if self.mode == REPLAY and len(found) < len(keys):
+            missing = next(key for key in keys if key not in found)
+            raise ReplayMiss(f"No recorded call for key {missing} in {self.path}")
+        return found
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, kind: str, model: str, responses: Dict[str, str]):
+        """ Stores responses by key; only record mode writes. """
+        if self.mode != RECORD or not responses:
+            return
+        now = int(time.time())
+        with self._lock, self._db:
+            self._db.executemany('''INSERT OR REPLACE INTO llm_calls (key, kind, model, response, created_at)
+                                    VALUES (?, ?, ?, ?, ?)''', [(key, kind, model, response, now) for key, response in responses.items()])
+
+    def put(self, key: str, kind: str, model: str, response: str):
+        self.put_many(kind, model, {key: response})
+
+    def clear(self):
+        if self.enabled:
+            with self._lock, self._db:
+                self._db.execute('DELETE FROM llm_calls')
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> LLMCache:
+    """ Returns the process wide cache configured by EVAL_LLM_CACHE_MODE and EVAL_LLM_CACHE_PATH. """
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+        if _cache.mode == REPLAY:
+            # Replayed runs never reach the API, but the OpenAI clients refuse to be built without a key
+            os.environ.setdefault("OPENAI_API_KEY", "replay")
+        logger.info(f"LLM cache: {_cache.mode} ({_cache.path})")
+    return _cache
+
+
+def set_llm_cache(cache: LLMCache):
+    """ Replaces the process wide cache, e.g. to switch a notebook to replay mode. """
+    global _cache
+    _cache = cache
+
+
+class LangchainLLMCache(BaseCache):
+    """ langchain cache for chat and completion models; langchain keys each call by prompt and llm_string, which holds the model and its parameters. """
+
+    def __init__(self, cache: Optional[LLMCache] = None):
+        self.cache = cache or get_llm_cache()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        response = self.cache.get(call_key("llm", "", llm_string, prompt))
+        return loads(response) if response is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.cache.put(call_key("llm", "", llm_string, prompt), "llm", llm_string[:200], dumps(list(return_val)))
+
+    def clear(self, **kwargs: Any) -> None:
+        self.cache.clear()
+
+
+class CachedEmbeddings(Embeddings):
+    """ langchain embeddings that serve cached vectors and embed only the texts seen for the first time, in one call. """
+
+    def __init__(self, embeddings: Embeddings, cache: Optional[LLMCache] = None):
+        self.embeddings = embeddings
+        self.cache = cache or get_llm_cache()
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+
+    def _embed(self, kind: str, texts: List[str], embed) -> List[List[float]]:
+        keys = [call_key(kind, self.model, None, text) for text in texts]
+        found = {key: json.loads(value) for key, value in self.cache.get_many(keys).items()}
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = embed(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self.cache.put_many(kind, self.model, {key: json.dumps(list(vector)) for key, vector in computed.items()})
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("embed_documents", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("embed_query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+
+class CachedLLM(CustomLLM):
+    """ llama_index LLM that serves cached completions and chat replies of a wrapped LLM, e.g. the one behind a query engine. """
+    _llm: LLM = PrivateAttr()
+    _cache: LLMCache = PrivateAttr()
+
+    def __init__(self, llm: LLM, cache: Optional[LLMCache] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._llm = llm
+        self._cache = cache or get_llm_cache()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        model = self._llm.metadata.model_name
+        key = call_key("complete", model, [_sampling_params(self._llm), kwargs], prompt)
+        if (text := self._cache.get(key)) is None:
+            text = self._llm.complete(prompt, formatted=formatted, **kwargs).text
+            self._cache.put(key, "complete", model, text)
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+        yield CompletionResponse(text=response.text, delta=response.text)
+
+    def _chat_key(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> str:
+        prompt = json.dumps([[m.role, m.content, m.additional_kwargs] for m in messages], default=str, separators=(',', ':'))
+        return call_key("chat", self._llm.metadata.model_name, [_sampling_params(self._llm), kwargs], prompt)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        if (text := self._cache.get(key)) is None:
+            text = self._llm.chat(messages, **kwargs).message.content or ""
+            self._cache.put(key, "chat", self._llm.metadata.model_name, text)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        if (text := self._cache.get(key)) is None:
+            text = (await self._llm.achat(messages, **kwargs)).message.content or ""
+            self._cache.put(key, "chat", self._llm.metadata.model_name, text)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        response = self.chat(messages, **kwargs)
+        yield ChatResponse(message=response.message, delta=response.message.content)
+
+
+def _sampling_params(llm: LLM) -> Dict[str, Any]:
+    """ The parameters of a llama_index LLM that change its output; credentials and endpoints are left out of the key. """
+    params = llm.to_dict()
+    return {name: params.get(name) for name in ("class_name", "model", "temperature", "max_tokens", "top_p", "additional_kwargs")}
+
+
+def cached_chat_openai(model: str, cache: Optional[LLMCache] = None, **kwargs) -> ChatOpenAI:
+    """ Builds a ChatOpenAI client whose calls go through the LLM cache. """
+    cache = cache or get_llm_cache()
+    if not cache.enabled:
+        return ChatOpenAI(model=model, **kwargs)
+    return ChatOpenAI(model=model, cache=LangchainLLMCache(cache), **kwargs)
+
+
+def cached_openai_embeddings(cache: Optional[LLMCache] = None, **kwargs) -> Embeddings:
+    """ Builds OpenAIEmbeddings whose calls go through the LLM cache. """
+    cache = cache or get_llm_cache()
+    embeddings = OpenAIEmbeddings(**kwargs)
+    return CachedEmbeddings(embeddings, cache) if cache.enabled else embeddings
+
+
+def cached_llama_llm(llm: Optional[LLM] = None, cache: Optional[LLMCache] = None, enabled: bool = LLM_CACHE_QUERY_ENGINE) -> LLM:
+    """ Wraps a llama_index LLM, by default the global Settings.llm, with the LLM cache when enabled.
+
+    Query engines answer the test questions with this LLM, so it is returned as is unless the caller
+    passes enabled=True or sets EVAL_LLM_CACHE_QUERY_ENGINE=1.
+    """
+    llm = llm or Settings.llm
+    if not enabled:
+        return llm
+    cache = cache or get_llm_cache()
+    return CachedLLM(llm, cache) if cache.enabled else llm
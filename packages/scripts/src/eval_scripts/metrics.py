@@ -0,0 +1,10 @@
+from typing import Any, Callable
+
+
+def eval_attributes(**attributes: Any) -> Callable[[Callable], Callable]:
+    """ Decorator that sets attributes read by the evaluation runner on an eval function, e.g. metric and batch_evaluator. """
+    def decorator(func: Callable) -> Callable:
+        for name, value in attributes.items():
+            setattr(func, name, value)
+        return func
+    return decorator
@@ -6,9 +6,10 @@ from datasets import Dataset
 from llama_index.core.indices import VectorStoreIndex
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.service_context import ServiceContext
-from llama_index.core.readers import SimpleDirectoryReader
 from typing import List, Dict, Any
 
+from eval_scripts.llm_cache import cached_llama_llm
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -17,7 +18,7 @@ def build_query_engine(documents: List[Dict[str, Any]]) -> BaseQueryEngine:
         documents,
         service_context=ServiceContext.from_defaults(chunk_size=512),
     )
-    return vector_index.as_query_engine(similarity_top_k=3)
+    return vector_index.as_query_engine(similarity_top_k=3, llm=cached_llama_llm())
 
 def generate_responses(query_engine: VectorStoreIndex, test_questions: List[str], test_answers: List[str] | None) -> Dataset:
     
@@ -38,12 +39,3 @@ def generate_responses(query_engine: VectorStoreIndex, test_questions: List[str]
     if test_answers is not None:
         dataset_dict["ground_truth"] = test_answers
     return Dataset.from_dict(dataset_dict)
-
-
-def load_documents(path_data: str) -> List[Dict[str, Any]]:
-    if os.path.isdir(path_data):
-        reader = SimpleDirectoryReader(input_dir=path_data, num_files_limit=1, required_exts=[".pdf"])
-    else:
-        reader = SimpleDirectoryReader(input_files=[path_data], num_files_limit=1, required_exts=[".pdf"])
-    return reader.load_data()
-
@@ -12,6 +12,8 @@ from llama_index.core.node_parser import SimpleNodeParser
 from datasets import Dataset, load_dataset
 from llama_index.core.schema import TextNode
 
+from eval_scripts.llm_cache import cached_llama_llm
+
 PATH_OUT = "tests/data/output/completions/sample"
 
 def main():
@@ -56,7 +58,7 @@ def build_query_engine(nodes, persist_dir="./storage"):
         # Persist the index
         vector_index.storage_context.persist(persist_dir=persist_dir)
 
-    query_engine = vector_index.as_query_engine(similarity_top_k=3)
+    query_engine = vector_index.as_query_engine(similarity_top_k=3, llm=cached_llama_llm())
     return query_engine
 
 
@@ -8,13 +8,16 @@ import pandas as pd
 from langchain_community.document_loaders import DirectoryLoader
 from ragas.testset.generator import TestsetGenerator
 from ragas.testset.evolutions import simple, reasoning, multi_context
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 from llama_index.core.indices import VectorStoreIndex
 from llama_index.core.base.base_query_engine import BaseQueryEngine
-from llama_index.core.readers import SimpleDirectoryReader
 from llama_index.core.service_context import ServiceContext
 from typing import Tuple, List, Dict, Any
 
+from eval_scripts.documents import load_documents_from_path
+from eval_scripts.generator import iter_testsets
+from eval_scripts.llm_cache import cached_chat_openai, cached_openai_embeddings
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -32,7 +35,7 @@ def main():
     PATH_DATA = os.path.abspath(sys.argv[1])
     
     logging.info("Loading documents from path: %s", PATH_DATA)
-    documents = load_documents(PATH_DATA)
+    documents = load_documents_from_path(PATH_DATA)
     # id, metadata[page_label, file_name, file_path], text
     
     logging.info("Generating test set from documents (Question, Answer/Ground-Truth")
@@ -51,17 +54,10 @@ def main():
         logging.info("Data server is not available")
 
 
-def load_documents(path_data: str) -> List[Dict[str, Any]]:
-    if os.path.isdir(path_data):
-        reader = SimpleDirectoryReader(input_dir=path_data, num_files_limit=1, required_exts=[".pdf"])
-    else:
-        reader = SimpleDirectoryReader(input_files=[path_data], num_files_limit=1, required_exts=[".pdf"])
-    return reader.load_data()
-
-def initialize_generator() -> Tuple[TestsetGenerator, OpenAIEmbeddings]:
-    generator_llm = ChatOpenAI(model="gpt-3.5-turbo-16k")
-    critic_llm = ChatOpenAI(model="gpt-4")
-    embeddings = OpenAIEmbeddings()
+def initialize_generator() -> Tuple[TestsetGenerator, Embeddings]:
+    generator_llm = cached_chat_openai(model="gpt-3.5-turbo-16k")
+    critic_llm = cached_chat_openai(model="gpt-4")
+    embeddings = cached_openai_embeddings()
     generator = TestsetGenerator.from_langchain(
         generator_llm,
         critic_llm,
@@ -69,18 +65,18 @@ def initialize_generator() -> Tuple[TestsetGenerator, OpenAIEmbeddings]:
     )
     return generator, embeddings
 
-def generate_testset(documents: List[Dict[str, Any]], test_size: int) -> TestsetGenerator:
-    logging.info("Initializing test set generator")
+def generate_batch(documents: List[Dict[str, Any]], test_size: int) -> Dataset:
     generator, embeddings = initialize_generator()
-    # Generate test set in batches
-    ds_list = []
-    for i in range(0, len(documents), STEP_SIZE):
-        docs = documents[i:i+STEP_SIZE]
-        df = generator.generate_with_llamaindex_docs(docs, test_size=test_size, distributions={simple: 0.5, reasoning: 0.25, multi_context: 0.25}).to_pandas()
-        ds_list.append(df)
+    return generator.generate_with_llamaindex_docs(documents, test_size=test_size, distributions={simple: 0.5, reasoning: 0.25, multi_context: 0.25}).to_dataset()
 
-    return Dataset.from_pandas(pd.concat(ds_list))
+def generate_testset(documents: List[Dict[str, Any]], test_size: int) -> Dataset:
+    logging.info("Initializing test set generator")
+    # Generate test set in batches of STEP_SIZE documents, several batches at a time
+    batches = [documents[i:i+STEP_SIZE] for i in range(0, len(documents), STEP_SIZE)]
+    results = dict(iter_testsets(batches, test_size, generate=generate_batch))
+    ds_list = [results[i].to_pandas() for i in sorted(results)]
 
+    return Dataset.from_pandas(pd.concat(ds_list))
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
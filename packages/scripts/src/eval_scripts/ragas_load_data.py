@@ -12,12 +12,12 @@ for document in documents:
 
 from ragas.testset.generator import TestsetGenerator
 from ragas.testset.evolutions import simple, reasoning, multi_context
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from eval_scripts.llm_cache import cached_chat_openai, cached_openai_embeddings
 
-# generator with openai models
-generator_llm = ChatOpenAI(model="gpt-3.5-turbo-16k")
-critic_llm = ChatOpenAI(model="gpt-4")
-embeddings = OpenAIEmbeddings()
+# generator with openai models, through the LLM cache
+generator_llm = cached_chat_openai(model="gpt-3.5-turbo-16k")
+critic_llm = cached_chat_openai(model="gpt-4")
+embeddings = cached_openai_embeddings()
 
 generator = TestsetGenerator.from_langchain(
     generator_llm,
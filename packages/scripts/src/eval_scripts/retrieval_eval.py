@@ -0,0 +1,156 @@
+import re
+from sqlite3 import Connection
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from eval_data.models.evalfunction import EvalFunctionModel, EvalFunctionType
+from eval_data.models.responseeval import ResponseEvalModel, ResponseEvalType
+from eval_data.models.testevalconfig import TestEvalConfigModel, TestEvalConfigType
+from eval_data.tools import iter_pending_evals
+
+from .metrics import eval_attributes
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+# Retrieval metrics are cheap, so a whole test run is usually scored in one or two chunks
+RETRIEVAL_CHUNK_SIZE = 4096
+METRICS = ("recall", "precision", "mrr", "ndcg")
+# Suffix added to the id of a node when it is split into chunks or list items, e.g. "3_123-0" or "3_123_1"
+_CHUNK_SUFFIX = re.compile(r"[-_]\d+$")
+
+
+def _encode(retrieved: List[List[str]], relevant: List[List[str]]):
+    """ Codes the ids as integers in two padded matrices: retrieved ids in rank order with duplicates
+    dropped (-1 padding), and the distinct relevant ids (-2 padding). A retrieved chunk of a relevant
+    passage counts as that passage. """
+    vocabulary: Dict[str, int] = {}
+    gold = [[vocabulary.setdefault(id, len(vocabulary)) for id in dict.fromkeys(ids)] for ids in relevant]
+
+    def code(id: str) -> int:
+        if id in vocabulary:
+            return vocabulary[id]
+        source = _CHUNK_SUFFIX.sub("", id)
+        return vocabulary[source] if source in vocabulary else vocabulary.setdefault(id, len(vocabulary))
+
+    ranked = [list(dict.fromkeys(code(id) for id in ids)) for ids in retrieved]
+    retrieved_codes = np.full((len(ranked), max(map(len, ranked), default=0)), -1, dtype=np.int64)
+    relevant_codes = np.full((len(gold), max(map(len, gold), default=0)), -2, dtype=np.int64)
+    for i, codes in enumerate(ranked):
+        retrieved_codes[i, :len(codes)] = codes
+    for i, codes in enumerate(gold):
+        relevant_codes[i, :len(codes)] = codes
+    return retrieved_codes, relevant_codes
+
+
+def retrieval_metrics(retrieved: List[List[str]], relevant: List[List[str]]) -> Dict[str, np.ndarray]:
+    """ Computes recall@k, precision@k, MRR and nDCG@k of every row at once, where k is the number of
+    ids retrieved for the row, chunks of one passage included. Returns one float array per metric name;
+    rows without relevant ids score 0.
+    """
+    retrieved_codes, relevant_codes = _encode(retrieved, relevant)
+    rows, depth = retrieved_codes.shape
+    if depth == 0 or relevant_codes.shape[1] == 0:
+        return {name: np.zeros(rows) for name in METRICS}
+
+    # (rows, depth) matrix of which ranks hold a relevant id
+    hits = (retrieved_codes[:, :, None] == relevant_codes[:, None, :]).any(axis=2)
+    k = np.array([len(ids) for ids in retrieved])
+    # Distinct passages in the ranking, the positions nDCG can fill
+    ranked = (retrieved_codes >= 0).sum(axis=1)
+    n_relevant = (relevant_codes >= 0).sum(axis=1)
+    n_hits = hits.sum(axis=1)
+
+    discounts = 1 / np.log2(np.arange(depth) + 2)
+    ideal = np.concatenate(([0.0], np.cumsum(discounts)))[np.minimum(n_relevant, ranked)]
+    first_hit = hits.argmax(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "recall": np.where(n_relevant > 0, n_hits / n_relevant, 0.0),
+            "precision": np.where(k > 0, n_hits / k, 0.0),
+            "mrr": np.where(n_hits > 0, 1 / (first_hit + 1), 0.0),
+            "ndcg": np.where(ideal > 0, (hits * discounts).sum(axis=1) / ideal, 0.0),
+        }
+
+
+def retrieval_metric(name: str):
+    """ Marks an eval function as a retrieval metric, scored from context node ids instead of text. """
+    return eval_attributes(retrieval_metric=name)
+
+
+@retrieval_metric("recall")
+def eval_retrieval_recall(retrieved_ids: List[List[str]], relevant_ids: List[List[str]]) -> List[float]:
+    return retrieval_metrics(retrieved_ids, relevant_ids)["recall"].tolist()
+
+@retrieval_metric("precision")
+def eval_retrieval_precision(retrieved_ids: List[List[str]], relevant_ids: List[List[str]]) -> List[float]:
+    return retrieval_metrics(retrieved_ids, relevant_ids)["precision"].tolist()
+
+@retrieval_metric("mrr")
+def eval_retrieval_mrr(retrieved_ids: List[List[str]], relevant_ids: List[List[str]]) -> List[float]:
+    return retrieval_metrics(retrieved_ids, relevant_ids)["mrr"].tolist()
+
+@retrieval_metric("ndcg")
+def eval_retrieval_ndcg(retrieved_ids: List[List[str]], relevant_ids: List[List[str]]) -> List[float]:
+    return retrieval_metrics(retrieved_ids, relevant_ids)["ndcg"].tolist()
+
+
+RETRIEVAL_EVALS = (
+    ("retrieval-recall", "Retrieval - Recall@k of the gold passages", eval_retrieval_recall),
+    ("retrieval-precision", "Retrieval - Precision@k of the retrieved contexts", eval_retrieval_precision),
+    ("retrieval-mrr", "Retrieval - Reciprocal rank of the first gold passage", eval_retrieval_mrr),
+    ("retrieval-ndcg", "Retrieval - nDCG@k against the gold passages", eval_retrieval_ndcg),
+)
+
+
+def register_retrieval_evals(db: Connection, test_run_id: int) -> List[TestEvalConfigType]:
+    """ Adds the retrieval eval functions to a test run, skipping the ones it already has. """
+    eval_function_model = EvalFunctionModel(db)
+    test_eval_config_model = TestEvalConfigModel(db)
+    configs = test_eval_config_model.get_test_eval_configs_by_test_run_id(test_run_id)
+    assigned = {config.eval_function_id: config for config in configs}
+    result = []
+    for name, description, func in RETRIEVAL_EVALS:
+        eval_function = eval_function_model.add_or_get_eval_function(EvalFunctionType(name=name, description=description, eval_function=func))
+        if (config := assigned.get(eval_function.id)) is None:
+            config = TestEvalConfigType(test_run_id=test_run_id, eval_function_id=eval_function.id)
+            config.id = test_eval_config_model.add_test_eval_config(config)
+        result.append(config)
+    return result
+
+
+def evaluate_retrieval(db: Connection, test_run_id: int, functions: Dict[int, Callable], chunk_size: int = RETRIEVAL_CHUNK_SIZE) -> int:
+    """ Scores the retrieval eval configs of a test run, given as {test eval config id: eval function}.
+
+    All metrics of a chunk come from one retrieval_metrics call over the context node ids and the
+    gold ids of the questions. Responses whose question has no gold ids, or with contexts saved
+    without node ids, are not planned and stay unscored.
+    Returns the number of response evals saved.
+    """
+    response_eval_model = ResponseEvalModel(db)
+    saved = 0
+    for rows in iter_pending_evals(db, test_run_id, test_eval_config_ids=list(functions), chunk_size=chunk_size, require_node_ids=True):
+        metrics = retrieval_metrics(
+            [[c.node_id for c in p.contexts] for p in rows],
+            [p.question.relevant_ids for p in rows],
+        )
+        response_evals = [
+            ResponseEvalType(
+                test_run_id=test_run_id,
+                question_id=p.question.id,
+                response_id=p.response.id,
+                test_eval_config_id=config_id,
+                eval_score=float(metrics[functions[config_id].retrieval_metric][i])
+            )
+            for i, p in enumerate(rows)
+            for config_id in p.test_eval_config_ids
+        ]
+        response_eval_model.add_response_evals(response_evals)
+        saved += len(response_evals)
+        logger.info(f"Test run {test_run_id}: {saved} retrieval evals saved")
+    return saved
+
+
+def is_retrieval_eval(func: Optional[Callable]) -> bool:
+    return getattr(func, "retrieval_metric", None) is not None
@@ -0,0 +1,100 @@
+import json
+import os
+from sqlite3 import Connection
+from typing import List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from .database import embed_nodes
+from .embeddings import Encoder, get_encoder, normalize
+from .generator import AbstractGenerator
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_TOP_K = 3
+# Queries scored per matrix product, bounding the (queries x nodes) score block in memory
+QUERY_BLOCK_SIZE = 256
+
+
+def top_k(queries: np.ndarray, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the (indices, scores) of the k best matrix rows for each query row, best first.
+
+    Both inputs are expected to be normalized, so the scores are cosine similarities. The k best
+    of each row are selected with argpartition and only those k are sorted.
+    """
+    k = min(k, matrix.shape[0])
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+        block = queries[start:start+QUERY_BLOCK_SIZE] @ matrix.T
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k] if k < block.shape[1] else np.tile(np.arange(k), (len(block), 1))
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        indices[start:start+len(block)] = np.take_along_axis(best, order, axis=1)
+        scores[start:start+len(block)] = np.take_along_axis(best_scores, order, axis=1)
+    return indices, scores
+
+
+class NumpyRetriever(AbstractGenerator):
+    """ Exact top-k cosine retriever over the node embeddings held in one float32 matrix.
+
+    Queries are answered without an LLM: the Response has no text and carries the retrieved
+    nodes and their scores as source_nodes. With a snapshot path the normalized matrix is saved
+    as a .npy file and memory-mapped on later runs with the same nodes, so nothing is stacked
+    or encoded again.
+    """
+
+    def __init__(self, nodes: List[TextNode], similarity_top_k: int = DEFAULT_TOP_K, encoder: Optional[Encoder] = None,
+                 db: Optional[Connection] = None, snapshot: Optional[str] = None):
+        self.nodes = nodes
+        self.similarity_top_k = similarity_top_k
+        self._encoder = encoder
+        if snapshot and not snapshot.endswith('.npy'):
+            snapshot = f"{snapshot}.npy"
+        self.matrix = self._load_snapshot(snapshot) if snapshot else None
+        if self.matrix is None:
+            embed_nodes(db, nodes, encoder=encoder)
+            self.matrix = normalize(np.array([node.embedding for node in nodes], dtype=np.float32).reshape(len(nodes), -1))
+            if snapshot:
+                self._save_snapshot(snapshot)
+        logger.info(f"NumpyRetriever: {self.matrix.shape[0]} nodes of dimension {self.matrix.shape[1]}")
+
+    @property
+    def encoder(self) -> Encoder:
+        return self._encoder or get_encoder()
+
+    def _fingerprint(self) -> dict:
+        return {"ids": [node.id_ for node in self.nodes], "hashes": [node.hash for node in self.nodes]}
+
+    def _load_snapshot(self, path: str) -> Optional[np.ndarray]:
+        if not (os.path.exists(path) and os.path.exists(f"{path}.json")):
+            return None
+        with open(f"{path}.json") as f:
+            if json.load(f) != self._fingerprint():
+                logger.info(f"Snapshot {path} does not match the nodes; rebuilding it")
+                return None
+        return np.load(path, mmap_mode='r')
+
+    def _save_snapshot(self, path: str):
+        np.save(path, self.matrix)
+        with open(f"{path}.json", 'w') as f:
+            json.dump(self._fingerprint(), f)
+
+    def retrieve_batch(self, queries: List[str], similarity_top_k: Optional[int] = None) -> List[List[NodeWithScore]]:
+        """ Retrieves the top k nodes of every query, encoding and scoring all queries together. """
+        if not queries or not self.nodes:
+            return [[] for _ in queries]
+        indices, scores = top_k(normalize(self.encoder.encode(queries)), self.matrix, similarity_top_k or self.similarity_top_k)
+        return [
+            [NodeWithScore(node=self.nodes[i], score=float(score)) for i, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+    def query(self, query: str) -> Response:
+        return Response(response=None, source_nodes=self.retrieve_batch([query])[0])
+
+    def query_batch(self, queries: List[str]) -> List[Response]:
+        return [Response(response=None, source_nodes=source_nodes) for source_nodes in self.retrieve_batch(queries)]
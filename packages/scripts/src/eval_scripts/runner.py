@@ -0,0 +1,175 @@
+import asyncio
+import queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sqlite3 import Connection
+from typing import Callable, List, Optional, Tuple
+
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+
+from eval_data.models.question import QuestionType
+from eval_data.models.response import ResponseModel
+from eval_data.models.testrun import TestRunType
+from eval_data.tools import save_responses
+
+from .generator import AbstractGenerator
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_COMMIT_SIZE = 100
+DEFAULT_BATCH_SIZE = 32
+
+
+def run_test(db: Connection, test_run: TestRunType, questions: List[QuestionType], generator: AbstractGenerator,
+             concurrency: int = DEFAULT_CONCURRENCY, commit_size: int = DEFAULT_COMMIT_SIZE, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """ Generates and saves responses for every question that has none yet in the test run.
+
+    Queries run with at most `concurrency` in flight: as batches of `batch_size` questions when the
+    generator overrides query_batch, through its own aquery when it overrides that, and through a
+    thread pool otherwise. Responses and their contexts are committed every `commit_size` results,
+    so an interrupted run resumes where it stopped.
+    Returns the number of responses saved.
+    """
+    answered = ResponseModel(db).get_answered_question_ids(test_run.id)
+    pending = [q for q in questions if q.id not in answered]
+    logger.info(f"Test run {test_run.id}: {len(pending)} questions to run, {len(questions) - len(pending)} already answered")
+    if not pending:
+        return 0
+
+    writer = _ResponseWriter(db, test_run.id, commit_size)
+    try:
+        if type(generator).query_batch is not AbstractGenerator.query_batch:
+            _run_batches(pending, generator, concurrency, batch_size, writer)
+        elif type(generator).aquery is not AbstractGenerator.aquery:
+            _run_event_loop(pending, generator, concurrency, writer)
+        else:
+            _run_threads(pending, generator, concurrency, writer)
+    finally:
+        # Results received before an error are kept, so a rerun only queries the rest
+        writer.flush()
+
+    logger.info(f"Test run {test_run.id}: saved {writer.count} responses, {writer.failed} failed")
+    return writer.count
+
+
+def _run_threads(questions: List[QuestionType], generator: AbstractGenerator, concurrency: int, writer: "_ResponseWriter"):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        questions = iter(questions)
+        in_flight = {}
+        while True:
+            for question in questions:
+                in_flight[pool.submit(generator.query, question.question)] = question
+                if len(in_flight) >= concurrency:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                question = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    writer.fail(question, e)
+                    continue
+                writer.add(question, result)
+
+
+def _run_batches(questions: List[QuestionType], generator: AbstractGenerator, concurrency: int, batch_size: int, writer: "_ResponseWriter"):
+    batches = (questions[i:i+batch_size] for i in range(0, len(questions), batch_size))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = {}
+        while True:
+            for batch in batches:
+                in_flight[pool.submit(generator.query_batch, [q.question for q in batch])] = batch
+                if len(in_flight) >= concurrency:
+                    break
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    for question in batch:
+                        writer.fail(question, e)
+                    continue
+                if len(results) != len(batch):
+                    raise ValueError(f"query_batch returned {len(results)} responses for {len(batch)} queries")
+                for question, result in zip(batch, results):
+                    writer.add(question, result)
+
+
+def _run_event_loop(questions: List[QuestionType], generator: AbstractGenerator, concurrency: int, writer: "_ResponseWriter"):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(_run_async(questions, generator, concurrency, writer.record))
+        return
+
+    # Called from a running event loop, e.g. in Jupyter: the queries get a loop of their own in a
+    # worker thread and hand their results back, so the connection is only used from this thread
+    results = queue.Queue()
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(asyncio.run, _run_async(questions, generator, concurrency, lambda *result: results.put(result)))
+        future.add_done_callback(lambda _: results.put(None))
+        while (result := results.get()) is not None:
+            writer.record(*result)
+        future.result()
+
+
+async def _run_async(questions: List[QuestionType], generator: AbstractGenerator, concurrency: int,
+                     record: Callable[[QuestionType, Optional[RESPONSE_TYPE], Optional[Exception]], None]):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def query(question: QuestionType) -> Tuple[QuestionType, Optional[RESPONSE_TYPE], Optional[Exception]]:
+        async with semaphore:
+            try:
+                return question, await generator.aquery(question.question), None
+            except Exception as e:
+                return question, None, e
+
+    for task in asyncio.as_completed([query(q) for q in questions]):
+        record(*await task)
+
+
+class _ResponseWriter:
+    """ Buffers generated responses and commits them in batches from the calling thread. """
+
+    def __init__(self, db: Connection, test_run_id: int, commit_size: int):
+        self.db = db
+        self.test_run_id = test_run_id
+        self.commit_size = commit_size
+        self.buffer: List[Tuple[QuestionType, RESPONSE_TYPE]] = []
+        self.count = 0
+        self.failed = 0
+
+    def add(self, question: QuestionType, result: RESPONSE_TYPE):
+        self.buffer.append((question, result))
+        if len(self.buffer) >= self.commit_size:
+            self.flush()
+
+    def fail(self, question: QuestionType, error: Exception):
+        self.failed += 1
+        logger.warning(f"Query failed for question {question.id}: {error}")
+
+    def record(self, question: QuestionType, result: Optional[RESPONSE_TYPE], error: Optional[Exception]):
+        if error:
+            self.fail(question, error)
+        else:
+            self.add(question, result)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        save_responses(
+            self.db,
+            test_run_id=self.test_run_id,
+            question_ids=[q.id for q, _ in self.buffer],
+            responses=[res.response or "" for _, res in self.buffer],
+            contexts=[[(c.node.get_content(), c.score or 0.0, c.node.node_id) for c in res.source_nodes] for _, res in self.buffer],
+        )
+        self.count += len(self.buffer)
+        logger.info(f"Test run {self.test_run_id}: {self.count} responses saved")
+        self.buffer = []
@@ -0,0 +1,150 @@
+import hashlib
+from sqlite3 import Connection
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from eval_data.models.question import QuestionModel, QuestionType
+from eval_data.models.questionembedding import QuestionEmbeddingModel, QuestionEmbeddingType
+from eval_data.models.questionsample import QuestionSampleModel, QuestionSampleType
+
+from .embeddings import MODEL_NAME, Encoder, get_encoder, normalize
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_ITERATIONS = 50
+# Points per block of the point-to-centroid distance computation
+DISTANCE_BLOCK_SIZE = 8192
+
+
+def _nearest(points: np.ndarray, centroids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the index of the nearest centroid of every point and the squared distance to it. """
+    labels = np.empty(len(points), dtype=np.int64)
+    distances = np.empty(len(points), dtype=np.float32)
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    for start in range(0, len(points), DISTANCE_BLOCK_SIZE):
+        block = points[start:start+DISTANCE_BLOCK_SIZE]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2
+        squared = (block * block).sum(axis=1, keepdims=True) - 2 * block @ centroids.T + centroid_norms
+        labels[start:start+len(block)] = squared.argmin(axis=1)
+        distances[start:start+len(block)] = np.maximum(np.take_along_axis(squared, labels[start:start+len(block), None], axis=1)[:, 0], 0)
+    return labels, distances
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = DEFAULT_ITERATIONS, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """ Clusters the rows of points into k clusters with k-means++ seeding and Lloyd iterations; returns (centroids, labels).
+
+    Assignments are computed a block of points at a time as one matrix product, and centroids are
+    recomputed with another. A cluster that loses all its points is reseeded with the point
+    farthest from its centroid. Stops when no assignment changes.
+    """
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    k = min(k, len(points))
+    rng = np.random.default_rng(seed)
+
+    norms = (points * points).sum(axis=1)
+
+    def squared_distances(index: int) -> np.ndarray:
+        return np.maximum(norms - 2 * points @ points[index] + norms[index], 0)
+
+    centroids = np.empty((k, points.shape[1]), dtype=np.float32)
+    index = rng.integers(len(points))
+    centroids[0] = points[index]
+    distances = squared_distances(index)
+    for i in range(1, k):
+        total = distances.sum(dtype=np.float64)
+        index = rng.choice(len(points), p=distances / total) if total > 0 else rng.integers(len(points))
+        centroids[i] = points[index]
+        distances = np.minimum(distances, squared_distances(index))
+
+    labels = np.full(len(points), -1, dtype=np.int64)
+    for iteration in range(iterations):
+        new_labels, distances = _nearest(points, centroids)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        # Cluster sums as one (k x n) one-hot by (n x d) matrix product
+        members = np.zeros((len(points), k), dtype=np.float32)
+        members[np.arange(len(points)), labels] = 1
+        centroids[filled] = (members.T @ points)[filled] / counts[filled, None]
+        for cluster in np.flatnonzero(~filled):
+            farthest = distances.argmax()
+            centroids[cluster] = points[farthest]
+            distances[farthest] = 0
+    logger.info(f"kmeans: {len(points)} points, {k} clusters, {iteration + 1} iterations")
+    return centroids, labels
+
+
+def medoids(points: np.ndarray, centroids: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """ Returns the index of the medoid of every non-empty cluster.
+
+    For unit vectors the point with the least summed squared distance to the rest of its cluster
+    is the one with the largest dot product with the cluster centroid, so no pairwise distances are needed.
+    """
+    scores = (points * centroids[labels]).sum(axis=1)
+    order = np.lexsort((-scores, labels))
+    first = np.concatenate(([True], labels[order][1:] != labels[order][:-1]))
+    return order[first]
+
+
+def embed_questions(db: Optional[Connection], questions: Sequence[QuestionType], encoder: Optional[Encoder] = None) -> np.ndarray:
+    """ Returns the normalized embeddings of the question texts, reusing the ones the encoder's model stored in question_embeddings. """
+    encoder = encoder or get_encoder()
+    model_name = getattr(encoder, "model_name", MODEL_NAME)
+    hashes = [hashlib.sha1(q.question.encode()).hexdigest() for q in questions]
+    question_embedding_model = QuestionEmbeddingModel(db) if db else None
+    stored = question_embedding_model.find_question_embeddings(model_name, hashes) if question_embedding_model else {}
+    misses = {}
+    for text_hash, question in zip(hashes, questions):
+        if text_hash not in stored:
+            misses.setdefault(text_hash, question.question)
+    logger.info(f"embed_questions: {len(hashes) - len(misses)} stored, {len(misses)} to encode with {model_name}")
+    if misses:
+        embeddings = encoder.encode(misses.values())
+        stored.update(zip(misses, embeddings))
+        if question_embedding_model:
+            question_embedding_model.add_question_embeddings([
+                QuestionEmbeddingType(model_name, text_hash, embedding) for text_hash, embedding in zip(misses, embeddings)
+            ])
+    return normalize(np.stack([stored[text_hash] for text_hash in hashes]))
+
+
+def sample_questions(questions: List[QuestionType], k: int, db: Optional[Connection] = None, encoder: Optional[Encoder] = None,
+                     seed: int = 0) -> List[QuestionType]:
+    """ Picks k representative questions: the medoids of a k-means clustering of the question embeddings. """
+    if len(questions) <= k:
+        return list(questions)
+    points = embed_questions(db, questions, encoder)
+    centroids, labels = kmeans(points, k, seed=seed)
+    return [questions[i] for i in sorted(medoids(points, centroids, labels))]
+
+
+def create_question_sample(db: Connection, name: str, qaset_ids: List[int], k: int, description: Optional[str] = None,
+                           encoder: Optional[Encoder] = None, seed: int = 0) -> QuestionSampleType:
+    """ Stores a named sample of up to k representative questions per QA set, or returns the sample that already has the name.
+
+    Each QA set is clustered on its own, so every set contributes up to k questions whatever its
+    size. Test runs target the sample through question_sample_id and its questions are
+    read back with QuestionSampleModel.get_questions.
+    """
+    question_sample_model = QuestionSampleModel(db)
+    if sample := question_sample_model.get_question_sample_by_name(name):
+        return sample
+
+    question_model = QuestionModel(db)
+    question_ids = []
+    for qaset_id in qaset_ids:
+        questions = question_model.get_questions_by_qaset_id(qaset_id)
+        sampled = sample_questions(questions, k, db=db, encoder=encoder, seed=seed)
+        logger.info(f"Question sample {name}: {len(sampled)} of {len(questions)} questions from QA set {qaset_id}")
+        question_ids.extend(q.id for q in sampled)
+
+    sample = QuestionSampleType(
+        name=name,
+        description=description or f"{k} k-means medoid questions per QA set from QA sets {', '.join(map(str, qaset_ids))} (seed {seed})"
+    )
+    sample.id = question_sample_model.add_question_sample(sample, question_ids)
+    return sample
@@ -0,0 +1,60 @@
+from typing import Dict, List
+
+import numpy as np
+
+from .embeddings import get_encoder, normalize
+from .metrics import eval_attributes
+
+# Responses scored per batch evaluator call; the evaluation runner reads it from the eval functions
+SIMILARITY_CHUNK_SIZE = 2048
+METRICS = ("answer_similarity", "context_similarity")
+
+
+def embed_unique(texts: List[str]) -> Dict[str, np.ndarray]:
+    """ Encodes each distinct text once with the shared encoder; returns the normalized rows by text. """
+    unique = list(dict.fromkeys(texts))
+    matrix = normalize(get_encoder().encode(unique)) if unique else np.empty((0, 0), dtype=np.float32)
+    return {text: matrix[i] for i, text in enumerate(unique)}
+
+
+def eval_similarity_batch(metrics: List[str], questions: List[str], contexts: List[List[str]], answers: List[str], ground_truths: List[str]) -> List[List[float]]:
+    """ Scores N rows with several embedding similarity metrics from one encoder call; returns one list of N scores per metric.
+
+    answer_similarity is the cosine similarity of the response and the ground truth, and
+    context_similarity the best cosine similarity of any context to the ground truth.
+    """
+    answers = [answer or "" for answer in answers]
+    ground_truths = [truth or "" for truth in ground_truths]
+    flat_contexts = [text or "" for row in contexts for text in row] if "context_similarity" in metrics else []
+    vectors = embed_unique(ground_truths + (answers if "answer_similarity" in metrics else []) + flat_contexts)
+    truth = np.stack([vectors[text] for text in ground_truths]) if ground_truths else None
+
+    scores = {}
+    if "answer_similarity" in metrics and truth is not None:
+        scores["answer_similarity"] = (np.stack([vectors[text] for text in answers]) * truth).sum(axis=1)
+    if "context_similarity" in metrics and truth is not None:
+        best = np.zeros(len(contexts), dtype=np.float32)
+        if flat_contexts:
+            counts = np.array([len(row) for row in contexts])
+            # Similarity of every context to the ground truth of its row, reduced to the row maximum
+            rows = np.repeat(np.arange(len(contexts)), counts)
+            similarity = (np.stack([vectors[text] for text in flat_contexts]) * truth[rows]).sum(axis=1)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            nonempty = counts > 0
+            best[nonempty] = np.maximum.reduceat(similarity, starts[nonempty])
+        scores["context_similarity"] = best
+    return [[float(score) for score in scores.get(metric, [])] for metric in metrics]
+
+
+def similarity_metric(metric: str):
+    """ Marks an eval function as an embedding similarity metric, so it shares an encoder call with the other similarity metrics. """
+    return eval_attributes(metric=metric, batch_evaluator=eval_similarity_batch, chunk_size=SIMILARITY_CHUNK_SIZE)
+
+
+@similarity_metric("answer_similarity")
+def eval_answer_similarity(questions: List[str], contexts: List[List[str]], answers: List[str], ground_truths: List[str]) -> List[float]:
+    return eval_similarity_batch(["answer_similarity"], questions, contexts, answers, ground_truths)[0]
+
+@similarity_metric("context_similarity")
+def eval_context_similarity(questions: List[str], contexts: List[List[str]], answers: List[str], ground_truths: List[str]) -> List[float]:
+    return eval_similarity_batch(["context_similarity"], questions, contexts, answers, ground_truths)[0]
@@ -0,0 +1,109 @@
+import itertools
+import os
+from collections import defaultdict
+from sqlite3 import Connection
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from eval_data.models.question import QuestionType
+from eval_data.models.response import ResponseModel
+from eval_data.models.testrun import TestRunModel, TestRunType
+from eval_data.tools import save_responses
+
+from .embeddings import MODEL_NAME, Encoder, get_encoder, normalize
+from .retriever import NumpyRetriever, top_k
+from .utils import chunk_documents
+
+from logging import getLogger
+logger = getLogger(__name__)
+
+DEFAULT_CHUNK_TOKENS = 8192
+DEFAULT_TOP_K = 3
+DEFAULT_BATCH_SIZE = 256
+# Settings that change the nodes or their vectors; grid points that share them share one index
+INDEX_KEYS = ("embed_model", "chunk_tokens")
+DEFAULTS = {"embed_model": MODEL_NAME, "chunk_tokens": DEFAULT_CHUNK_TOKENS, "similarity_top_k": DEFAULT_TOP_K}
+
+
+def expand_grid(grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """ Returns every combination of the grid values, with the settings it leaves out at their defaults. """
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep settings: {sorted(unknown)}")
+    keys = list(grid)
+    return [{**DEFAULTS, **dict(zip(keys, values))} for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def sweep_description(name: str, point: Dict[str, Any]) -> str:
+    return f"{name} " + " ".join(f"{key}={point[key]}" for key in sorted(point))
+
+
+def run_sweep(db: Connection, datasource_id: int, nodes: List[TextNode], questions: List[QuestionType], grid: Dict[str, Sequence[Any]],
+              name: str = "sweep", snapshot_dir: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> List[TestRunType]:
+    """ Runs a resumable retrieval-only test run per grid point over embed_model, chunk_tokens and similarity_top_k, sharing one index per embedding and chunking setting. """
+    test_run_model = TestRunModel(db)
+    response_model = ResponseModel(db)
+    points = expand_grid(grid)
+    test_runs = [
+        test_run_model.add_or_get_test_run(TestRunType(datasource_id=datasource_id, description=sweep_description(name, point)))
+        for point in points
+    ]
+
+    groups: Dict[Tuple, List[int]] = defaultdict(list)
+    for i, point in enumerate(points):
+        groups[tuple(point[key] for key in INDEX_KEYS)].append(i)
+
+    positions = {q.id: i for i, q in enumerate(questions)}
+    encoders: Dict[str, Encoder] = {}
+    query_vectors: Dict[str, np.ndarray] = {}
+    for (embed_model, chunk_tokens), members in groups.items():
+        answered = {i: response_model.get_answered_question_ids(test_runs[i].id) for i in members}
+        pending = [q for q in questions if any(q.id not in answered[i] for i in members)]
+        logger.info(f"Sweep {name}: embed_model={embed_model} chunk_tokens={chunk_tokens}, {len(members)} test runs, {len(pending)} questions to retrieve")
+        if not pending:
+            continue
+
+        if embed_model not in encoders:
+            encoders[embed_model] = get_encoder() if embed_model == MODEL_NAME else Encoder(model_name=embed_model)
+        encoder = encoders[embed_model]
+        if embed_model not in query_vectors:
+            # Queries are encoded once per model and reused by every chunking setting
+            query_vectors[embed_model] = normalize(encoder.encode([q.question for q in questions]))
+        vectors = query_vectors[embed_model][[positions[q.id] for q in pending]]
+
+        # The embeddings table is keyed by node id only, so it is shared with the default index alone
+        default_index = embed_model == MODEL_NAME and chunk_tokens == DEFAULT_CHUNK_TOKENS
+        snapshot = os.path.join(snapshot_dir, f"{name}-{embed_model.replace('/', '_')}-{chunk_tokens}") if snapshot_dir else None
+        # Each index embeds copies of the nodes, so its vectors reach neither the caller's nodes nor another
+        # setting; vectors the nodes carry already are only kept for the default model
+        keep_vectors = embed_model == MODEL_NAME
+        index_nodes = [
+            node.model_copy(update={"embedding": node.embedding if keep_vectors else None})
+            for node in chunk_documents(nodes, max_tokens=chunk_tokens)
+        ]
+        max_k = max(points[i]["similarity_top_k"] for i in members)
+        retriever = NumpyRetriever(index_nodes, similarity_top_k=max_k, encoder=encoder, db=db if default_index else None, snapshot=snapshot)
+
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start+batch_size]
+            indices, scores = top_k(vectors[start:start+batch_size], retriever.matrix, max_k)
+            ranked = [
+                [(index_nodes[j].get_content(), float(score), index_nodes[j].id_) for j, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices, scores)
+            ]
+            for i in members:
+                rows = [(q, contexts) for q, contexts in zip(batch, ranked) if q.id not in answered[i]]
+                if not rows:
+                    continue
+                k = points[i]["similarity_top_k"]
+                save_responses(
+                    db,
+                    test_run_id=test_runs[i].id,
+                    question_ids=[q.id for q, _ in rows],
+                    responses=["" for _ in rows],
+                    contexts=[contexts[:k] for _, contexts in rows],
+                )
+            logger.info(f"Sweep {name}: {min(start + batch_size, len(pending))}/{len(pending)} questions retrieved for {len(members)} test runs")
+    return test_runs
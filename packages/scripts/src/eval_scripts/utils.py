@@ -1,7 +1,8 @@
 import requests
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, Iterator, List
 from llama_index.core.schema import TextNode
 import math
+from functools import lru_cache
 import tiktoken
 
 from logging import getLogger
@@ -36,8 +37,11 @@ def post_qasets(data: dict):
     return post_to_server(data, DB_SERVER, API_ENDPOINT_QA)
 
 def chunk_documents(doc_list: List[TextNode], max_tokens=8192) -> list[TextNode]:
+    return list(iter_chunked_documents(doc_list, max_tokens=max_tokens))
+
+def iter_chunked_documents(doc_list: Iterable[TextNode], max_tokens=8192) -> Iterator[TextNode]:
+    """ Lazy chunk_documents: yields the nodes of doc_list as they are read, split when they exceed max_tokens. """
     OVERLAP = 10
-    documents = []
     for doc in doc_list:
         if (tokens:=count_tokens(doc.text)) and tokens > max_tokens:
             print(f"Document {doc.id_} has {tokens} tokens")
@@ -53,13 +57,15 @@ def chunk_documents(doc_list: List[TextNode], max_tokens=8192) -> list[TextNode]
 
             print(f"Chunked into {len(chunks)} pieces")
             for i, chunk in enumerate(chunks):
-                documents.append(TextNode(text=chunk, id_=f"{doc.id_}-{i}"))
+                yield TextNode(text=chunk, id_=f"{doc.id_}-{i}")
         else:
-            documents.append(doc)
+            yield doc
 
-    return documents
 
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str = "gpt-3.5-turbo"):
+    return tiktoken.encoding_for_model(model)
 
 def count_tokens(text):
-    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")  # or whichever model you're using
+    tokenizer = get_tokenizer("gpt-3.5-turbo")  # or whichever model you're using
     return len(tokenizer.encode(text))
@@ -0,0 +1,52 @@
+import pytest
+
+from eval_data.database import connect
+from eval_data.models.datasource import DatasourceModel, DatasourceType
+from eval_data.models.document import DocumentModel, DocumentType
+from eval_data.models.evalfunction import EvalFunctionModel, EvalFunctionType
+from eval_data.models.qaset import QASetModel, QASetType
+from eval_data.models.question import QuestionModel, QuestionType
+from eval_data.models.testevalconfig import TestEvalConfigModel, TestEvalConfigType
+from eval_data.models.testrun import TestRunModel, TestRunType
+from eval_data.tools import save_responses
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / "eval.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def questions(db):
+    """ Forty saved questions of one QA set. """
+    datasource_id = DatasourceModel(db).add_datasource(DatasourceType(name="datasource"))
+    document_id = DocumentModel(db).add_document(DocumentType(datasource_id=datasource_id, name="doc", location="doc.pdf", source="file"))
+    qaset_id = QASetModel(db).add_qaset(QASetType(datasource_id, document_id, "doc-qa", "doc.pdf", "question", "ground_truth"))
+    questions = [QuestionType(qaset_id, document_id, f"question {i}", f"answer {i}", relevant_ids=[f"n{i}"]) for i in range(40)]
+    for question, id in zip(questions, QuestionModel(db).add_questions(questions)):
+        question.id = id
+    return questions
+
+
+@pytest.fixture
+def test_run(db, questions):
+    test_run = TestRunType(datasource_id=1, description="run")
+    test_run.id = TestRunModel(db).add_test_run(test_run)
+    return test_run
+
+
+@pytest.fixture
+def make_test_run(db, questions):
+    """ Builds a test run that answered the first len(answers) questions, with a test eval config per eval function. """
+    def make_test_run(answers, eval_functions):
+        test_run_id = TestRunModel(db).add_test_run(TestRunType(datasource_id=1, description="run"))
+        save_responses(db, test_run_id, [q.id for q in questions[:len(answers)]], answers, [[("context", 1.0)] for _ in answers])
+        eval_function_model = EvalFunctionModel(db)
+        TestEvalConfigModel(db).add_test_eval_configs([
+            TestEvalConfigType(test_run_id, eval_function_model.add_or_get_eval_function(EvalFunctionType(func.__name__, "", func)).id)
+            for func in eval_functions
+        ])
+        return test_run_id
+    return make_test_run
@@ -0,0 +1,65 @@
+from eval_data.models.context import ContextType
+from eval_data.models.question import QuestionType
+from eval_data.models.response import ResponseType
+from eval_data.tools import PendingEval
+from eval_scripts.evaluation import evaluate_chunk
+from eval_scripts.metrics import eval_attributes
+
+
+class Metric:
+    def __init__(self, name):
+        self.name = name
+
+
+LENGTH = Metric("length")
+WORDS = Metric("words")
+# Calls to the fake batch evaluator, as lists of metric names
+calls = []
+
+
+def fake_batch(metrics, questions, contexts, answers, ground_truths):
+    calls.append([metric.name for metric in metrics])
+    by_name = {"length": [float(len(a)) for a in answers], "words": [float(len(a.split())) for a in answers]}
+    return [by_name[metric.name] for metric in metrics]
+
+
+@eval_attributes(metric=LENGTH, batch_evaluator=fake_batch)
+def eval_length(questions, contexts, answers, ground_truths):
+    return fake_batch([LENGTH], questions, contexts, answers, ground_truths)[0]
+
+
+@eval_attributes(metric=WORDS, batch_evaluator=fake_batch)
+def eval_words(questions, contexts, answers, ground_truths):
+    return fake_batch([WORDS], questions, contexts, answers, ground_truths)[0]
+
+
+def _pending(id, answer, config_ids):
+    return PendingEval(
+        response=ResponseType(test_run_id=1, question_id=id, response=answer, id=id),
+        question=QuestionType(qaset_id=1, document_id=1, question=f"question {id}", answer="truth", id=id),
+        contexts=[ContextType(response_id=id, text="context", similarity_score=1.0, sort_index=0)],
+        test_eval_config_ids=config_ids,
+    )
+
+
+def test_configs_sharing_an_evaluator_are_scored_in_one_call():
+    calls.clear()
+    functions = {1: eval_length, 2: eval_words, 3: eval_length}
+    chunk = [_pending(1, "one two", [1, 2, 3]), _pending(2, "three", [1, 2, 3])]
+    response_evals = evaluate_chunk(1, chunk, functions)
+    # The metric of configs 1 and 3 is scored once
+    assert calls == [["length", "words"]]
+    scores = {(e.test_eval_config_id, e.response_id): e.eval_score for e in response_evals}
+    assert scores == {
+        (1, 1): 7.0, (1, 2): 5.0,
+        (2, 1): 2.0, (2, 2): 1.0,
+        (3, 1): 7.0, (3, 2): 5.0,
+    }
+
+
+def test_configs_with_other_rows_get_their_own_call():
+    calls.clear()
+    chunk = [_pending(1, "one two", [1, 2]), _pending(2, "three", [1])]
+    response_evals = evaluate_chunk(1, chunk, {1: eval_length, 2: eval_words})
+    assert sorted(calls) == [["length"], ["words"]]
+    assert len(response_evals) == 3
@@ -0,0 +1,87 @@
+import importlib
+import sys
+
+import pytest
+
+from eval_data.tools import iter_pending_evals
+from eval_scripts.evaluation import evaluate_test_run
+
+
+SOURCE = '''
+calls = []
+
+def eval_length(questions, contexts, answers, ground_truths):
+    calls.append(list(answers))
+    return [None if answer == "unscorable" else float(len(answer)) {} for answer in answers]
+'''
+
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    """ A module level eval function that counts its calls and whose code can be changed by reloading. """
+    path = tmp_path / "memo_eval_module.py"
+    path.write_text(SOURCE.format(""))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("memo_eval_module")
+    yield path, module
+    sys.modules.pop("memo_eval_module", None)
+
+
+@pytest.fixture
+def new_run(module, make_test_run):
+    return lambda answers: make_test_run(answers, [module[1].eval_length])
+
+
+def _scores(db, test_run_id):
+    return sorted(row[0] for row in db.execute('SELECT eval_score FROM response_evals WHERE test_run_id = ?', (test_run_id,)))
+
+
+def test_same_rows_are_served_from_the_memo(db, module, new_run):
+    _, module = module
+    first = evaluate_test_run(db, new_run(["a", "bb", "ccc"]))
+    assert (first.saved, first.hits, first.misses) == (3, 0, 3)
+    assert module.calls == [["a", "bb", "ccc"]]
+
+    # Whitespace is normalized before hashing
+    test_run_id = new_run(["a", " bb", "ccc "])
+    second = evaluate_test_run(db, test_run_id)
+    assert (second.saved, second.hits, second.misses) == (3, 3, 0)
+    assert module.calls == [["a", "bb", "ccc"]]
+    assert _scores(db, test_run_id) == [1.0, 2.0, 3.0]
+    assert db.execute('SELECT COUNT(*) FROM eval_memos').fetchone()[0] == 3
+
+
+def test_changed_input_text_misses_the_memo(db, module, new_run):
+    _, module = module
+    evaluate_test_run(db, new_run(["a", "bb"]))
+    stats = evaluate_test_run(db, new_run(["a", "bbbb"]))
+    assert (stats.hits, stats.misses) == (1, 1)
+    assert module.calls[-1] == ["bbbb"]
+
+
+def test_changed_function_code_misses_the_memo(db, module, new_run):
+    path, module = module
+    evaluate_test_run(db, new_run(["a", "bb"]))
+    path.write_text(SOURCE.format("* 10"))
+    importlib.reload(module)
+
+    test_run_id = new_run(["a", "bb", "x"])
+    stats = evaluate_test_run(db, test_run_id)
+    assert (stats.hits, stats.misses) == (0, 3)
+    assert _scores(db, test_run_id) == [10.0, 10.0, 20.0]
+
+
+def test_missing_scores_are_neither_memoized_nor_saved(db, module, new_run):
+    _, module = module
+    test_run_id = new_run(["a", "unscorable"])
+    stats = evaluate_test_run(db, test_run_id)
+    assert stats.saved == 1
+    assert _scores(db, test_run_id) == [1.0]
+    assert db.execute('SELECT eval_score FROM eval_memos').fetchall() == [(1.0,)]
+    pending = [p.response.response for chunk in iter_pending_evals(db, test_run_id) for p in chunk]
+    assert pending == ["unscorable"]
+
+    # The next run retries it instead of serving a memoized score
+    stats = evaluate_test_run(db, test_run_id)
+    assert (stats.saved, stats.hits, stats.misses) == (0, 0, 1)
+    assert module.calls[-1] == ["unscorable"]
@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+from eval_data.models import testevalconfig
+from eval_scripts.evaluation import ScoreStats, evaluate_adaptive
+
+
+def eval_constant(questions, contexts, answers, ground_truths):
+    return [0.5 for _ in answers]
+
+
+def eval_parity(questions, contexts, answers, ground_truths):
+    return [float(len(answer) % 2) for answer in answers]
+
+
+def _answers(count):
+    return ["x" * (i + 1) for i in range(count)]
+
+
+def _scored(db, test_run_id):
+    return db.execute('SELECT COUNT(*) FROM response_evals WHERE test_run_id = ?', (test_run_id,)).fetchone()[0]
+
+
+def test_batches_match_the_scores_at_once():
+    scores = np.random.default_rng(0).random(101)
+    stats = ScoreStats()
+    for start in range(0, len(scores), 17):
+        stats.add(scores[start:start+17])
+    assert stats.count == len(scores)
+    assert stats.mean == pytest.approx(scores.mean())
+    assert stats.variance == pytest.approx(scores.var(ddof=1))
+    assert stats.half_width(1.96) == pytest.approx(1.96 * scores.std(ddof=1) / math.sqrt(len(scores)))
+
+
+def test_from_sums_matches_add():
+    scores = [0.0, 0.5, 1.0, 1.0]
+    stats = ScoreStats()
+    stats.add(scores)
+    summed = ScoreStats.from_sums(len(scores), sum(scores), sum(s * s for s in scores))
+    assert (summed.count, summed.mean) == (stats.count, stats.mean)
+    assert summed.m2 == pytest.approx(stats.m2)
+
+
+def test_half_width_needs_two_scores():
+    stats = ScoreStats.from_sums(0, 0.0, 0.0)
+    assert stats.count == 0 and stats.half_width() == math.inf
+    stats.add([1.0])
+    assert stats.half_width() == math.inf
+    assert stats.finite_half_width() is None
+    stats.add([])
+    assert stats.count == 1
+
+
+def test_adaptive_stops_once_the_interval_is_narrow_enough(db, make_test_run):
+    test_run_id = make_test_run(_answers(40), [eval_constant])
+    stats = evaluate_adaptive(db, test_run_id, target_half_width=0.01, min_samples=10, chunk_size=4)
+    # The scores never vary, so the first chunk that reaches min_samples stops the config
+    assert [(s.count, s.mean, s.half_width()) for s in stats.values()] == [(12, 0.5, 0.0)]
+    assert _scored(db, test_run_id) == 12
+
+
+def test_adaptive_never_exceeds_the_budget(db, make_test_run):
+    test_run_id = make_test_run(_answers(40), [eval_constant, eval_parity])
+    stats = evaluate_adaptive(db, test_run_id, target_half_width=0.01, budget=10, min_samples=10, chunk_size=4)
+    # The budget falls inside the third chunk, which is trimmed to it
+    assert [s.count for s in stats.values()] == [10, 10]
+    assert _scored(db, test_run_id) == 20
+    # The budget is per call; a second call goes on from the scores saved so far
+    stats = evaluate_adaptive(db, test_run_id, target_half_width=0.01, budget=3, min_samples=100, chunk_size=4)
+    assert [s.count for s in stats.values()] == [13, 13]
+
+
+def test_adaptive_records_the_stats_on_the_configs(db, make_test_run):
+    test_run_id = make_test_run(_answers(40), [eval_parity])
+    stats = evaluate_adaptive(db, test_run_id, target_half_width=0.01, budget=20, chunk_size=8)
+    config, = testevalconfig.TestEvalConfigModel(db).get_test_eval_configs_by_test_run_id(test_run_id)
+    reached = stats[config.id]
+    assert reached.count == 20
+    assert (config.score_mean, config.ci_half_width, config.sample_count) == (
+        pytest.approx(reached.mean), pytest.approx(reached.half_width()), 20)
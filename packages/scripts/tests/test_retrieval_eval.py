@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from eval_scripts.retrieval_eval import retrieval_metrics
+
+
+def test_metrics_of_ranked_ids():
+    metrics = retrieval_metrics([["a", "x", "b"], ["x", "y", "c"], ["x", "y"]], [["a", "b"], ["c"], ["a"]])
+    np.testing.assert_allclose(metrics["recall"], [1, 1, 0])
+    np.testing.assert_allclose(metrics["precision"], [2 / 3, 1 / 3, 0])
+    np.testing.assert_allclose(metrics["mrr"], [1, 1 / 3, 0])
+    ideal = 1 + 1 / np.log2(3)
+    np.testing.assert_allclose(metrics["ndcg"], [(1 + 1 / np.log2(4)) / ideal, 1 / np.log2(4), 0])
+
+
+def test_chunks_of_a_relevant_passage_count_as_the_passage():
+    metrics = retrieval_metrics([["3_5-0", "3_5-1", "3_7"]], [["3_5"]])
+    # k counts every retrieved chunk, while the passage is found once
+    assert metrics["precision"][0] == pytest.approx(1 / 3)
+    assert metrics["recall"][0] == 1
+    assert metrics["mrr"][0] == 1
+    assert metrics["ndcg"][0] == 1
+
+
+def test_rows_without_ids_score_zero():
+    metrics = retrieval_metrics([[], ["a"]], [["a"], []])
+    for name in ("recall", "precision", "mrr", "ndcg"):
+        np.testing.assert_array_equal(metrics[name], [0, 0])
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+# The retriever module imports the llama_index and ragas based generator interface
+pytest.importorskip("llama_index.core")
+pytest.importorskip("ragas")
+
+from eval_scripts import retriever
+from eval_scripts.retriever import top_k
+
+
+def _normalized(rows, columns, seed):
+    vectors = np.random.default_rng(seed).standard_normal((rows, columns)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50, 80])
+def test_top_k_matches_a_full_sort(monkeypatch, k):
+    # Small blocks so several query blocks are scored
+    monkeypatch.setattr(retriever, "QUERY_BLOCK_SIZE", 7)
+    queries, matrix = _normalized(20, 8, 0), _normalized(50, 8, 1)
+    indices, scores = top_k(queries, matrix, k)
+    expected = np.argsort(-(queries @ matrix.T), axis=1, kind="stable")[:, :min(k, len(matrix))]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_allclose(scores, np.take_along_axis(queries @ matrix.T, expected, axis=1), rtol=1e-6)
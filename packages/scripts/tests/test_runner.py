@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("llama_index.core")
+pytest.importorskip("ragas")
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from eval_data.models.context import ContextModel
+from eval_data.models.response import ResponseModel
+from eval_data.tools import save_responses
+from eval_scripts.generator import AbstractGenerator
+from eval_scripts.runner import run_test
+
+
+def _response(query):
+    return Response(response=f"re: {query}", source_nodes=[NodeWithScore(node=TextNode(text=f"context of {query}", id_=f"node-{query}"), score=0.5)])
+
+
+class StubGenerator(AbstractGenerator):
+    """ Answers every query at once and records the queries it was asked. """
+    def __init__(self, nodes=None):
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        return _response(query)
+
+
+class StubBatchGenerator(StubGenerator):
+    def __init__(self, drop=0):
+        super().__init__()
+        self.drop = drop
+
+    def query_batch(self, queries):
+        self.queries.extend(queries)
+        return [_response(query) for query in queries][:len(queries) - self.drop]
+
+
+class StubAsyncGenerator(StubGenerator):
+    async def aquery(self, query):
+        await asyncio.sleep(0)
+        return self.query(query)
+
+
+def _saved(db, test_run):
+    return {r.question_id: r.response for r in ResponseModel(db).get_responses_by_test_run_id(test_run.id)}
+
+
+@pytest.mark.parametrize("generator_class", [StubGenerator, StubBatchGenerator, StubAsyncGenerator])
+def test_run_saves_a_response_and_contexts_per_question(db, questions, test_run, generator_class):
+    generator = generator_class()
+    assert run_test(db, test_run, questions, generator, concurrency=2, commit_size=2, batch_size=2) == len(questions)
+    assert _saved(db, test_run) == {q.id: f"re: {q.question}" for q in questions}
+    assert sorted(generator.queries) == sorted(q.question for q in questions)
+    for response in ResponseModel(db).get_responses_by_test_run_id(test_run.id):
+        contexts = ContextModel(db).get_contexts_by_response_id(response.id)
+        assert [(c.text, c.node_id) for c in contexts] == [(f"context of {response.response[4:]}", f"node-{response.response[4:]}")]
+
+
+def test_run_resumes_after_the_answered_questions(db, questions, test_run):
+    save_responses(db, test_run.id, [questions[0].id, questions[3].id], ["earlier", "earlier"], [[], []])
+    generator = StubGenerator()
+    assert run_test(db, test_run, questions, generator) == len(questions) - 2
+    assert sorted(generator.queries) == sorted(q.question for i, q in enumerate(questions) if i not in (0, 3))
+    assert _saved(db, test_run)[questions[0].id] == "earlier"
+
+    rerun = StubGenerator()
+    assert run_test(db, test_run, questions, rerun) == 0
+    assert rerun.queries == []
+
+
+def test_short_batch_results_raise(db, questions, test_run):
+    with pytest.raises(ValueError, match="returned 1 responses for 2 queries"):
+        run_test(db, test_run, questions[:2], StubBatchGenerator(drop=1), batch_size=2)
+    assert _saved(db, test_run) == {}
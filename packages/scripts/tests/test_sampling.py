@@ -0,0 +1,62 @@
+import numpy as np
+
+from eval_scripts.sampling import embed_questions, kmeans, medoids
+
+
+def _blobs():
+    rng = np.random.default_rng(0)
+    centers = np.eye(3, dtype=np.float32)
+    points = np.concatenate([center + 0.01 * rng.standard_normal((20, 3)) for center in centers]).astype(np.float32)
+    return centers, points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+def test_kmeans_separates_clusters():
+    centers, points = _blobs()
+    centroids, labels = kmeans(points, 3)
+    assert centroids.shape == (3, 3)
+    # Every blob lands in a cluster of its own
+    assert sorted(len(set(labels[i:i+20])) for i in range(0, 60, 20)) == [1, 1, 1]
+    assert len(set(labels)) == 3
+    for i, center in enumerate(centers):
+        np.testing.assert_allclose(centroids[labels[i * 20]], center, atol=0.05)
+
+
+def test_kmeans_caps_k_at_the_number_of_points():
+    _, points = _blobs()
+    centroids, labels = kmeans(points[:2], 5)
+    assert len(centroids) == 2
+    assert sorted(labels) == [0, 1]
+
+
+def test_medoids_are_the_points_closest_to_each_centroid():
+    _, points = _blobs()
+    centroids, labels = kmeans(points, 3)
+    chosen = medoids(points, centroids, labels)
+    assert len(chosen) == 3
+    for cluster in range(3):
+        members = np.flatnonzero(labels == cluster)
+        expected = members[(points[members] @ centroids[cluster]).argmax()]
+        assert expected in chosen
+
+
+class StubEncoder:
+    model_name = "stub"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        texts = list(texts)
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_question_embeddings_are_stored_apart_from_node_embeddings(db, questions):
+    encoder = StubEncoder()
+    first = embed_questions(db, questions[:3], encoder)
+    again = embed_questions(db, questions[:4], encoder)
+    np.testing.assert_allclose(again[:3], first)
+    # Only the new question is encoded the second time
+    assert encoder.encoded == [q.question for q in questions[:4]]
+    assert db.execute('SELECT COUNT(*) FROM question_embeddings').fetchone()[0] == 4
+    assert db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0] == 0
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+# The sweep builds llama_index nodes and imports the retriever, which pulls in the ragas based generator interface
+pytest.importorskip("llama_index.core")
+pytest.importorskip("ragas")
+
+from llama_index.core.schema import TextNode
+
+from eval_data.models.response import ResponseModel
+from eval_scripts import sweep
+from eval_scripts.embeddings import MODEL_NAME
+
+
+class StubEncoder:
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+
+    def encode(self, texts):
+        return np.ones((len(texts), 2), dtype=np.float32)
+
+
+class StubIndex:
+    """ Stands in for NumpyRetriever: records the nodes each index is built on and embeds them in place, as embed_nodes does. """
+    builds = []
+
+    def __init__(self, nodes, similarity_top_k, encoder, db=None, snapshot=None):
+        StubIndex.builds.append((encoder.model_name, nodes, [node.embedding for node in nodes]))
+        for i, node in enumerate(nodes):
+            node.embedding = [1.0, float(i)]
+        self.matrix = sweep.normalize(np.array([node.embedding for node in nodes], dtype=np.float32))
+
+
+@pytest.fixture
+def stub_index(monkeypatch):
+    StubIndex.builds = []
+    monkeypatch.setattr(sweep, "NumpyRetriever", StubIndex)
+    monkeypatch.setattr(sweep, "get_encoder", StubEncoder)
+    monkeypatch.setattr(sweep, "Encoder", StubEncoder)
+    return StubIndex
+
+
+def test_each_index_builds_on_copies_of_the_nodes(db, questions, stub_index):
+    nodes = [TextNode(text="alpha", id_="n0", embedding=[0.0, 1.0]), TextNode(text="beta", id_="n1")]
+    grid = {"embed_model": [MODEL_NAME, "other-model"], "similarity_top_k": [1, 2]}
+
+    test_runs = sweep.run_sweep(db, 1, nodes, questions, grid)
+
+    # One index per embed model, each over nodes of its own
+    assert [model for model, _, _ in stub_index.builds] == [MODEL_NAME, "other-model"]
+    built = [node for _, index_nodes, _ in stub_index.builds for node in index_nodes]
+    assert len({id(node) for node in built}) == len(built) == 4
+    assert not {id(node) for node in built} & {id(node) for node in nodes}
+    # Vectors the nodes carry are only reused by the default model
+    assert [embeddings for _, _, embeddings in stub_index.builds] == [[[0.0, 1.0], None], [None, None]]
+    # The caller's nodes are untouched
+    assert [node.embedding for node in nodes] == [[0.0, 1.0], None]
+
+    response_model = ResponseModel(db)
+    assert len(test_runs) == 4
+    for test_run in test_runs:
+        assert response_model.get_answered_question_ids(test_run.id) == {q.id for q in questions}